@@ -1,5 +1,9 @@
 __version__ = "5.0"
 __all__ = [
+    "aio",
     "classes",
+    "columns",
     "functions"
-]
\ No newline at end of file
+]
+
+from printhead.functions import columns
@@ -24,9 +24,24 @@ import getopt
 from printhead.functions import *
 
 def main(args=sys.argv[1:]):
-        opts, args = getopt.getopt(args, "s:H:x:M:m:peSctqh",
+        if len(args) > 0 and args[0] in ('index', 'query', 'load', 'census'):
+            try:
+                if args[0] == 'index':
+                    indexMain(args[1:])
+                elif args[0] == 'load':
+                    loadMain(args[1:])
+                elif args[0] == 'census':
+                    censusMain(args[1:])
+                else:
+                    queryMain(args[1:])
+            except Exception as e:
+                errMsg = "Problem with %s: %s" % (args[0], str(e))
+                print(errMsg)
+            return
+        opts, args = getopt.getopt(args, "s:H:x:M:m:j:w:r:peSctqh",
                                    ["parse", "extract", "skey=", "header=", "xml=", "struct", "merge=",
-                                    "mode=", "check", "tsv", "quiet", "help"])
+                                    "mode=", "check", "tsv", "quiet", "help", "cache=", "jobs=",
+                                    "where=", "recursive=", "pattern=", "files-from="])
         _VERBOSE_ = 1
 
         xtract = 0
@@ -42,9 +57,16 @@ def main(args=sys.argv[1:]):
         hfl = 0
         breakfl = 0
         mode = 1
+        cache = ''
+        jobs = 1
+        where = None
+        roots = []
+        patterns = None
+        filesfrom = None
 
         while True:
-            if len(args) == 0:
+            if len(args) == 0 and not [o for (o, v) in opts
+                                       if o in ("-r", "--recursive", "--files-from")]:
                 usage()
                 break
     #            sys.exit()
@@ -96,64 +118,64 @@ def main(args=sys.argv[1:]):
                     if o in ("-h", "--help"):
                         usage()
                         breakfl = 1
+                    if o == "--cache":
+                        cache = v
+                    if o in ("-j", "--jobs"):
+                        jobs = int(v)
+                    if o in ("-w", "--where"):
+                        where = KeyFilter.compiled(v)
+                    if o in ("-r", "--recursive"):
+                        roots.append(v)
+                    if o == "--pattern":
+                        patterns = tuple([pat.strip() for pat in v.split(',') if pat.strip()])
+                    if o == "--files-from":
+                        filesfrom = v
             except Exception as e:
                 errMsg = "Problem parsing command line options: %s" % str(e)
                 print(errMsg)
                 break
+            if roots or filesfrom:
+                args = fileNames(args, roots=roots, patterns=patterns, filesfrom=filesfrom)
             try:
                 if tsv == 1:
                     head = int(show)
                     if head < 0:
                             head = 0
-                    (pH, lines) = tsvFunc(args, skey=skey, header=head, mode=mode)
-                    for l in lines:
-                        print(l[:-1])  # don't print the \n
+                    tsvWrite(args, skey=skey, header=head, mode=mode, cache=cache,
+                             jobs=jobs, where=where)
 
                 elif xtract == 1:
                     if xmlfl != '':
                         xtract = 0
-                    for f in args:
-                        pH = hdrExtract(f, xmlfl=xmlfl, show=show,
-                                        xtract=xtract, mode=mode)
+                    pH = hdrExtract(args, xmlfl=xmlfl, show=show, xtract=xtract,
+                                    mode=mode, cache=cache, jobs=jobs, where=where)
                 elif skeyfl == 1:
-                    for f in args:
-                        head = int(show)
-                        if head < 0:
-                                head = 0
-                        pH = run([f], skey=skey, header=head, mode=mode, struct=struct, check=check)
+                    head = int(show)
+                    if head < 0:
+                            head = 0
+                    pH = run(args, skey=skey, header=head, mode=mode, struct=struct, check=check,
+                             cache=cache, jobs=jobs, where=where, hcache=0)
                 elif xmlfl != '':
                     struct = 1
-                    for f in args:
-                        pH = FitsHead(f, skey=skey, show=show, struct=struct,
-                                      check=check, mode=mode)
-                        pH.fd.close()
-                        pH.parseFitsHead()
-                        XmlHead = pH.xmlHead(format=xmlfl, head=show)
-                        for xml in XmlHead:
-                            if type(xml) == type(''):
-                                print(xml + "\n")
-                            elif type(xml) == type([]):
-                                print('\n'.join(xml))
+                    for (f, res, err) in mapFiles(xmlFile, args, jobs=jobs, xmlfl=xmlfl,
+                                                  skey=skey, show=show, struct=struct,
+                                                  check=check, mode=mode, where=where):
+                        if err is not None:
+                            raise err
+                        writeOutput(res)
 
                 elif struct > 0:
                     if mergefl == 0:
-                        for f in args:
-                            pH = FitsHead(f, struct=struct, check=check, verbose=0,
-                                          show=show, mode=mode)
-                            if show == -99:
-                                output = '\n'.join(pH.STRUCT)
-                            elif show == 99:
-                                output = ''.join(pH.HEAD)
-                            elif show >= 0 and show <= len(pH.HEAD):
-                                output = pH.HEAD[show]
-                            else:
-                                output = "Invalid header number specified. Should be: [0-%d,99]" % \
-                                    (len(pH.HEAD)-1)
-                            print(output)
+                        for (f, res, err) in mapFiles(structFile, args, jobs=jobs,
+                                                      show=show, struct=struct, check=check,
+                                                      mode=mode, cache=cache, where=where):
+                            if err is not None:
+                                raise err
+                            writeOutput(res)
                 elif breakfl == 1:
                     break
                 else:
-                   pH = run(args)
+                   pH = run(args, jobs=jobs, where=where, hcache=0)
                 break
             except Exception as e:
                errMsg = "Problem extracting headers: %s" % str(e)
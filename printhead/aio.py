@@ -0,0 +1,124 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+####
+# asyncio interface for reading the headers of many files
+###
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from printhead.classes.FitsHead import FitsHead
+
+
+def readFile(name, show=99, mode=1, cache='', lazy=0):
+    """
+    Blocking read of the headers of a single file, executed in a worker
+    thread by read_headers.
+
+    INPUT:     string, file name
+               further attributes as for read_headers
+    OUTPUT:    list of HeadDict instances, one per HDU
+    """
+    pH = FitsHead(name, struct=1, show=show, mode=mode, cache=cache)
+    pH.close()
+    pH.parseFitsHead(lazy=lazy)
+    return pH.Extension
+
+
+async def read_headers(paths, limit=64, ordered=0, errors='raise', show=99, mode=1,
+                       cache='', lazy=0, executor=None):
+    """
+    Asynchronous generator producing the tuples (<file name>, <list of HeadDict>)
+    for all files in <paths>, e.g.
+
+        async for fname, hdus in printhead.aio.read_headers(paths, limit=64):
+            print(fname, hdus[0].getKeyword('EXPTIME')[1])
+
+    The files are read and parsed by FitsHead in a thread pool, thus the
+    event loop is never blocked and the latency of many files overlaps.
+    Never more than <limit> files are in flight (or, for ordered, waiting
+    to be produced), which bounds both the load on the file system and
+    the memory use, also for very long iterables <paths>.
+
+    INPUT:     iterable of strings, file names
+               int attribute limit, maximum number of files in flight, default 64
+               int attribute ordered, if 1 the results are produced in the order
+                              of <paths>, otherwise in the order of completion,
+                              default 0, optional
+               string attribute errors, 'raise' (default) to raise the exception of
+                              a failing file, 'return' to produce it in place of
+                              the list of HeadDict instances, optional
+               int attribute show, header(s) to read, 99 for all, default 99, optional
+               int attribute mode, see FitsHead, default 1, optional
+               string attribute cache, directory of the structure cache, optional
+               int attribute lazy, create LazyHeadDict instances, default 0, optional
+               Executor attribute executor, used instead of a private thread
+                              pool with <limit> threads, optional
+    OUTPUT:    tuples, (<file name>, <list of HeadDict instances or exception>)
+    """
+    if limit < 1:
+        errMsg = "limit has to be at least 1, got %d" % limit
+        raise Exception(errMsg)
+    if errors not in ('raise', 'return'):
+        errMsg = "errors has to be 'raise' or 'return', got %s" % errors
+        raise Exception(errMsg)
+    loop = asyncio.get_running_loop()
+    private = executor is None
+    if private:
+        executor = ThreadPoolExecutor(max_workers=limit)
+    read = partial(readFile, show=show, mode=mode, cache=cache, lazy=lazy)
+    names = iter(paths)
+    pending = {}                     # future -> (sequence number, file name)
+    done = {}                        # sequence number -> result, ordered only
+    seq = 0
+    nxt = 0
+    more = 1
+    try:
+        while True:
+            while more and len(pending) + len(done) < limit:
+                try:
+                    name = next(names)
+                except StopIteration:
+                    more = 0
+                    break
+                pending[loop.run_in_executor(executor, read, name)] = (seq, name)
+                seq += 1
+            if not pending:
+                break
+            finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in finished:
+                (ind, name) = pending.pop(fut)
+                try:
+                    hdus = fut.result()
+                except Exception as e:
+                    if errors == 'raise':
+                        raise
+                    hdus = e
+                if ordered:
+                    done[ind] = (name, hdus)
+                else:
+                    yield (name, hdus)
+            while nxt in done:
+                yield done.pop(nxt)
+                nxt += 1
+    finally:
+        for fut in pending:
+            fut.cancel()
+        if private:
+            executor.shutdown(wait=False)
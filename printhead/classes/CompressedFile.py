@@ -0,0 +1,283 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import zlib
+
+_GZIP_MAGIC_ = b'\x1f\x8b'
+_LZW_MAGIC_ = b'\x1f\x9d'
+
+
+class LzwDecompressor:
+    """
+    Incremental decoder for the LZW format written by the UNIX compress
+    utility (.Z files). The interface mimics the zlib decompression objects,
+    i.e. compressed data is passed to decompress() in arbitrary pieces and
+    the decoded bytes available so far are returned.
+
+    Codes are stored LSB first in groups of eight codes. Whenever the code
+    width changes or the table is cleared the encoder pads to the end of
+    the current group, which is replicated here by counting the codes read
+    since the last width change.
+    """
+
+    def __init__(self):
+        """
+        """
+        self.eof = False
+        self.unused_data = b''
+        self.unconsumed_tail = b''
+        self.inbuf = bytearray()
+        self.bitpos = 0              # bit position of the next code in inbuf
+        self.maxbits = 0             # 0 as long as the header is not read
+        self.blockMode = 0
+        self.nbits = 9
+        self.maxcode = (1 << 9) - 1
+        self.maxmaxcode = 0
+        self.ncodes = 0              # codes read with the current width
+        self.oldcode = -1
+        self.table = []
+
+
+    def resetTable(self):
+        """
+        Initialise the string table with the 256 single byte entries.
+        """
+        self.table = [bytes(bytearray([ii])) for ii in range(256)]
+        if self.blockMode:
+            self.table.append(b'')   # code 256 is the CLEAR code
+
+
+    def alignGroup(self):
+        """
+        Skip the padding the encoder adds up to the end of a group of
+        eight codes.
+        """
+        rest = self.ncodes % 8
+        if rest:
+            self.bitpos += (8 - rest) * self.nbits
+        self.ncodes = 0
+
+
+    def decompress(self, data, max_length=0):
+        """
+        Decode the next piece of compressed data.
+
+        INPUT:     bytes, compressed data
+                   int attribute max_length, ignored, accepted for compatibility
+                                             with the zlib objects
+        OUTPUT:    bytes, decoded data
+        """
+        self.inbuf.extend(data)
+        if not self.maxbits:
+            if len(self.inbuf) < 3:
+                return b''
+            if bytes(self.inbuf[:2]) != _LZW_MAGIC_:
+                raise Exception("Not in UNIX compress (.Z) format")
+            flags = self.inbuf[2]
+            self.maxbits = flags & 0x1f
+            self.blockMode = flags & 0x80
+            self.maxmaxcode = 1 << self.maxbits
+            self.resetTable()
+            self.bitpos = 24
+
+        inbuf = self.inbuf
+        table = self.table
+        out = []
+        nbits = self.nbits
+        mask = (1 << nbits) - 1
+        avail = len(inbuf) * 8
+        while True:
+            if len(table) > self.maxcode:
+                self.alignGroup()
+                nbits += 1
+                self.nbits = nbits
+                mask = (1 << nbits) - 1
+                if nbits == self.maxbits:
+                    self.maxcode = self.maxmaxcode
+                else:
+                    self.maxcode = mask
+                continue
+            if self.bitpos + nbits > avail:
+                break
+            bp = self.bitpos
+            ind = bp >> 3
+            code = (int.from_bytes(inbuf[ind:ind+3], 'little') >> (bp & 7)) & mask
+            self.bitpos = bp + nbits
+            self.ncodes += 1
+
+            if self.oldcode == -1:
+                if code >= 256:
+                    raise Exception("Corrupt compressed (.Z) data")
+                self.oldcode = code
+                out.append(table[code])
+                continue
+            if code == 256 and self.blockMode:
+                del table[256:]
+                self.oldcode = -2    # the next entry is a dummy at the CLEAR code
+                self.alignGroup()
+                nbits = 9
+                self.nbits = nbits
+                mask = (1 << nbits) - 1
+                self.maxcode = mask
+                continue
+
+            if code < len(table):
+                entry = table[code]
+            elif code == len(table):
+                entry = table[self.oldcode] + table[self.oldcode][:1]
+            else:
+                raise Exception("Corrupt compressed (.Z) data")
+            out.append(entry)
+            if self.oldcode == -2:
+                table.append(b'')
+            elif len(table) < self.maxmaxcode:
+                table.append(table[self.oldcode] + entry[:1])
+            self.oldcode = code
+
+        drop = min(self.bitpos >> 3, len(inbuf))
+        del inbuf[:drop]
+        self.bitpos -= drop * 8
+        return b''.join(out)
+
+
+    def flush(self):
+        """
+        Signal the end of the input. Incomplete codes at the end are dropped.
+        """
+        self.eof = True
+        return b''
+
+
+
+class CompressedFile:
+    """
+    Read-only file object decompressing gzip (.gz) and UNIX compress (.Z)
+    files in-process. Data is only decompressed as far as it has been
+    requested by read() or seek(), thus reading the first header of a huge
+    compressed file inflates only a few blocks.
+
+    The stream is not seekable in the usual sense: seeking forward decompresses
+    and discards the data in between, seeking backward restarts decompression
+    from the beginning of the file.
+    """
+
+    _CHUNKSIZE_ = 65536
+
+    def __init__(self, name):
+        """
+        INPUT:     string, name of the compressed file
+        """
+        self.name = name
+        self.raw = open(name, 'rb')
+        self.closed = False
+        self.reset()
+
+
+    def reset(self):
+        """
+        Start decompression from the beginning of the file.
+        """
+        self.raw.seek(0, 0)
+        magic = self.raw.read(2)
+        self.raw.seek(0, 0)
+        if magic == _GZIP_MAGIC_:
+            self.newDecompressor = lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.chunksize = self._CHUNKSIZE_
+        elif magic == _LZW_MAGIC_:
+            self.newDecompressor = LzwDecompressor
+            self.chunksize = 4096    # the LZW decoder does not limit its output
+        else:
+            raise Exception("File %s is neither in gzip nor in compress format" % self.name)
+        self.dec = self.newDecompressor()
+        self.out = bytearray()       # decompressed but not yet consumed data
+        self.pos = 0                 # position in the decompressed stream
+        self.eof = False
+
+
+    def fill(self, size):
+        """
+        Decompress until at least <size> bytes are buffered or the end of
+        the file is reached.
+        """
+        while len(self.out) < size and not self.eof:
+            data = self.dec.unconsumed_tail
+            if not data:
+                data = self.raw.read(self.chunksize)
+            if not data:
+                self.out.extend(self.dec.flush())
+                self.eof = True
+                break
+            self.out.extend(self.dec.decompress(data, max(size - len(self.out), 2880)))
+            if self.dec.eof and self.dec.unused_data:
+                # concatenated gzip members
+                rest = self.dec.unused_data
+                if not rest.strip(b'\0'):
+                    continue       # zero padding after the last member
+                self.dec = self.newDecompressor()
+                self.out.extend(self.dec.decompress(rest, max(size - len(self.out), 2880)))
+
+
+    def read(self, size=-1):
+        """
+        Read up to <size> bytes of decompressed data, all remaining data if
+        <size> is negative.
+        """
+        if size is None or size < 0:
+            while not self.eof:
+                self.fill(len(self.out) + self.chunksize)
+            size = len(self.out)
+        else:
+            self.fill(size)
+        data = bytes(self.out[:size])
+        del self.out[:size]
+        self.pos += len(data)
+        return data
+
+
+    def seek(self, offset, whence=0):
+        """
+        Move to position <offset> of the decompressed stream, relative to
+        the start (whence=0) or the current position (whence=1).
+        """
+        if whence == 1:
+            offset = self.pos + offset
+        elif whence != 0:
+            raise Exception("CompressedFile does not support seeking from the end")
+        if offset < self.pos:
+            self.reset()
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, self._CHUNKSIZE_)):
+                break
+        return self.pos
+
+
+    def tell(self):
+        """
+        Return the position in the decompressed stream.
+        """
+        return self.pos
+
+
+    def close(self):
+        """
+        Close the underlying file.
+        """
+        self.raw.close()
+        self.out = bytearray()
+        self.closed = True
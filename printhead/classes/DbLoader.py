@@ -0,0 +1,216 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import sys
+import re
+import sqlite3
+
+# columns of the DBCM rows produced by FitsHead.parseFitsHead2TupleList(forceString=2)
+_COLUMNS_ = ('file_prefix', 'file_id', 'ext', 'key_ind', 'key', 'value', 'comment',
+             'type', 'value_num', 'value_dt')
+_TYPES_ = ('TEXT', 'TEXT', 'INTEGER', 'INTEGER', 'TEXT', 'TEXT', 'TEXT',
+           'TEXT', 'REAL', 'TEXT')
+_BATCH_ = 5000                   # rows per executemany call
+_COMMIT_ = 200000                # rows per transaction
+_TABLE_ = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')   # valid table names
+_SYNC_ = ('OFF', 'NORMAL', 'FULL', 'EXTRA')        # values of the synchronous pragma
+
+
+def sqliteConnect(dbname, sync='OFF'):
+    """
+    Open a SQLite database tuned for bulk loading: write ahead log and
+    relaxed synchronisation. The DbLoader takes care of the transactions.
+
+    INPUT:     string, name of the database file, created if it does not exist
+               string attribute sync, value of the synchronous pragma, one of
+                                 OFF, NORMAL, FULL or EXTRA, default 'OFF'
+    OUTPUT:    sqlite3 connection
+    """
+    if str(sync).upper() not in _SYNC_:
+        errMsg = "Invalid value of the synchronous pragma: %s" % sync
+        raise Exception(errMsg)
+    sync = str(sync).upper()
+    conn = sqlite3.connect(dbname)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = %s" % sync)
+    return conn
+
+
+class DbLoader:
+    """
+    Bulk loader writing the DBCM rows of FitsHead.parseFitsHead2TupleList(forceString=2)
+    into a database table through any DB-API 2.0 connection.
+
+    Rows are collected into batches of <batch> rows, each one inserted with a
+    single executemany call of the same INSERT statement, which the database
+    modules prepare once and reuse. A transaction is committed only every
+    <commit> rows and at the end, rather than per file or per row.
+
+    The loader is meant to be used by a single writer, typically consuming the
+    results of parsing workers, see functions.dbLoad.
+    """
+
+    def __init__(self, conn, table='dbcm', batch=_BATCH_, commit=_COMMIT_,
+                 paramstyle=None, create=1):
+        """
+        INPUT:     DB-API connection, e.g. sqliteConnect(<file name>)
+                   string attribute table, name of the table, letters, digits
+                                    and underscores only, default 'dbcm'
+                   int attribute batch, rows per executemany call, optional
+                   int attribute commit, rows per transaction, optional
+                   string attribute paramstyle, DB-API paramstyle of the module
+                                    of <conn>, default: derived from the
+                                    connection, 'qmark' if unknown
+                   int attribute create, create the table if it does not exist, default 1
+        """
+        if not isinstance(table, str) or not _TABLE_.match(table):
+            errMsg = "Invalid table name: %s" % table
+            raise Exception(errMsg)
+        self.conn = conn
+        self.table = table
+        self.batch = max(1, batch)
+        self.commitRows = max(self.batch, commit)
+        if paramstyle is None:
+            paramstyle = self.paramStyle(conn)
+        self.paramstyle = paramstyle
+        self.named = paramstyle in ('named', 'pyformat')
+        self.cursor = conn.cursor()
+        self.stmt = self.insertStatement()
+        self.rows = []
+        self.pending = 0                 # rows written since the last commit
+        self.nrows = 0
+        self.nfiles = 0
+        if create:
+            self.createTable()
+
+
+    def paramStyle(self, conn):
+        """
+        Return the paramstyle attribute of the DB-API module of <conn>.
+        """
+        module = sys.modules.get(type(conn).__module__.split('.')[0])
+        for mod in (module, sys.modules.get(type(conn).__module__)):
+            style = getattr(mod, 'paramstyle', None)
+            if style:
+                return style
+        return 'qmark'
+
+
+    def insertStatement(self):
+        """
+        Return the INSERT statement for one row in the paramstyle of the connection.
+        """
+        if self.paramstyle == 'qmark':
+            marks = ['?'] * len(_COLUMNS_)
+        elif self.paramstyle == 'numeric':
+            marks = [':%d' % (ii + 1) for ii in range(len(_COLUMNS_))]
+        elif self.paramstyle == 'named':
+            marks = [':%s' % col for col in _COLUMNS_]
+        elif self.paramstyle == 'format':
+            marks = ['%s'] * len(_COLUMNS_)
+        elif self.paramstyle == 'pyformat':
+            marks = ['%%(%s)s' % col for col in _COLUMNS_]
+        else:
+            errMsg = "Unsupported paramstyle: %s" % self.paramstyle
+            raise Exception(errMsg)
+        return "INSERT INTO %s (%s) VALUES (%s)" % (self.table, ', '.join(_COLUMNS_),
+                                                   ', '.join(marks))
+
+
+    def createTable(self):
+        """
+        Create the table and commit, if it does not exist yet.
+        """
+        cols = ', '.join(['%s %s' % (col, typ) for (col, typ) in zip(_COLUMNS_, _TYPES_)])
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (self.table, cols))
+        self.conn.commit()
+
+
+    def convertRow(self, row):
+        """
+        Convert a DBCM row of strings into the column types of the table:
+        integer HDU and card indices, float numeric values and None for
+        missing numeric and datetime values.
+        """
+        num = row[8]
+        if num != '':
+            try:
+                num = float(num)
+            except ValueError:
+                num = None
+        else:
+            num = None
+        row = (row[0], row[1], int(row[2]), int(row[3]), row[4], row[5], row[6], row[7],
+               num, row[9] or None)
+        if self.named:
+            return dict(zip(_COLUMNS_, row))
+        return row
+
+
+    def add(self, rows):
+        """
+        Add the DBCM rows <rows> of one file, writing full batches.
+
+        INPUT:     list of DBCM tuples, or list of lists of DBCM tuples
+                   (one per HDU) as returned by parseFitsHead2TupleList
+        """
+        for row in rows:
+            if isinstance(row, list):
+                self.rows.extend([self.convertRow(rr) for rr in row])
+            else:
+                self.rows.append(self.convertRow(row))
+            if len(self.rows) >= self.batch:
+                self.flush(commit=0)
+        self.nfiles += 1
+
+
+    def flush(self, commit=1):
+        """
+        Write the collected rows and commit if <commit> is set or enough
+        rows have been written since the last commit.
+        """
+        if self.rows:
+            self.cursor.executemany(self.stmt, self.rows)
+            self.nrows += len(self.rows)
+            self.pending += len(self.rows)
+            self.rows = []
+        if self.pending and (commit or self.pending >= self.commitRows):
+            self.conn.commit()
+            self.pending = 0
+
+
+    def close(self):
+        """
+        Write the remaining rows and commit. The connection stays open.
+        """
+        self.flush()
+        self.cursor.close()
+
+
+    def load(self, results):
+        """
+        Load the rows of all files produced by the iterable <results>.
+
+        INPUT:     iterable of lists of DBCM rows, one list per file
+        OUTPUT:    tuple, (<number of files>, <number of rows>)
+        """
+        for rows in results:
+            self.add(rows)
+        self.close()
+        return (self.nfiles, self.nrows)
@@ -0,0 +1,141 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import os
+import sys
+from fnmatch import fnmatch
+
+# default file name patterns
+_PATTERNS_ = ('*.fits', '*.fit', '*.fts', '*.fits.gz', '*.fits.Z', '*.fit.gz', '*.fit.Z')
+_CHUNKSIZE_ = 65536              # bytes read at once from a file list
+
+
+class FileWalker:
+    """
+    Iterable producing the names of the files to be processed from
+
+        the directory trees below <roots>: all files whose names match one of
+        <patterns>, in sorted order per directory. Plain files given as roots
+        are produced as they are.
+        the file <filesfrom> ('-' for stdin) containing NUL separated file
+        names, e.g. the output of find -print0.
+
+    The directories are read with os.scandir, i.e. the type of the entries
+    is usually known without a stat call per file, and patterns of the form
+    '*<suffix>' are matched by a plain suffix comparison. The names are
+    produced while the trees and the list are read, thus the processing of
+    the first files overlaps with the discovery of the others.
+    """
+
+    def __init__(self, roots=(), patterns=_PATTERNS_, filesfrom=None):
+        """
+        INPUT:     list of strings attribute roots, directories, default none
+                   list of strings attribute patterns, file name patterns,
+                                   default *.fits, *.fit, *.fts and their .gz
+                                   and .Z versions, optional
+                   string attribute filesfrom, name of a file containing NUL
+                                   separated file names, '-' for stdin, optional
+        """
+        self.roots = list(roots)
+        self.patterns = tuple(patterns)
+        self.filesfrom = filesfrom
+        suffixes = []                # '*<suffix>' patterns
+        others = []
+        for pat in self.patterns:
+            if pat.startswith('*') and not [c for c in pat[1:] if c in '*?[']:
+                suffixes.append(pat[1:])
+            else:
+                others.append(pat)
+        self.suffixes = tuple(suffixes)
+        self.others = tuple(others)
+
+
+    def __iter__(self):
+        for root in self.roots:
+            if os.path.isdir(root):
+                for name in self.walk(root):
+                    yield name
+            else:
+                yield root
+        if self.filesfrom:
+            for name in self.readList(self.filesfrom):
+                yield name
+
+
+    def match(self, fname):
+        """
+        Return True if the file name <fname> matches one of the patterns.
+        """
+        if fname.endswith(self.suffixes):
+            return True
+        for pattern in self.others:
+            if fnmatch(fname, pattern):
+                return True
+        return False
+
+
+    def walk(self, root):
+        """
+        Generator producing the paths of all matching files below the
+        directory <root>, depth first. Symbolic links to directories are not
+        followed and unreadable directories are skipped.
+        """
+        try:
+            entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+        except OSError:
+            return
+        dirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif self.match(entry.name) and entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+        for path in dirs:
+            for name in self.walk(path):
+                yield name
+
+
+    def readList(self, fname):
+        """
+        Generator producing the NUL separated file names read from the file
+        <fname> ('-' for stdin) chunk by chunk.
+        """
+        if fname == '-':
+            fd = getattr(sys.stdin, 'buffer', sys.stdin)
+        else:
+            fd = open(fname, 'rb')
+        try:
+            rest = b''
+            while True:
+                chunk = fd.read(_CHUNKSIZE_)
+                if not chunk:
+                    break
+                names = (rest + chunk).split(b'\0')
+                rest = names.pop()
+                for name in names:
+                    if name:
+                        yield os.fsdecode(name)
+            if rest.strip(b'\n'):
+                yield os.fsdecode(rest.strip(b'\n'))
+        finally:
+            if fd is not getattr(sys.stdin, 'buffer', sys.stdin):
+                fd.close()
@@ -0,0 +1,169 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_MASK_ = 0xFFFFFFFF
+_CARDSIZE_ = 80
+# characters excluded from the ASCII encoding of the CHECKSUM value
+_EXCLUDE_ = (0x3a, 0x3b, 0x3c, 0x3d, 0x3e, 0x3f, 0x40, 0x5b, 0x5c, 0x5d, 0x5e, 0x5f, 0x60)
+
+
+class FitsChecksum:
+    """
+    Computation and verification of the FITS standard DATASUM and CHECKSUM
+    keywords, i.e. of the 32-bit ones' complement sums of the big-endian
+    words of the data part and of the whole HDU.
+
+    The sums are calculated on large chunks at once: with NumPy (if it is
+    installed) as a vectorized sum of the words, else by reducing the chunk
+    read as one big-endian integer modulo 2**32-1, which equals the ones'
+    complement sum of its words. A single shared instance is available as
+    FitsChecksum.shared.
+    """
+
+    def __init__(self, usenumpy=1):
+        """
+        INPUT:     int attribute usenumpy, use NumPy if available, default 1, optional
+        """
+        self.numpy = numpy if usenumpy else None
+
+
+    def add(self, a, b):
+        """
+        Return the ones' complement sum of the 32-bit values <a> and <b>.
+        """
+        s = a + b
+        return (s & _MASK_) + (s >> 32)
+
+
+    def sum(self, data, total=0):
+        """
+        Add the big-endian 32-bit words of <data> to the running ones'
+        complement sum <total>.
+
+        INPUT:     bytes-like, length has to be a multiple of 4
+                   int attribute total, sum of the preceding data, default 0, optional
+        OUTPUT:    int, ones' complement sum
+        """
+        if len(data) % 4:
+            errMsg = "Checksum data length %d is not a multiple of 4" % len(data)
+            raise Exception(errMsg)
+        if self.numpy is not None:
+            nn = int(self.numpy.frombuffer(data, dtype='>u4').sum(dtype=self.numpy.uint64))
+        else:
+            nn = int.from_bytes(data, 'big')
+            bits = len(data) * 8
+            while bits > 64:         # fold halves, 2**32 == 1 modulo 2**32-1
+                half = (bits // 64) * 32
+                nn = (nn >> half) + (nn & ((1 << half) - 1))
+                bits = max(bits - half, half) + 1
+        if nn == 0:
+            return total
+        nn = nn % _MASK_ or _MASK_   # only all-zero data sums up to +0
+        return self.add(total, nn)
+
+
+    def headerValues(self, head):
+        """
+        Return the values of the DATASUM and CHECKSUM cards of the raw header
+        <head> as the tuple (<DATASUM or None>, <CHECKSUM or None>).
+        """
+        head = bytes(head)
+        values = [None, None]
+        for (ii, key) in enumerate((b'DATASUM ', b'CHECKSUM')):
+            ind = head.find(key)
+            while ind >= 0 and ind % _CARDSIZE_:
+                ind = head.find(key, ind + 1)
+            if ind >= 0:
+                val = head[ind+10:ind+_CARDSIZE_].split(b'/')[0].strip()
+                values[ii] = val.strip(b"'").strip().decode('latin-1')
+        return tuple(values)
+
+
+    def verify(self, head, datasum, hdrsum=None):
+        """
+        Verify the DATASUM and CHECKSUM keywords of the raw header <head>
+        against the ones' complement sum <datasum> of the data part.
+
+        INPUT:     bytes-like, complete header blocks
+                   int, ones' complement sum of the data part
+                   int attribute hdrsum, sum of <head> if known, optional
+        OUTPUT:    tuple, (<DATASUM status>, <CHECKSUM status>) where the status
+                   is 1 if the keyword matches, 0 if it does not and -1 if the
+                   keyword is missing
+        """
+        (dsum, csum) = self.headerValues(head)
+        dstat = cstat = -1
+        if dsum is not None:
+            try:
+                dstat = int(int(dsum) == datasum)
+            except ValueError:
+                dstat = 0
+        if csum is not None:
+            if hdrsum is None:
+                hdrsum = self.sum(bytes(head))
+            cstat = int(self.add(hdrsum, datasum) == _MASK_)
+        return (dstat, cstat)
+
+
+    def checksum(self, head, datasum):
+        """
+        Return the value of the CHECKSUM keyword for the raw header <head>,
+        which must contain the CHECKSUM card and the DATASUM card matching
+        <datasum>, or None if there is no CHECKSUM card.
+        """
+        head = bytearray(head)
+        ind = head.find(b'CHECKSUM')
+        while ind >= 0 and ind % _CARDSIZE_:
+            ind = head.find(b'CHECKSUM', ind + 1)
+        if ind < 0:
+            return None
+        head[ind+10:ind+28] = b"'0000000000000000'"
+        return self.encode(self.add(self.sum(head), datasum) ^ _MASK_)
+
+
+    def encode(self, value):
+        """
+        Return the 16 character ASCII encoding of the 32-bit <value> as used
+        for the CHECKSUM keyword.
+        """
+        asc = [0] * 16
+        for ii in range(4):
+            byte = (value >> (8 * (3 - ii))) & 0xFF
+            ch = [byte // 4 + 0x30] * 4
+            ch[0] += byte % 4
+            check = 1
+            while check:
+                check = 0
+                for jj in (0, 2):
+                    if ch[jj] in _EXCLUDE_ or ch[jj+1] in _EXCLUDE_:
+                        ch[jj] += 1
+                        ch[jj+1] -= 1
+                        check = 1
+            for jj in range(4):
+                asc[4*jj + ii] = ch[jj]
+        return bytes(asc[15:] + asc[:15]).decode('ascii')
+
+
+
+FitsChecksum.shared = FitsChecksum()
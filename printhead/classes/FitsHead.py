@@ -41,12 +41,24 @@ from printhead import __version__
 import sys
 import os
 import types
-import subprocess
 import string,re
-from glob import glob
-from zlib import crc32
+import mmap
 from math import ceil
+from array import array
+from printhead.classes.HeadBuffer import HeadBuffer
 from printhead.classes.HeadDict import HeadDict
+from printhead.classes.KeyFilter import KeyFilter
+from printhead.classes.KeyType import KeyType
+from printhead.classes.LazyHeadDict import LazyHeadDict
+from printhead.classes.XmlWriter import XmlWriter
+from printhead.classes.CompressedFile import CompressedFile
+from printhead.classes.FitsChecksum import FitsChecksum
+from printhead.classes.StructCache import StructCache
+from printhead.classes.StructScan import StructScan, dataCrc, dataSums, findEnd
+
+_SPECIAL_RX_ = re.compile('^COMMENT|HISTORY|END|ESO-LOG')  # these are the special keywords
+_SPECIAL_KEYS_ = ('COMMENT', 'HISTORY', 'END', 'ESO-LOG')
+_QUOTE_RX_ = re.compile("'(''|[^'])*'")  # this allows to catch crazy keyword values like "'o''Neill'"
 
 if sys.version_info.major == 3:
     PY_VERSION = 3
@@ -64,22 +76,48 @@ class FitsHead:
     for more details just call the usage function or run the
     script without parameters.
     """
-    def __init__(self,file,skey='END',struct=0,show=0,check=0, verbose=0, mode=1):
+    def __init__(self,file,skey='END',struct=0,show=0,check=0, verbose=0, mode=1, memmap=1,
+                 cache='', where=None):
         """
+        If memmap is 1 (default) plain local files are memory-mapped and the
+        headers and data are accessed directly on the mapped buffer.
+        If cache is the name of a directory (or a StructCache instance) the
+        structure of the file is kept there and reused as long as the file
+        does not change.
+        If where is a filter expression (or a KeyFilter instance) it is
+        tested while the headers are read. The headers which do not match
+        are not kept (empty entries in self.HEAD), see matchHeads.
         """
         self.verbose = int(verbose)
         self.nbytes = 0             # number of bytes read so far
+        self.memmap = int(memmap)    # use a memory-mapped buffer for local files
+        self.buf = None              # the mapped buffer, if any
         self.POS = []                # position of headers
+        self.scanned = []            # [header position, data position, data size]
+                                     # of the headers found by headerPos
         self.SIZE = []
         self.datasum = []            # datasum of headers if check!=0
+        self.fitscheck = []          # FITS DATASUM and verification if check!=0
+        self.hdrcheck = None         # raw blocks of the last header if check!=0
         self.show = int(show)        # print the header if show!=0
         self.struct = int(struct)    # examine the structure of the file
         self.check = int(check)      # calculate datasums
         self.Extension = []          # list of HeadDict instances
+        if type(where) == type(''):
+            where = KeyFilter.compiled(where)
+        self.where = where           # KeyFilter selecting the headers
+        self.selected = {}           # header number: 1 if matching the filter
         self.Mode = mode             # if 0 it is assumed that the input does
                                      # not contain data (.hdr file)
-        self.KKeys = ['SIMPLE','EXTEND','NAXIS[0-9]{0,2}','BITPIX','XTENSION', 'END',]
-        if skey != 'END': self.KKeys.append(skey)
+        self.KKeys = ['SIMPLE','EXTEND','NAXIS[0-9]{0,2}','BITPIX','XTENSION','PCOUNT','GCOUNT',
+                      'GROUPS','END',]
+        self.MKeys = re.compile('|'.join(self.KKeys))  # the mandatory keywords only
+        self.skeys = self.keyList(skey)  # keywords searched for, see dumpHead
+        self.KKeys += [re.escape(key) for key in self.skeys]
+        if type(cache) == type(''):
+            self.cache = StructCache(cache) if cache else None
+        else:
+            self.cache = cache
         if type(file) == type(''):
             (self.fd, self.size) = self.openFile(file)
             if self.size == -1:
@@ -100,8 +138,30 @@ class FitsHead:
         else:
             errMsg = "Invalid type passed to file parameter during __init__"
             raise Exception(errMsg)
-        self.HEAD = []               # list of list(s) of header cards
+        self.HEAD = []               # list of HeadBuffer instances holding the header cards
         self.analyzeStruct()
+        for (ii, selected) in self.selected.items():
+            if not selected and ii < len(self.HEAD):
+                self.HEAD[ii] = HeadBuffer()     # drop the headers not matching the filter
+
+    @staticmethod
+    def keyList(skey):
+        """
+        Return the list of keywords given by <skey>, either a list or a string
+        of comma separated keywords. 'END' stands for no keyword.
+
+        INPUT:     string or list of strings
+        OUTPUT:    list of strings
+        """
+        if type(skey) == type(''):
+            skey = skey.split(',')
+        skeys = []
+        for key in skey:
+            key = key.strip()
+            if key and key != 'END' and key not in skeys:
+                skeys.append(key)
+        return skeys
+
 
     def analyzeStruct(self):
         """
@@ -109,55 +169,298 @@ class FitsHead:
         of the FITS file. It fills the string array self.STRUCT and the string array
         self.HEAD, which contains the plain header cards. The mandatory keywords
         are parsed into the HD dictionaries for each extension.
+
+        If a structure cache is used and holds a valid entry for the file only
+        the requested header(s) are read, see loadStruct. If only the structure
+        is requested (show=-99) the file is analyzed by the byte-level scanner,
+        see scanStruct. The same is done for the headers preceding the
+        requested header if 0 <= show < 99, thus only that header is actually
+        read and parsed.
         """
         self.STRUCT = []
+        if self.struct > 0 and self.useCache():
+            table = self.cache.get(self.name)
+            if table:
+                if self.show == -99 and self.where is None:
+                    self.loadStruct(table, [])
+                elif self.show >= 0 and self.show != 99 and self.show < len(table):
+                    self.loadStruct(table[:self.show+1], [self.show])
+                else:
+                    self.loadStruct(table, range(len(table)))
+                return
+        if self.struct > 0 and self.show == -99 and self.Mode and self.where is None:
+            table = self.scanStruct()
+            if self.useCache():
+                self.cache.put(self.name, table)
+            self.loadStruct(table, [])
+            return
+        if self.struct > 0 and self.show >= 0 and self.show != 99 and self.Mode:
+            # only the mandatory cards of the headers before the requested one
+            self.loadStruct(self.scanStruct(nhdu=self.show), [])
+            if len(self.HEAD) < self.show:
+                return                   # there are less headers in the file
+            HH = self.dumpHead()
+            if len(HH) > 0:
+                self.HEAD.append(HH)
+                self.skipData(header=-1)
+                datasum = self.datasum[-1] if self.check else -1
+                self.addStructLine(self.getAxes(self.Extension[-1]), self.POS[-1][0], datasum,
+                                   self.fitscheck[-1] if self.check else None)
+            return
         HH = self.dumpHead()
-        hcount = 1
-        headfl = 1
         if self.struct > 0:
             while len(HH) > 0 :
                 self.HEAD.append(HH)
                 if self.Mode:
                     self.skipData(header=-1)
-                naxis = int(self.Extension[-1].getKeyword('NAXIS')[1])
-                if headfl == 1:
-                    stmp = "# HDR  NAXIS  "
-                    for na in range(1,naxis+1):
-                        stmp += "NAXIS%d  " % na
-                    stmp += '        POS         DATASUM'
-                    self.STRUCT.append(stmp)
-                    self.STRUCT.append(70*'-')
-                    headfl = 0
                 if self.check:
                     datasum = self.datasum[-1]
+                    fitscheck = self.fitscheck[-1] if self.Mode else None
                 else:
                     datasum = -1
-                stmp = "%3d  %3d    " % (len(self.HEAD), naxis)
-                for na in range(1,naxis+1):
-                    lna = int(self.Extension[-1].getKeyword('NAXIS'+str(na))[1])
-                    stmp += "%6d   " % lna
-                if naxis > 0:
-                    stmp += "%10d    %12d" % (self.POS[-1][0],datasum)
-                self.STRUCT.append(stmp)
+                    fitscheck = None
+                self.addStructLine(self.getAxes(self.Extension[-1]), self.POS[-1][0], datasum,
+                                   fitscheck)
                 if self.show == len(self.HEAD)-1 and self.show != 99:
                     break
                 else:
                     HH = self.dumpHead()
-                    hcount += 1
+            else:
+                if self.useCache():
+                    self.cache.put(self.name, self.structTable())
         else:
             self.HEAD = [HH]
 
 
+    def addStructLine(self, axes, pos, datasum=-1, fitscheck=None):
+        """
+        Append the line describing a header to self.STRUCT. The
+        title lines are added before the first line.
+
+        INPUT:     int list, values of NAXIS1 ... NAXISn of the header
+                   int, position of the header in the file
+                   int, datasum of the data part, -1 if not available
+                   tuple attribute fitscheck, (<FITS DATASUM>, <DATASUM status>,
+                         <CHECKSUM status>), appended as FITSSUM, DSUM and CSUM
+                         columns if given, optional
+        """
+        naxis = len(axes)
+        if len(self.STRUCT) == 0:
+            stmp = "# HDR  NAXIS  "
+            for na in range(1,naxis+1):
+                stmp += "NAXIS%d  " % na
+            stmp += '        POS         DATASUM'
+            if fitscheck is not None:
+                stmp += '     FITSSUM  DSUM  CSUM'
+            self.STRUCT.append(stmp)
+            self.STRUCT.append(70*'-')
+        stmp = "%3d  %3d    " % (len(self.STRUCT) - 1, naxis)
+        for lna in axes:
+            stmp += "%6d   " % lna
+        if naxis > 0 or fitscheck is not None:
+            stmp += "%10d    %12d" % (pos,datasum)
+        if fitscheck is not None:
+            status = {1:'ok', 0:'BAD', -1:'-'}
+            stmp += "  %10d  %4s  %4s" % (fitscheck[0], status[fitscheck[1]],
+                                          status[fitscheck[2]])
+        self.STRUCT.append(stmp)
+
+
+    def getAxes(self, HD):
+        """
+        Return the list of the NAXISn values of the header <HD>.
+        """
+        naxis = int(HD.getKeyword('NAXIS')[1])
+        return [int(HD.getKeyword('NAXIS'+str(na))[1]) for na in range(1,naxis+1)]
+
+
+    def useCache(self):
+        """
+        Return 1 if the structure cache can be used for this file, i.e. if a
+        cache is defined and the file is a plain file containing data.
+        No cache is used if data checksums are requested.
+        """
+        return int(self.cache is not None and self.size > 0 and bool(self.Mode) \
+                   and not self.check)
+
+
+    def structTable(self):
+        """
+        Return the structure table of the headers analyzed so far. There is
+        one entry per HDU, see StructCache for a description.
+
+        OUTPUT:    list of dictionaries
+        """
+        table = []
+        for ii in range(len(self.Extension)):
+            HD = self.Extension[ii]
+            keys = []
+            for (ind, key) in sorted(HD['index'].items()):
+                if self.MKeys.match(key):
+                    keys.append([ind] + list(HD.getKeyword(key)[:4]))
+            table.append({'pos':self.POS[ii][0], 'datapos':self.POS[ii][1],
+                          'datasize':self.SIZE[ii], 'keys':keys})
+        return table
+
+
+    def scanStruct(self, nhdu=-1):
+        """
+        Method runs the byte-level structure scanner (StructScan) from the
+        current position and returns the structure table. The mandatory
+        cards found by the scanner are converted into keyword tuples. If
+        self.check is set the table contains the CRC32 of the data parts.
+
+        INPUT:     int attribute nhdu, if >= 0 stop after this number of headers,
+                                       default -1, optional
+        OUTPUT:    list, structure table, see structTable.
+        """
+        table = []
+        if nhdu == 0:
+            return table
+        scan = StructScan(self.fd, buf=self.buf, pos=self.nbytes, check=self.check,
+                          mode=self.Mode, limit=nhdu)
+        for entry in scan:
+            entry['keys'] = [[ind] + list(self.parseFitsCard(card)[:4])
+                             for (ind, card) in entry.pop('cards')]
+            table.append(entry)
+        self.nbytes = scan.pos
+        return table
+
+
+    def loadStruct(self, table, heads):
+        """
+        Method fills the structure information from a structure table without
+        walking through the file. Only the headers listed in <heads> are
+        actually read. The other entries of self.HEAD are empty and the
+        corresponding HeadDict instances in self.Extension contain the
+        mandatory keywords only.
+
+        INPUT:     list, structure table, see structTable.
+                   int list, numbers of the headers to be read
+        """
+        for ii in range(len(table)):
+            entry = table[ii]
+            if ii in heads:
+                self.seekPos(entry['pos'])
+                self.HEAD.append(self.dumpHead())
+            else:
+                HD = HeadDict(number=ii, pos=entry['pos'])
+                for (ind, key, value, comment, typ) in entry['keys']:
+                    # mandatory keywords are never HIERARCH, no nesting required
+                    HD['index'][ind] = key
+                    HD.KEYPOS[key] = ind
+                    HD['cards'][key] = {'Value':value, 'Comment':comment, 'Type':typ}
+                HD.setHeaderSize(entry['datapos'] - entry['pos'])
+                HD.DATASIZE = (entry['datasize'], (entry['datasize'] + 2879) // 2880)
+                self.Extension.append(HD)
+                self.POS.append([entry['pos'], entry['datapos']])
+                self.HEAD.append(HeadBuffer())
+            self.SIZE.append(entry['datasize'])
+            self.datasum.append(entry.get('datasum', -1))
+            if 'fitscheck' in entry:
+                self.fitscheck.append((entry['fitsum'],) + tuple(entry['fitscheck']))
+            else:
+                self.fitscheck.append(None)
+            values = dict((key, value) for (ind, key, value, comment, typ) in entry['keys'])
+            axes = [int(values.get('NAXIS%d' % na, 0)) for na in range(1, int(values['NAXIS'])+1)]
+            self.addStructLine(axes, entry['pos'], self.datasum[-1], self.fitscheck[-1])
+
+
+    def seekPos(self, pos):
+        """
+        Position the file at byte <pos>.
+        """
+        if self.buf is None:
+            self.fd.seek(pos, 0)
+        self.nbytes = pos
+
+
+    @staticmethod
+    def cardKey(card):
+        """
+        Return the keyword of the raw card <card> as derived in dumpHead,
+        i.e. the full keyword for HIERARCH cards.
+
+        INPUT:     bytes, one card
+        OUTPUT:    string, keyword
+        """
+        key = card[:8].strip()
+        if key == b'HIERARCH':
+            key = card[:card.find(b'=')].strip()
+        return key.decode('latin-1')
+
+
+    def searchHead(self):
+        """
+        Read the header starting at the current position keeping only the
+        cards of the keywords in self.skeys. The raw blocks are searched for
+        the keywords with bytes.find instead of splitting every card and
+        reading stops as soon as all keywords are found, i.e. the rest of
+        the header is not read at all. Since the END card is not necessarily
+        reached the data part can't be located afterwards, thus this is only
+        used for a single header (struct == 0), see dumpHead.
+
+        Output: HEAD: HeadBuffer containing the cards found
+        """
+        _BLOCKSIZE_ = 2880
+        number = len(self.Extension)
+        raw = self.readBlock(_BLOCKSIZE_)
+        self.nbytes = self.nbytes + _BLOCKSIZE_
+        if len(raw) > 0 and not raw[0:8] == b'XTENSION' and not raw[0:6] == b'SIMPLE':
+            return HeadBuffer()
+        if not raw:
+            return HeadBuffer()
+        self.POS.append([self.nbytes - _BLOCKSIZE_, 0])
+        # card prefix: keyword, keywords shorter than 8 characters padded with blanks
+        missing = dict([(key.ljust(8).encode('latin-1'), key) for key in self.skeys])
+        found = {}                   # card index: raw card
+        index = 0
+        while raw:
+            end = len(raw)
+            pos = raw.find(b'END ')
+            while pos >= 0:
+                if pos % 80 == 0 and raw[pos:pos+80].rstrip() == b'END':
+                    end = pos
+                    break
+                pos = raw.find(b'END ', pos + 1)
+            for pattern in list(missing):
+                pos = raw.find(pattern, 0, end)
+                while pos >= 0:
+                    # the pattern may only be a prefix of a longer HIERARCH keyword
+                    if pos % 80 == 0 and self.cardKey(raw[pos:pos+80]) == missing[pattern]:
+                        found[index + pos // 80] = raw[pos:pos+80]
+                        del missing[pattern]
+                        break
+                    pos = raw.find(pattern, pos + 1, end)
+            if end < len(raw) or not missing:
+                break
+            raw = self.readBlock(_BLOCKSIZE_)
+            self.nbytes = self.nbytes + _BLOCKSIZE_
+            index += _BLOCKSIZE_ // 80
+        cards = [self.parseFitsCard(found[ind].decode('latin-1'), index=ind)
+                 for ind in sorted(found)]
+        HD = HeadDict.fromCards(cards, number=number, pos=self.POS[-1][0])
+        HD.setHeaderSize(self.nbytes - self.POS[-1][0])
+        self.Extension.append(HD)
+        self.POS[-1][1] = self.nbytes
+        return HeadBuffer(b''.join([found[ind] for ind in sorted(found)]))
+
 
     def dumpHead(self):
         """
         Read all header blocks starting at current position.
 
-        Output: HEAD: array of header strings
+        If keywords are searched for (skey) only their cards are kept. For a
+        single header (struct == 0) without filter this is done by searchHead.
+
+        Output: HEAD: HeadBuffer containing the header cards
         """
 
         _BLOCKSIZE_ = 2880
-        skey = self.KKeys[-1]
+        if self.skeys and not self.struct and self.where is None:
+            return self.searchHead()
+        missing = set(self.skeys)
+        found = []                   # cards of the keywords searched for
         rkkeys = self.KKeys[0]
         for kkey in self.KKeys[1:]:
             rkkeys = rkkeys + '|' + kkey
@@ -168,20 +471,25 @@ class FitsHead:
         endfl = 0
         skfl = 0
         keys=[]
-        block = self.fd.read(_BLOCKSIZE_)
-        block = block.decode("latin-1")
+        raw = self.readBlock(_BLOCKSIZE_)
+        block = raw.decode("latin-1")
         self.nbytes = self.nbytes + _BLOCKSIZE_
         if len(block) > 0 and not block[0:8] == 'XTENSION' and not block[0:6] == 'SIMPLE':
-            return ''
+            return HeadBuffer()
         if block:
             self.POS.append([self.nbytes - _BLOCKSIZE_,0])
-            HD = HeadDict(number=number, pos = self.nbytes - _BLOCKSIZE_)
-        HEAD = block
-        sline = ''
+        cards = []                   # parsed cards, see HeadDict.fromCards
+        blocks = [raw]               # joined only once at the end
+        self.hdrcheck = [raw] if self.check else None
+        offsets = array('I')         # offsets of the non-blank cards
+        where = self.where
+        values = {}                  # keyword values tested by the filter
+        rejected = 0
         while block:
             kkeys=[]
             for ind in range(0,_BLOCKSIZE_,80):
                 if block[ind] != ' ':
+                    offsets.append(index*80)
                     pkey = block[ind:ind+8].strip()
                     if pkey == 'END':
                         endfl = 1
@@ -193,56 +501,133 @@ class FitsHead:
                         key = pkey
                     kkeys.append(key)
                     if rq.match(key):
-                        LineTuple = self.parseFitsCard(block[ind:ind+80])
-                        sline = block[ind:ind+80].strip()
-                        if skey != 'END' and LineTuple[0] == skey:
-                            HEAD = sline
+                        LineTuple = self.parseFitsCard(block[ind:ind+80], index=index)
+                        if LineTuple[0] in missing:
+                            missing.discard(LineTuple[0])
+                            found.append(raw[ind:ind+80])
                             skfl = 1
-                        LineDict = HD.keyTuple2Dict(LineTuple)
-                        LineDict['index']={index:LineTuple[0]}
-                        HD.updateKeyword(LineDict)
+                        cards.append(LineTuple)
+                    if where is not None and key in where.keys:
+                        # stop testing at the first failing card
+                        rejected = not where.card(values, key,
+                                                  self.parseFitsCard(block[ind:ind+80])[1])
+                        if rejected:
+                            index += 1
+                            break
                 index += 1
 
+            if rejected:
+                self.skipHead(raw, ind + 80, cards, index)
+                break
             keys.append(kkeys)
             if endfl == 1:
 #               stat=self.fd.close()
                 break
-            block=self.fd.read(_BLOCKSIZE_)
-            block = block.decode("latin-1")
+            raw = self.readBlock(_BLOCKSIZE_)
+            block = raw.decode("latin-1")
             self.nbytes = self.nbytes + _BLOCKSIZE_
-            if skfl == 0: HEAD = HEAD + block
-
+            if skfl == 0: blocks.append(raw)
+            if self.check: self.hdrcheck.append(raw)
+
+        if rejected:
+            # only a placeholder, the header is dropped in __init__
+            HEAD = HeadBuffer(b'END'.ljust(80))
+        elif skfl == 1:
+            HEAD = HeadBuffer(b''.join(found))
+        else:
+            HEAD = HeadBuffer(b''.join(blocks), offsets)
 
         if block or index > 0:
+            HD = HeadDict.fromCards(cards, number=number, pos=self.POS[-1][0])
             HD.setHeaderSize(self.nbytes - self.POS[-1][0])
             HD.setDataSize()
             self.Extension.append(HD)
             self.POS[-1][1] = self.nbytes
+            if where is not None:
+                self.selected[number] = int(not rejected and where.match(values))
 
         return HEAD
 
 
+    def skipHead(self, raw, start, cards, index):
+        """
+        Advance to the end of a header rejected by the filter without
+        decoding its cards. Block by block only the END card is located
+        (findEnd) and the cards needed for the size of the data part are
+        picked up, all other cards are skipped.
+
+        INPUT:     bytes, the current header block
+                   int, offset of the next card in <raw>
+                   list, parsed cards, extended in place
+                   int, index of the card at <start>
+        OUTPUT:    none, self.nbytes points to the end of the header
+        """
+        _BLOCKSIZE_ = 2880
+        have = set([card[0] for card in cards])
+        index = index - start // 80          # index of the first card of <raw>
+        while raw:
+            end = findEnd(raw, start)
+            stop = end if end >= 0 else len(raw)
+            for prefix in (b'BITPIX', b'NAXIS', b'PCOUNT', b'GCOUNT', b'GROUPS'):
+                pos = raw.find(prefix, start, stop)
+                while pos >= 0:
+                    if pos % 80 == 0:
+                        key = raw[pos:pos+8].decode("latin-1").strip()
+                        if key not in have and self.MKeys.fullmatch(key):
+                            have.add(key)
+                            cards.append(self.parseFitsCard(raw[pos:pos+80].decode("latin-1"),
+                                                            index=index + pos // 80))
+                    pos = raw.find(prefix, pos + 1, stop)
+            if end >= 0:
+                return
+            raw = self.readBlock(_BLOCKSIZE_)
+            self.nbytes = self.nbytes + _BLOCKSIZE_
+            if self.check: self.hdrcheck.append(raw)
+            index += 36
+            start = 0
+
+
+    def matchHeads(self, heads):
+        """
+        Return the numbers out of <heads> of the headers which have been read
+        and match the filter, all of <heads> if there is no filter.
+
+        INPUT:     iterable of int, header numbers
+        OUTPUT:    list of int
+        """
+        if self.where is None:
+            return list(heads)
+        return [ii for ii in heads if self.selected.get(ii, 0)]
+
+
     def skipData(self,header=-1):
         """
         skipData method for multiple extension files. Contains also the calculation of the
         data checksum. If the file object is not created from a ordinary file, like a socket or
         a pipe then the method does not skip but rather read through the data.
+        If the file is memory-mapped skipping is just moving the position pointer.
+        If self.check is set the FITS DATASUM is calculated as well and the DATASUM
+        and CHECKSUM keywords of the header are verified, see FitsChecksum.
         """
         (siz,nblocks) = self.Extension[header].DATASIZE
         siz = int(siz)
         rr = siz % 2880
         checksum = -1
+        fitsum = 0
         if (siz > 0):
-            if dir(self.fd).count('name') != 0 and (not self.check) and \
+            datasiz = siz
+            if rr!=0: datasiz = datasiz + (2880-rr)
+            if self.buf is not None:
+                if self.check:
+                    (checksum, fitsum) = dataSums(None, datasiz, buf=self.buf, pos=self.nbytes)
+            elif dir(self.fd).count('name') != 0 and (not self.check) and \
                 self.fd.name[1:-1] != 'fdopen':    #this fd.name means pipe, i.e. no seek
                 if siz != 0: self.fd.seek(siz,1)     #skip over data
                 if rr  != 0: self.fd.seek(2880-rr,1) #and rest of card
+            elif self.check:
+                (checksum, fitsum) = dataSums(self.fd, datasiz)
             else:
-                datasiz = siz
-                if rr!=0: datasiz = datasiz + (2880-rr)
-                data = self.fd.read(datasiz)
-                checksum = -1
-                checksum = crc32(data)
+                checksum = dataCrc(self.fd, datasiz)    # chunked, also reads through pipes
 
             self.nbytes = self.nbytes + siz
             if rr != 0: self.nbytes = self.nbytes+(2880-rr)
@@ -251,6 +636,12 @@ class FitsHead:
             checksum = -1
 
         self.datasum.append(checksum)
+        if self.check and self.hdrcheck is not None:
+            self.fitscheck.append((fitsum,) +
+                                  FitsChecksum.shared.verify(b''.join(self.hdrcheck), fitsum))
+            self.hdrcheck = None
+        else:
+            self.fitscheck.append(None)
         self.SIZE.append(siz)
         return 0
 
@@ -263,48 +654,80 @@ class FitsHead:
         If blfl is 0 the actual data size as given in the header is read, else
         the number of complete FITS blocks are read.
         """
-        if self.size>0:   # positioning does not work for streams
-            self.fd.seek(self.POS[header][0]+self.POS[header][1],0)
+        if self.buf is not None:
+            start = self.POS[header][1]
+        elif self.size>0:   # positioning does not work for streams
+            self.fd.seek(self.POS[header][1],0)
         else:
             header = -1   # force header to be last one
         (siz,nblocks) = self.Extension[header].DATASIZE
+        siz = int(siz)
         wfl = 0
         if len(ofile) > 0:
             try:
-                of = open(ofile,'w')
+                of = open(ofile,'wb')
                 wfl = 1
             except:
                 print("Problem opening output file:",ofile)
                 return
         if wfl:
-            for ii in range(nblocks):
-                block = self.fd.read(2880)
-                of.write(block)
-            del(block)
+            if self.buf is not None:
+                of.write(memoryview(self.buf)[start:start+nblocks*2880])
+            else:
+                for ii in range(nblocks):
+                    block = self.fd.read(2880)
+                    of.write(block)
+                del(block)
+            of.close()
             return -1
         else:
             if blfl == 0:
                 rsiz = siz
             else:
                 rsiz = nblocks*2880
+            if self.buf is not None:
+                return self.buf[start:start+rsiz]
             data = self.fd.read(rsiz)
             return data
 
 
+    def readBlock(self, size=2880):
+        """
+        Method returns the next <size> bytes at the current position. For
+        memory-mapped files the bytes are sliced directly from the mapped
+        buffer at position self.nbytes, else they are read from the file object.
+
+        INPUT:     int attribute size, number of bytes, default 2880, optional
+        OUTPUT:    bytes, empty if the end of the file is reached
+        """
+        if self.buf is not None:
+            return self.buf[self.nbytes:self.nbytes+size]
+        return self.fd.read(size)
+
+
+    def close(self):
+        """
+        Release the mapped buffer, if any, and close the file object.
+        """
+        if self.buf is not None:
+            self.buf.close()
+            self.buf = None
+        self.fd.close()
+
+
     def openFile(self,file):
         """
-        Opens the file or a pipe if the file is compressed and returns
-        a file-descriptor and the size of the file.
+        Opens the file or a decompressing stream if the file is compressed
+        and returns a file-descriptor and the size of the file.
         """
-        flist = glob(file)        #try to find the file
-        if len(flist) == 0:            # don't open new one if it does not exist
+        if not os.path.exists(file):   # don't open new one if it does not exist
             return (-1,-1)
         else:
             base = os.path.basename(file)
             ID, ext = os.path.splitext(base)
             if ext == '.Z' or ext == '.gz':
-                (fd,STDIN,STDOUT) = subprocess.Popen(['/usr/bin/gunzip','-qc',file],0)
-                size = -2   # size is not available in a pipe, but this is not a problem
+                fd = CompressedFile(file)
+                size = -2   # size is not available for a stream, but this is not a problem
                 self.name = file
                 self.ID, ext = os.path.splitext(ID)
             else:
@@ -317,36 +740,121 @@ class FitsHead:
                 fd.seek(0,0)
                 self.name = fd.name
                 self.ID = base
+                if self.memmap and size > 0:
+                    try:
+                        self.buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+                    except (ValueError, EnvironmentError):
+                        self.buf = None    # fall back to plain reads
 
         return (fd,size)
 
 
 
-    def parseFitsHead(self):
+    def header(self, number, lazy=0):
+        """
+        Method returns the fully parsed header <number> as a HeadDict instance.
+        If the header has not been read already only the mandatory cards of the
+        preceding headers are scanned in order to find its position.
+
+        INPUT:     int, number of the header counted from 0
+                   int attribute lazy, if 1 a LazyHeadDict is returned,
+                                       default 0, optional
+        OUTPUT:    HeadDict instance
+        """
+        if number < len(self.HEAD) and len(self.HEAD[number]) > 0 and not self.skeys:
+            return self.parseHeader(self.HEAD[number], number, self.POS[number][0], lazy)
+        pos = self.headerPos(number)
+        if pos < 0:
+            errMsg = "Header %d does not exist in file %s" % (number, self.name)
+            raise Exception(errMsg)
+        return self.parseHeader(self.readHeader(pos), number, pos, lazy)
+
+
+    def headerPos(self, number):
+        """
+        Return the position of the header <number> in the file or -1 if the
+        file contains less headers.
+        """
+        if number < len(self.POS):
+            return self.POS[number][0]
+        if self.useCache():
+            table = self.cache.get(self.name)
+            if table:
+                return table[number]['pos'] if number < len(table) else -1
+        if number < len(self.scanned):
+            return self.scanned[number][0]
+        # continue the scan behind the last header found so far
+        if self.scanned:
+            (pos, datapos, siz) = self.scanned[-1]
+            self.seekPos(datapos + (siz + (-siz) % 2880 if self.Mode else 0))
+        else:
+            self.seekPos(0)
+        for entry in self.scanStruct(nhdu=number+1-len(self.scanned)):
+            self.scanned.append([entry['pos'], entry['datapos'], entry['datasize']])
+        if len(self.scanned) <= number:
+            return -1
+        return self.scanned[number][0]
+
+
+    def readHeader(self, pos):
+        """
+        Read the plain header starting at position <pos>.
+
+        INPUT:     int, position of the header in the file
+        OUTPUT:    HeadBuffer, header cards
+        """
+        self.seekPos(pos)
+        blocks = []
+        while True:
+            block = self.readBlock(2880)
+            if len(block) < 2880:
+                break
+            blocks.append(block)
+            self.nbytes = pos + 2880 * len(blocks)
+            if findEnd(block) >= 0:
+                break
+        return HeadBuffer(b''.join(blocks))
+
+
+    def parseHeader(self, head, number=0, pos=0, lazy=0):
+        """
+        Method parses the plain header <head> into a HeadDict dictionary.
+        If <lazy> is 1 a LazyHeadDict is returned instead, which parses the
+        cards only when they are accessed.
+
+        INPUT:     HeadBuffer or string, header cards
+                   int attribute number, number of the header, default 0, optional
+                   int attribute pos, position of the header, default 0, optional
+                   int attribute lazy, default 0, optional
+        OUTPUT:    HeadDict instance
+        """
+        if lazy:
+            HD = LazyHeadDict(head, number=number, pos=pos, parser=self.parseFitsCard)
+        else:
+            if not isinstance(head, HeadBuffer):
+                head = HeadBuffer(head)
+            HD = HeadDict.fromCards(self.parseBlock(head), number=number, pos=pos)
+        HD.setHeaderSize(len(head))
+        HD.setDataSize()
+        return HD
+
+
+    def parseFitsHead(self, lazy=0):
 
         """
         Method parses self.HEAD into a HeadDict dictionary.
+        Headers which have not been read (empty entries in self.HEAD) keep the
+        HeadDict containing the mandatory keywords only.
+        If <lazy> is 1 LazyHeadDict instances are created, which parse a card
+        only when it is accessed. This is much faster if only a few keywords
+        of large headers are used.
         """
         exts = []
         for ii in range(len(self.HEAD)):
-            HD = HeadDict()
-            for ind in range(0,len(self.HEAD[ii]),80):
-                h = self.HEAD[ii][ind:ind+80]
-                LineTuple = self.parseFitsCard(h)
-                key = LineTuple[0]
-                if key in ['COMMENT', 'HISTORY', 'ESO-LOG']:
-                    LineDict = {'index':-1,'cards':{key:{'Value':LineTuple[1],\
-                                'Comment':LineTuple[2],'Type':''}}}
-                else:
-                    LineDict = HD.keyTuple2Dict(LineTuple)
-                if len(key) > 0:
-                    LineDict.update({'index':{ind/80:LineTuple[0]}})
-                    HD.updateKeyword(LineDict)
-
-            HD.setNumber(ii)
-            HD.setPos(self.Extension[ii].POS)
-            HD.setDataSize()
-            exts.append(HD)
+            if len(self.HEAD[ii]) == 0:
+                exts.append(self.Extension[ii])
+            else:
+                exts.append(self.parseHeader(self.HEAD[ii], ii, self.Extension[ii].POS, lazy))
         self.Extension = exts
         return
 
@@ -372,9 +880,7 @@ class FitsHead:
         tupleList = []
         for ii in range(len(self.HEAD)):
             tupleList.append([])
-            for ind in range(0,len(self.HEAD[ii]),80):
-                h = self.HEAD[ii][ind:ind+80]
-                LineTuple = self.parseFitsCard(h, index=ind/80)
+            for LineTuple in self.parseBlock(self.HEAD[ii], raw=(forceString > 0)):
                 key = LineTuple[0]
                 LineList = []
                 if len(key) > 0:
@@ -408,22 +914,32 @@ class FitsHead:
         INPUT: string(80), One line of a FITS header
         RETURN: tuple, (key, value, comment, type, index)
         """
+        return self.getKeyType(self.splitCard(line, index))
+
+
+    def splitCard(self,line, index=-1):
+        """
+        Method splits a single FITS header card into its parts without
+        deriving the type of the value. This is the general path handling
+        free format, string, HIERARCH and special cards.
+
+        INPUT: string(80), One line of a FITS header
+        RETURN: tuple, (key, value, comment, type, index), where type is 'C'
+                for quoted string values and empty otherwise.
+        """
 
         key = ''
         value = ''
         comment = ''
         typ = ''
-        sexpr = re.compile('^COMMENT|HISTORY|END|ESO-LOG')  # these are the special keywords
-        qexpr = re.compile("'(''|[^'])*'")  # this allows to catch crazy keyword values like "'o''Neill'"
 
-
-        if line[0] != ' ' and not sexpr.match(line):
+        if line[0] != ' ' and not _SPECIAL_RX_.match(line):
             (key,rest) = line.split('=',1)
             key = key.strip()
             rest = rest.strip()
             if rest[0] == "'":
                 try:
-                    m = qexpr.match(rest)
+                    m = _QUOTE_RX_.match(rest)
                     value = m.group()[1:-1].strip()
                     vind = m.end()
                     typ = 'C'
@@ -445,81 +961,103 @@ class FitsHead:
 
             value = value.strip()
             comment = comment.strip()
-        elif sexpr.match(line):
-            key = sexpr.match(line).group()
-            rest = sexpr.split(line)
+        elif _SPECIAL_RX_.match(line):
+            key = _SPECIAL_RX_.match(line).group()
+            rest = _SPECIAL_RX_.split(line)
             comment = ''
             if key in ['COMMENT', 'HISTORY', 'ESO-LOG']:
                 value = [rest[1].strip()]
             else:
                 value = ''
 
-        return self.getKeyType((key,value,comment,typ,index))
-
-
+        return (key,value,comment,typ,index)
 
 
-    def xmlHead(self, format='vo', outfile = '', pretty = 1, head=0):
+    def parseBlock(self, block, start=0, raw=0):
         """
-        Method takes Extension and creates a list of XML strings or writes
-        the XML strings to <outfile>. If <pretty> is 1 (default) then the
-        XML file is nicely indented.
+        Method parses all cards of a header block or of a complete header in
+        one pass. Standard fixed format cards (keyword in columns 1-8, '= '
+        in columns 9-10, unquoted value in columns 11-30 followed by nothing
+        but an optional comment) are split by slicing at the fixed columns.
+        Only free format, string, HIERARCH and special cards go through the
+        general path, see splitCard. Blank cards are skipped.
+
+        INPUT:     HeadBuffer, bytes or string, header cards
+                   int attribute start, number of the first card of <block>,
+                                        default 0, optional
+                   int attribute raw, if 1 the values are returned as found in
+                                      the header instead of being converted
+                                      according to their type, default 0, optional
+        OUTPUT:    list of tuples, (key, value, comment, type, index)
         """
-
-        if head == 99:
-            heads = self.Extension
+        if isinstance(block, HeadBuffer):
+            offsets = block.offsets
+            block = block.data
         else:
-            heads = [self.Extension[head]]
-        XmlHead = []
-
-        level = 0
-        indent = '   '
-        XmlHead.append('<?xml version="1.0" encoding="ISO-8859-1"?>')
-
-        if format == 'vo':
-
-            XmlHead.append('<VOTABLE version="1.1">')
-            level = 1 * pretty
-            XmlHead.append(level*indent + '<INFO name="Creator" value=' + \
-                           '"ESO printhead tool"/>')
-            XmlHead.append(level*indent + '<INFO name="Version" value="' +\
-                           __version__ + '"/>')
-            XmlHead.append(level*indent + '<INFO name="Compatibility" value=' +\
-                           '"FITS"/>')
-            XmlHead.append(level*indent + '<DESCRIPTION>')
-            level +=1
-
-            XmlHead.append(level*indent + 'VOTable file created from FITS file')
-            XmlHead.append(level*indent + self.name)
-
-            level -=1
-            XmlHead.append(level*indent + '</DESCRIPTION>')
-        elif format == 'xfits':
-            level = 1 * pretty
-            XmlHead.append('<?xml-stylesheet type="text/xml" href="XMLmenu.xsl"?>')
-            XmlHead.append('<XFits>')
-        else:
-            XmlHead.append("<ERROR>Invalid format specified. Should be vo or xfits</ERROR>")
-            return XmlHead
-        for HD in heads:
-            if format == 'vo':
-                XmlHead.append(HD.VotableSerialize(level=level, indent=indent))
+            offsets = range(0, len(block), 80)
+        if type(block) != type(''):
+            block = str(block, 'latin-1')
+        getKeyType = self.getKeyType
+        splitCard = self.splitCard
+        tupleList = []
+        for off in offsets:
+            card = block[off:off+80]
+            if card[0] == ' ':
+                continue
+            ind = start + off // 80
+            LineTuple = None
+            if card[8:10] == '= ' and not card.startswith(_SPECIAL_KEYS_) and \
+               card.find('=') == 8:
+                vfield = card[10:30]
+                rest = card[30:].strip()
+                if (not rest or rest[0] == '/') and vfield.find("'") < 0 and \
+                   vfield.find('/') < 0:
+                    LineTuple = (card[:8].strip(), vfield.strip(), rest[1:].strip(), '', ind)
+            if LineTuple is None:
+                LineTuple = splitCard(card, index=ind)
+            if raw:
+                typed = getKeyType(LineTuple)
+                tupleList.append(LineTuple[:3] + typed[3:])
             else:
-                XmlHead.append(HD.XfitsSerialize(level=level, indent=indent))
+                tupleList.append(getKeyType(LineTuple))
+        return tupleList
 
-# close the root element
 
-        if format == 'vo':
-            XmlHead.append('\n</VOTABLE>')
-        else:
-            XmlHead.append('\n</XFits>')
 
 
-# put the XML into the object
+    def xmlHead(self, format='vo', outfile = '', pretty = 1, head=0):
+        """
+        Method takes Extension and creates a list of XML strings or writes
+        the XML strings to <outfile>. If <pretty> is 1 (default) then the
+        XML file is nicely indented. See writeXml for writing large headers
+        without keeping the whole document in memory.
+        """
+        if format not in ('vo', 'xfits'):
+            return ["<ERROR>Invalid format specified. Should be vo or xfits</ERROR>"]
+        if outfile:
+            o = open(outfile, 'wb')
+            self.writeXml(o, format=format, pretty=pretty, head=head)
+            o.close()
+        writer = XmlWriter(format=format, pretty=pretty)
+        return list(writer.documentLines(self.xmlHeads(head), self.name))
 
-        return XmlHead
+
+    def writeXml(self, out, format='vo', pretty=1, head=0, bufsize=65536):
+        """
+        Method streams the XML document of the parsed header(s) <head> (99 for
+        all) to <out>, a text or binary file object or a socket, see XmlWriter.
+        """
+        writer = XmlWriter(out, format=format, pretty=pretty, bufsize=bufsize)
+        writer.writeDocument(self.xmlHeads(head), self.name)
 
 
+    def xmlHeads(self, head=0):
+        """
+        Return the list of HeadDict instances selected by <head> and the filter.
+        """
+        if head == 99:
+            return [self.Extension[ii] for ii in self.matchHeads(range(len(self.Extension)))]
+        return [self.Extension[head]]
 
 
 
@@ -629,7 +1167,7 @@ class FitsHead:
 
 
 
-    def getFitsCard(self,key,header=0):
+    def getFitsCard(self,key,header=0,view=0):
         """
         Method takes a keyword <key> and returns the original FITS
         card.
@@ -638,13 +1176,17 @@ class FitsHead:
 
         INPUT:  key, string      Name of the keyword to be searched for
                 header,int       number of header to be searched (def. 0)
+                view,int         if 1 a memoryview into the header buffer
+                                 is returned instead of a string (def. 0)
 
-        OUTPUT: string
+        OUTPUT: string or memoryview
 
         If the keyword does not exist the output string is empty.
         """
         ind = self.Extension[header].getKeyPos(key)
         if ind > -1:
+            if view:
+                return self.HEAD[header].card(ind)
             return self.HEAD[header][ind*80:ind*80+80]
         else:
             return ''
@@ -653,79 +1195,25 @@ class FitsHead:
     def getKeyType(self,lineTuple):
         """
         Method tries to guess the type of a keyword value,
-        where <type> is one out of ['B','C','U', 'S', 'I','L','F','P', 'R','T']
-        and updates the lineTuple on input.
+        where <type> is one out of ['B','C','U','S','I','F','D','R','T']
+        and updates the lineTuple on input. The inference is done by the
+        shared KeyType instance, which caches the results per value string.
 
         types:
             'B':    boolean
             'C':    character
-            'T':    tiny int unsigned (0 >= value < 256)
+            'U':    tiny int unsigned (0 >= value < 256)
             'S':    short (-65536 < value < +65536)
-            'I':    integer (32 bit int)
-            'L':    long (unlimited)
-            'F':    float (if len(value) <= 10)
-            'D':    double (if len(value) > 10)
+            'I':    integer
+            'F':    float (if decimals <= 15)
+            'D':    double (if decimals > 15)
+            'R':    float out of range, value is not converted
             'T':    datetime string (ISO)
 
         INPUT: tuple, lineTuple
         RETURN: lineTuple
         """
-        # regexp for dateTime type
-        dtRx = re.compile(\
-          "(19\d{2}|2\d{3})\-(0\d|1[012])\-([012]\d|3[01])" + \
-          "([T ]([01]\d|2[0-3])\:[0-5]\d\:[0-5]\d(\.\d+)?)?\s*$")
-
-        # deal with reserved words, which would lead to the wrong type...
-        reserved = ['INFINITY', 'INF', 'NAN']
-        val = lineTuple[1]
-        typ = lineTuple[3]
-
-        # check if type is defined already or if one of the reserved words is used.
-        if typ == 'C' or (type(val) == type('') and val.upper() in reserved):
-            typ = 'C'
-            value = val
-        else:
-            try:
-              float(val)
-              value = float(val)
-              if value != 0 and (abs(value) > 1.0e15 or value < 1e-15):
-                  typ = 'R'
-                  value = None
-              dotpos = val.find('.')
-              if dotpos < 0 and typ != 'R':
-                  try:
-                     iv = int(val)
-                     if iv < 256 and iv >= 0:
-                        typ = 'U'
-                     elif iv > iv < 65536:
-                        typ = 'S'
-                     elif iv :
-                        typ = 'I'
-                     value = iv
-                  except:
-                     typ = 'L'
-                     value = int(val)
-              elif typ != 'R':
-                  epos = val.upper().find('E')
-                  if epos == -1:
-                     epos = len(val)
-                  else:
-                     ex = int(val[epos+1:])
-                  if dotpos >= 0:
-                     typ = 'F'
-                     if len(val[dotpos+1:epos]) > 15:
-                        typ = 'D'
-            except:
-                if val == 'T' or val == 'F':
-                    value = True if val=='T' else False
-                    typ = 'B'
-                else:
-                    typ = 'C'
-                    value = val
-        if type(val) == type('') and typ == 'C' and dtRx.match(val):
-            # check for datetime format
-            typ = 'T'
-
+        (typ, value) = KeyType.shared.infer(lineTuple[1], lineTuple[3])
         return (lineTuple[0], value, lineTuple[2], typ, lineTuple[4])
 
 
@@ -0,0 +1,119 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+from array import array
+
+_CARDSIZE_ = 80
+
+
+class HeadBuffer:
+    """
+    Compact storage of a single plain FITS header. The header is kept as one
+    bytes object together with an array of the offsets of all non-blank cards.
+
+    For compatibility with code treating the headers in FitsHead.HEAD as
+    strings, len(), slicing and comparison behave like for the decoded
+    string, i.e. head[ind:ind+80] returns the card as a string. Code which
+    does not need strings should use view, card and cards instead, which
+    return memoryviews into the buffer without copying.
+    """
+
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, data=b'', offsets=None):
+        """
+        INPUT:     bytes or string, header cards, default empty, optional
+                   array attribute offsets, offsets of the non-blank cards,
+                                 derived from the data if not given, optional
+        """
+        if type(data) == type(''):
+            data = data.encode('latin-1')
+        self.data = bytes(data)
+        if offsets is None:
+            offsets = array('I', [off for off in range(0, len(self.data), _CARDSIZE_)
+                                  if self.data[off:off+1] != b' '])
+        self.offsets = offsets
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def __getitem__(self, ind):
+        return self.data[ind:ind+1].decode('latin-1') if type(ind) == type(0) \
+            else self.data[ind].decode('latin-1')
+
+
+    def __str__(self):
+        return self.data.decode('latin-1')
+
+
+    def __repr__(self):
+        return 'HeadBuffer(%d bytes, %d cards)' % (len(self.data), len(self.offsets))
+
+
+    def __bytes__(self):
+        return self.data
+
+
+    def __eq__(self, other):
+        if isinstance(other, HeadBuffer):
+            return self.data == other.data
+        if type(other) == type(''):
+            return self.data == other.encode('latin-1')
+        return self.data == other
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+    def __hash__(self):
+        return hash(self.data)
+
+
+    def view(self, start=0, stop=None):
+        """
+        Return a memoryview of the bytes <start> to <stop> of the header.
+        """
+        return memoryview(self.data)[start:stop]
+
+
+    def card(self, ind):
+        """
+        Return a memoryview of the card number <ind>, counted from 0.
+        """
+        return memoryview(self.data)[ind*_CARDSIZE_:(ind+1)*_CARDSIZE_]
+
+
+    def cards(self):
+        """
+        Generator producing the tuples (<card number>, <memoryview of the card>)
+        for all non-blank cards of the header.
+        """
+        mv = memoryview(self.data)
+        for off in self.offsets:
+            yield off // _CARDSIZE_, mv[off:off+_CARDSIZE_]
+
+
+    def write(self, out):
+        """
+        Write the header to the binary file object <out>.
+        """
+        out.write(self.data)
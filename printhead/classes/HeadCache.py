@@ -0,0 +1,188 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import os
+import threading
+from collections import OrderedDict
+from printhead.classes.FitsHead import FitsHead
+
+_MAXENTRIES_ = 4096
+_MAXBYTES_ = 256 * 1024 * 1024
+_OVERHEAD_ = 4                   # memory of a header relative to its raw size
+
+
+class HeadCache:
+    """
+    In-memory LRU cache of parsed headers for long running processes, which
+    access the same files over and over, see functions.getval.
+
+    The entries are keyed on (<absolute path>, <size>, <mtime_ns>, <HDU>),
+    thus a file is read again as soon as it changes. Each entry is a closed
+    FitsHead instance holding the plain header <HDU> (see FitsHead with
+    show=<HDU>), whose HeadDict in Extension[<HDU>] is a LazyHeadDict, i.e.
+    the cards are parsed when they are accessed for the first time only.
+
+    The cache is bounded both by the number of entries and by the memory of
+    the headers, estimated as a fixed multiple of their raw size. The least
+    recently used entries are dropped first. A single process-wide instance
+    is available as HeadCache.shared.
+    """
+
+    def __init__(self, maxentries=_MAXENTRIES_, maxbytes=_MAXBYTES_):
+        """
+        INPUT:     int attribute maxentries, maximum number of headers, default 4096
+                   int attribute maxbytes, memory budget in bytes, default 256 MB
+        """
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()     # key: (<FitsHead instance>, <bytes>)
+        self.current = {}                # (<absolute path>, <hdu>): key of the entry
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def fileKey(self, name, hdu=0):
+        """
+        Return the cache key of header <hdu> of the file <name>.
+
+        OUTPUT:    tuple, (<absolute path>, <size>, <mtime_ns>, <hdu>)
+        """
+        path = os.path.abspath(name)
+        st = os.stat(path)
+        mtime = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        return (path, st.st_size, mtime, hdu)
+
+
+    def get(self, name, hdu=0, cache=''):
+        """
+        Return the FitsHead instance holding header <hdu> of the file <name>,
+        read from the file only if it is not cached or the file changed.
+
+        INPUT:     string, file name
+                   int attribute hdu, number of the header, default 0, optional
+                   string attribute cache, directory of the structure cache,
+                                    used when reading the file, optional
+        OUTPUT:    FitsHead instance
+        """
+        try:
+            key = self.fileKey(name, hdu)
+        except OSError:
+            errMsg = "*** File %s does not exists ****" % name
+            raise Exception(errMsg)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        pH = FitsHead(name, show=hdu, struct=1, cache=cache)
+        pH.close()
+        if hdu >= len(pH.HEAD) or len(pH.HEAD[hdu]) == 0:
+            errMsg = "Header %d does not exist in file %s" % (hdu, name)
+            raise Exception(errMsg)
+        pH.Extension[hdu] = pH.parseHeader(pH.HEAD[hdu], hdu, pH.POS[hdu][0], lazy=1)
+        self.put(key, pH, _OVERHEAD_ * len(pH.HEAD[hdu]))
+        return pH
+
+
+    def put(self, key, pH, nbytes):
+        """
+        Add the FitsHead instance <pH> with the estimated size <nbytes> under
+        <key> and drop the least recently used entries exceeding the limits.
+        An entry of the same header of an older version of the file (other
+        size or mtime) is dropped as well, found through self.current.
+        """
+        with self.lock:
+            old = self.current.get((key[0], key[3]))
+            if old is not None:
+                self.drop(old)
+            self.entries[key] = (pH, nbytes)
+            self.current[(key[0], key[3])] = key
+            self.nbytes += nbytes
+            self.evict()
+
+
+    def evict(self):
+        """
+        Drop the least recently used entries until the limits are kept.
+        The lock has to be held by the caller.
+        """
+        while self.entries and (len(self.entries) > self.maxentries or
+                                self.nbytes > self.maxbytes):
+            self.drop(next(iter(self.entries)))
+
+
+    def drop(self, key):
+        """
+        Remove the entry <key>. The lock has to be held by the caller.
+        """
+        self.nbytes -= self.entries.pop(key)[1]
+        if self.current.get((key[0], key[3])) == key:
+            del self.current[(key[0], key[3])]
+
+
+    def invalidate(self, name=None):
+        """
+        Remove all entries of the file <name>, or all entries if <name> is None.
+
+        OUTPUT:    int, number of entries removed
+        """
+        with self.lock:
+            if name is None:
+                nentries = len(self.entries)
+                self.entries.clear()
+                self.current.clear()
+                self.nbytes = 0
+                return nentries
+            path = os.path.abspath(name)
+            keys = [key for key in self.entries if key[0] == path]
+            for key in keys:
+                self.drop(key)
+            return len(keys)
+
+
+    def configure(self, maxentries=None, maxbytes=None):
+        """
+        Change the limits of the cache, dropping entries if necessary.
+        """
+        with self.lock:
+            if maxentries is not None:
+                self.maxentries = maxentries
+            if maxbytes is not None:
+                self.maxbytes = maxbytes
+            self.evict()
+
+
+    def cacheInfo(self):
+        """
+        Return the statistics of the cache.
+
+        OUTPUT:    dictionary, hits, misses, entries, bytes, maxentries, maxbytes
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'bytes': self.nbytes,
+                    'maxentries': self.maxentries, 'maxbytes': self.maxbytes}
+
+
+
+HeadCache.shared = HeadCache()
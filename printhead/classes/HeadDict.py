@@ -46,6 +46,9 @@ import string,re
 from glob import glob
 from zlib import crc32
 from math import ceil
+from printhead.classes.StructScan import dataSize
+from printhead.classes.KeyType import KeyType
+from printhead.classes.XmlWriter import XmlWriter
 
 if sys.version_info.major == 3:
     PY_VERSION = 3
@@ -70,12 +73,21 @@ class HeadDict(dict):
     (keyval dictionary) which has the three keys 'Value', 'Comment' and 'Type'. For HIERARCH keywords it contains
     the next level in the hierarchy, where the leaf node contains finally a standard keyval
     dictionary as described above for normal keywords.
+
+    In addition two flat indices are kept as attributes: KEYMAP maps the full keyword
+    name to its keyval dictionary and KEYPOS maps the keyword name to its position,
+    i.e. it is the reverse of the 'index' dictionary. Both are maintained by
+    updateKeyword, deleteKeyIndex, setKeyIndex and sortKeys and allow lookups without
+    walking the hierarchy. If the 'index' dictionary is changed directly KEYPOS is
+    rebuilt on the next lookup which detects the inconsistency.
     """
 
     def __init__(self, number=0, pos=0):
         """
         """
         self.update({'index':{},'cards':{}})
+        self.KEYMAP = {}             # keyword -> keyval dictionary
+        self.KEYPOS = {}             # keyword -> position, reverse of 'index'
         self.POS = pos
         self.NUMBER = number
         self.HEADERSIZE = -1
@@ -133,28 +145,26 @@ class HeadDict(dict):
 
     def setDataSize(self):
         """
-        Calculate and set the DATASIZE variable.
+        Calculate and set the DATASIZE variable. PCOUNT and GCOUNT are taken
+        into account if they are present.
 
         INPUT:     none
         OUTPUT:    int tuple, (datasize, <number of blocks>)
         """
         naxis = int(self.getKeyword('NAXIS')[1])
+        axes = []
+        for ii in range(1, naxis+1):
+            axes.append(int(self.getKeyword("NAXIS" + str(ii))[1]))
         siz = 0
         nblocks = 0
         if (naxis > 0):
-            siz = 1
-            ii  = 1
-            while (ii <= naxis):
-                kk="NAXIS" + str(ii)
-                siz = siz * int(self.getKeyword(kk)[1])
-                ii += 1
-
-
-            siz = siz * abs(int(self.getKeyword('BITPIX')[1]))/8     #calculate data size
-            if PY_VERSION == 3:
-                nblocks = int(siz/2880.+0.5)
-            else:
-                nblocks = long(siz/2880.+0.5)
+            pcount = self.getKeyword('PCOUNT')[1]
+            gcount = self.getKeyword('GCOUNT')[1]
+            siz = dataSize(int(self.getKeyword('BITPIX')[1]), axes,
+                           int(pcount) if pcount != '' else 0,
+                           int(gcount) if gcount != '' else 1,
+                           self.getKeyword('GROUPS')[1] in ('T', True))
+            nblocks = (siz + 2879) // 2880
 
         self.DATASIZE = (siz,nblocks)
 
@@ -176,11 +186,6 @@ class HeadDict(dict):
         try:
             (key,value,comment,typ,index) = keyTuple
             hkeys = key.split()
-
-            fullInd = ''
-            for hk in hkeys:
-                fullInd += "['"+hk+"']"
-
         except:
             return 0
 
@@ -196,18 +201,25 @@ class HeadDict(dict):
 
             if maxInd > (lenInd-1) and not lenInd-1 in self['index']:
                 newInd = lenInd-1
-            elif maxInd > (lenInd-1)  and not len_ind in self['index']:
+            elif maxInd > (lenInd-1)  and not lenInd in self['index']:
                 newInd = maxInd
             elif maxInd > 0 and self['index'][maxInd] == 'END'  and maxInd == lenInd-1:
                 newInd = maxInd
                 del(self['index'][maxInd])
                 maxInd = maxInd+1
                 self['index'].update({maxInd:'END'})
-            eval("testKey['cards']"+fullInd+".update({'Comment':comment,'Value':value,'Type':typ})")
+                self.KEYPOS['END'] = maxInd
+            node = testKey['cards']
+            for hk in hkeys:
+                node = node[hk]
+            node.update({'Comment':comment,'Value':value,'Type':typ})
             testKey.update({'index':{newInd:key}})
         elif force == 1:
             testKey = existKey.copy()
-            eval("testKey['cards']"+fullInd+".update({'Comment':comment,'Value':value,'Type':typ})")
+            node = testKey['cards']
+            for hk in hkeys:
+                node = node[hk]
+            node.update({'Comment':comment,'Value':value,'Type':typ})
         else:
             testKey = existKey
 
@@ -223,13 +235,40 @@ class HeadDict(dict):
         OUTPUT:    node of HD dictionary.
         """
         hkeys = key.split()
-        fullInd = ''
         node = self['cards']
         for hk in hkeys:
             node = node[hk]
         return node
 
 
+    def findNode(self,key):
+        """
+        Return the keyval dictionary of the keyword <key> using the flat
+        keyword map, or None if the keyword does not exist.
+
+        INPUT:     string, keyword
+        OUTPUT:    dictionary or None
+        """
+        node = self.KEYMAP.get(key)
+        if node is None:
+            try:
+                node = self.getNode(key)
+            except (KeyError, TypeError):
+                return None
+            if type(node) == type({}) and 'Value' in node:
+                self.KEYMAP[key] = node
+        return node
+
+
+    def syncIndex(self):
+        """
+        Rebuild the reverse index KEYPOS from the 'index' dictionary.
+        """
+        self.KEYPOS = {}
+        for (ind, key) in self['index'].items():
+            self.KEYPOS.setdefault(key, ind)
+
+
     def getElementType(self,key=''):
         """
         Method returns the type of an element ['node'|'leaf'].
@@ -266,11 +305,10 @@ class HeadDict(dict):
         """
         hkeys = key.split()
 
-        fullInd = ''
         curkey = ''
         exists = 0
         keyDict = HeadDict()
-        node = self['cards'].copy()
+        node = self['cards']
         for hk in hkeys:
             if hk in node and type(node[hk]) == type({}):
                 keys = node[hk].keys()
@@ -279,11 +317,9 @@ class HeadDict(dict):
                 if keys != ('Comment','Value','Type') and hk != hkeys[-1]:
                     if desc == 0:
                         keyDict.getNode(curkey).update({hk:{}})
-#                        eval("keyDict['cards']"+fullInd+".update({hk:{}})")
                 elif keys == ('Comment','Value','Type') or hk == hkeys[-1]:
                     if desc == 0:
                         keyDict.getNode(curkey).update({hk:node})
-#                        eval("keyDict['cards']"+fullInd+".update({hk:node})")
                     else:
                         keyDict['cards'].update(node)
 
@@ -291,7 +327,6 @@ class HeadDict(dict):
                 node = node[hk]
                 if desc == 0:
                     keyDict.getNode(curkey).update({hk:node})
-#                    eval("keyDict['cards']"+fullInd+".update({hk:node})")
                 else:
                     keyDict['cards'].update({hk:node})
 
@@ -303,15 +338,14 @@ class HeadDict(dict):
                     node = {hk:{}}
                 if desc == 0:
                     keyDict.getNode(curkey).update(node)
-#                    eval("keyDict['cards']"+fullInd+".update(node)")
                 else:
                     keyDict['cards'].update(node)
 
-            fullInd += "['"+hk+"']"
             curkey = (curkey+" "+hk).strip()
 
-        if self.getKeyIndex(key) >=0:
-            keyDict['index'].update({self.getKeyIndex(key):key})
+        ind = self.getKeyIndex(key)
+        if ind >=0:
+            keyDict['index'].update({ind:key})
         else:
             keyDict['index'].update({-1:key})
 
@@ -346,19 +380,16 @@ class HeadDict(dict):
         OUTPUT    integer, index of the keyword or -1 if keyword does not exist
         """
 
-        ind = -1
-        try:
-            list(self['index'].values()).index(key)
-            exist = 1
-        except:
-            exist = 0
-
-        if exist:
-            for ind in self['index'].keys():
-                if self['index'][ind] == key:
-                    return ind
-
-        return ind
+        index = self['index']
+        ind = self.KEYPOS.get(key)
+        if ind is not None and index.get(ind) == key:
+            return ind
+        if ind is not None or len(self.KEYPOS) != len(index):
+            self.syncIndex()         # 'index' has been changed directly
+            ind = self.KEYPOS.get(key)
+            if ind is not None:
+                return ind
+        return -1
 
 
     def filter(self,keyexp):
@@ -393,13 +424,12 @@ class HeadDict(dict):
               header from scratch.
         """
 
-        try:
-            pos = list(self['index'].values()).index(key)
-            self['index'].remove(pos)
-            self['index'].update({newind:key})
-        except:
+        ind = self.getKeyIndex(key)
+        if ind < 0:
             return 0
-
+        del(self['index'][ind])
+        self['index'].update({newind:key})
+        self.KEYPOS[key] = newind
         return 1
 
 
@@ -413,6 +443,7 @@ class HeadDict(dict):
         """
         ind = self.getKeyIndex(key)
         del(self['index'][ind])
+        del(self.KEYPOS[key])
         return ind
 
 
@@ -430,31 +461,20 @@ class HeadDict(dict):
         If check is set to 1 and the keyword does not exists, the function
         returns None instead.
         """
-        hkeys = key.split()
-
-        fullInd = ''
-        for hk in hkeys:
-            fullInd += "['"+hk+"']"
-
-
-        try:
-            val = eval("self['cards']"+fullInd+"['Value']")
-        except:
+        node = self.findNode(key)
+        if node is None or type(node) != type({}) or 'Value' not in node:
             if check == 1:
                 return None
-            else:
-                val = ''
-        try:
-            com = eval("self['cards']"+fullInd+"['Comment']")
-        except:
-            com = ''
+            return key,'','','',-1
+        val = node['Value']
+        com = node.get('Comment', '')
         try:
-            if len(str(val)) > 0 and not eval("'Type' in self['cards']"+fullInd):
-                typ = self.getKeyType(key)
-            elif eval("'Type' in self['cards']"+fullInd):
-                typ = eval("self['cards']"+fullInd+"['Type']")
+            if 'Type' in node:
+                typ = node['Type']
                 if typ == '':
-                   typ = self.getKeyType(key)
+                    typ = self.getKeyType(key)
+            elif len(str(val)) > 0:
+                typ = self.getKeyType(key)
             else:
                 typ = ''
         except:
@@ -480,14 +500,14 @@ class HeadDict(dict):
             ind = inds[ii]
             hkeys = key.split()
 
-            fullInd = ''
             curkey = ''
 
             node = keyDict['cards']
             oDict = self.getKeyDict(key,inst=1)
             for hk in hkeys:
                 if 'Value' in oDict.getNode(key=curkey)[hk]:
-                    test = len(oDict.getNode(key=curkey)[hk]['Value'])
+                    oval = oDict.getNode(key=curkey)[hk]['Value']
+                    test = len(oval) if type(oval) in (type(''), type([])) else 1
                 else:
                     test = hk in self.getNode(key=curkey)
                 node = node[hk]
@@ -498,16 +518,106 @@ class HeadDict(dict):
                         self['cards'].update({key:node})
                     self['cards'][key]['Value'].\
                          append(keyDict['cards'][key]['Value'][0])
-                fullInd += "['"+hk+"']"
                 curkey = (curkey+" "+hk).strip()
 
-            if list(self['index'].values()).count(key):
-                dind = self.getKeyIndex(key)
+            dind = self.getKeyIndex(key)
+            if dind >= 0:
                 del(self['index'][dind])
             self['index'].update({ind:key})
+            self.KEYPOS[key] = ind
+            self.KEYMAP.pop(key, None)   # the node may have been replaced
         return 1
 
 
+    def storeCard(self, keyTuple, ind):
+        """
+        Method takes the keyTuple of a parsed header card and stores it at
+        position <ind>. COMMENT, HISTORY and ESO-LOG values are collected
+        into a list.
+
+        INPUT:     keyTuple, (key, value, comment, type, index)
+                   int, position of the card in the header
+        OUTPUT:    none
+        """
+        key = keyTuple[0]
+        if len(key) == 0:
+            return
+        if key in ['COMMENT', 'HISTORY', 'ESO-LOG']:
+            LineDict = {'index':-1,'cards':{key:{'Value':keyTuple[1],\
+                        'Comment':keyTuple[2],'Type':''}}}
+        else:
+            LineDict = self.keyTuple2Dict(keyTuple)
+        LineDict.update({'index':{ind:key}})
+        self.updateKeyword(LineDict)
+
+
+    def addCards(self, cards):
+        """
+        Method stores a list of parsed header cards in one linear pass. The
+        result is the same as calling storeCard for every card: HIERARCH
+        keywords are nested, the values of COMMENT, HISTORY and ESO-LOG
+        cards are collected into a list, for keywords appearing more than
+        once the first value is kept and the last position is used.
+
+        INPUT:     list of keyTuples, (key, value, comment, type, index), where
+                   index is the position of the card in the header
+        OUTPUT:    none
+        """
+        index = self['index']
+        topNode = self['cards']
+        keyPos = self.KEYPOS
+        keyMap = self.KEYMAP
+        for (key, value, comment, typ, ind) in cards:
+            if len(key) == 0:
+                continue
+            if key in ['COMMENT', 'HISTORY', 'ESO-LOG']:
+                if key in topNode:
+                    topNode[key]['Value'].append(value[0])
+                else:
+                    topNode[key] = {'Value':list(value), 'Comment':comment, 'Type':''}
+            else:
+                hkeys = key.split()
+                node = topNode
+                for hk in hkeys[:-1]:
+                    if hk not in node:
+                        node[hk] = {}
+                    node = node[hk]
+                leaf = node.get(hkeys[-1])
+                if leaf is None or ('Value' in leaf and leaf['Value'] in ('', [])):
+                    leaf = {'Comment':comment, 'Value':value, 'Type':typ}
+                    node[hkeys[-1]] = leaf
+                keyMap[key] = leaf
+            if key in keyPos:
+                del(index[keyPos[key]])
+            index[ind] = key
+            keyPos[key] = ind
+
+
+    @staticmethod
+    def fromCards(cards, number=0, pos=0):
+        """
+        Create a HeadDict from a list of parsed header cards in linear time,
+        see addCards.
+
+        INPUT:     list of keyTuples, (key, value, comment, type, index)
+                   int attribute number, number of the header, default 0, optional
+                   int attribute pos, position of the header, default 0, optional
+        OUTPUT:    HeadDict instance
+        """
+        HD = HeadDict(number=number, pos=pos)
+        HD.addCards(cards)
+        return HD
+
+
+    def iterKeywords(self):
+        """
+        Generator producing the keyword tuples (<key>,<value>,<comment>,<type>,-1)
+        in the order of the header.
+        """
+        for ind in sorted(self['index'].keys()):
+            yield self.getKeyword(self['index'][ind])
+
+
     def getKeyPos(self,key):
         """
         Method takes a keyword <key> and returns the position in the original FITS
@@ -518,12 +628,7 @@ class HeadDict(dict):
 
         If the keyword does not exist the output is -1
         """
-        values = list(self['index'].values())
-        keys = list(self['index'].keys())
-        try:
-            return keys[values.index(key)]
-        except:
-            return -1
+        return self.getKeyIndex(key)
 
 
 
@@ -531,76 +636,21 @@ class HeadDict(dict):
         """
         Method updates the keyword dictionary with the derived type
         {<key>:{'Value':<value>,'Comment':<comment>, 'Type':<type>}}
-        where <type> is one out of ['B','C','I','L','F','P', 'R' 'T']
+        where <type> is one out of ['B','C','U','S','I','F','D','R','T'],
+        see KeyType.
 
         INPUT:     string, keyword
         OUTPUT:    string, derived type or blank string if type could not be derived
         """
-        dtRx = re.compile(\
-          "(19\d{2}|2\d{3})\-(0\d|1[012])\-([012]\d|3[01])" + \
-          "([T ]([01]\d|2[0-3])\:[0-5]\d\:[0-5]\d(\.\d+)?)?\s*$")
-
-        hkeys = key.split()
-
-        fullInd = ''
-        for hk in hkeys:
-            fullInd += "['"+hk+"']"
-
-
-        if eval("'Type' in self['cards']"+fullInd):
-            typ = eval("'Type' in self['cards']"+fullInd)
-        else:
-            typ = ""
-        if eval("'Value' in self['cards']"+fullInd):
-
-            val = eval("self['cards']"+fullInd+"['Value']")
-            if typ == 'C' or (type(val) == type('') and val.upper() in reserved):
-                typ = 'C'
-            else:
-                try:
-                  float(val)
-                  value = float(val)
-                  if value != 0 and (abs(value) > 1.0e15 or abs(value) < 1e-15):
-                      typ = 'R'
-                      value = None
-                  dotpos = val.find('.')
-                  if dotpos < 0 and typ != 'R':
-                      try:
-                         iv = int(val)
-                         if iv < 256 and iv >= 0:
-                            typ = 'U'
-                         elif iv < 65536:
-                            typ = 'S'
-                         else:
-                            typ = 'I'
-                      except:
-                         typ = 'L'
-                  elif typ != 'R':
-                      epos = val.upper().find('E')
-                      if epos == -1:
-                         epos = len(val)
-                      else:
-                         ex = int(val[epos+1:])
-                      if dotpos >= 0:
-                         typ = 'F'
-                         if len(val[dotpos+1:epos]) > 15:
-                            typ = 'P'
-                except:
-                    if val == 'T' or val == 'F':
-                        typ = 'B'
-                    else:
-                        typ = 'C'
-            if type(val) == type('') and typ == 'C' and dtRx.match(val):
-                # check for datetime format
-                typ = 'T'
-
-
-            exec("self['cards']"+fullInd+".update({'Type':typ})")
-            return typ
-        else:
-            exec("self['cards']"+fullInd+".update({'Type':''})")
-
+        node = self.findNode(key)
+        if node is None:
             return ''
+        if 'Value' in node:
+            (typ, value) = KeyType.shared.infer(node['Value'], node.get('Type', ''))
+        else:
+            typ = ''
+        node.update({'Type':typ})
+        return typ
 
 
     def sortKeys(self):
@@ -639,6 +689,7 @@ class HeadDict(dict):
 
         maxk = max(self['index'].keys())
         self['index'].update({maxk+1:'END'})
+        self.syncIndex()
 
         return
 
@@ -659,8 +710,7 @@ class HeadDict(dict):
 
         comhist = {'COMMENT':-1,'HISTORY':-1, 'ESO-LOG':-1}
 
-        newind = self['index'].keys()
-        newind.sort()
+        newind = sorted(self['index'].keys())
 
         for ind in newind:
 
@@ -714,20 +764,14 @@ class HeadDict(dict):
 
                 elif key[0:8] == 'HIERARCH':
 
-                    hind = ""
-                    hkeys = key.split()
-
                     fitsLine = key
                     fitsLine = fitsLine + (29 - len(fitsLine)) * ' ' + '= '
-                    for hk in hkeys:
-                        hind = hind + "['" + hk + "']"
+                    node = self.findNode(key)
 
-                        kkeys = eval("self['cards']"+hind+".keys()")
-
-                    if kkeys.count("Value") > 0:
-                        value = str(eval("self['cards']"+hind+"['Value']"))
-                        comment = eval("self['cards']"+hind+"['Comment']")
-                        typ = eval("self['cards']"+hind+"['Type']")
+                    if node is not None and 'Value' in node:
+                        value = str(node['Value'])
+                        comment = node['Comment']
+                        typ = node['Type']
                         if typ != 'C':
                             fitsLine = fitsLine + (43 - len(fitsLine) - \
                                                    len(value)) * ' '
@@ -759,6 +803,7 @@ class HeadDict(dict):
     def XfitsSerialize(self, level=0, indent='   ', pretty=1):
         """
         Method serializes the HD dictionary into a string array. The format is XFits.
+        Use XmlWriter to write the XML directly to a file.
 
         INPUT:     none mandatory
                    int attribute level, >=0 defines the initial indentation level
@@ -767,126 +812,9 @@ class HeadDict(dict):
                                             per level. default '   ', optional
         OUTPUT:    string list, XML (XFits) formatted header
         """
-        if len(self.XmlHead) > 1 and self.XmlHead[0].strip()[:15] == "<HEADER number=":
-            return self.XmlHead
-        openTags = []
-        hflag = 0
-        chlist = {'COMMENT':-1,'HISTORY':-1, 'ESO-LOG':-1}
-        XmlHead = []
-        XmlHead.append(level*indent + '<HEADER number="' + str(self.NUMBER) + '" position="' + \
-                           str(self.POS) + '" datasize="' + str(self.DATASIZE[0]) + '">')
-        level += 1    # indent all the rest...
-        for key in list(self['index'].values()):
-
-# treat all 'normal' keywords
-            rkey = key[0:8].strip()
-            if rkey not in ['HIERARCH', 'COMMENT', 'HISTORY', 'ESO-LOG']:
-                if hflag:
-                    for ot in openTags:
-                        XmlHead.append(level*indent + '</'+ot+'>')
-                        if ot != 'HIERARCH': level = (level - 1) * pretty
-                    openTags = []
-                    hflag = 0
-                if openTags and (openTags[0] in ['COMMENT', 'HISTORY', 'ESO-LOG']):
-                    XmlHead.append(level*indent + '</' + openTags[0] + '>')
-                openTags = [rkey]
-                XmlHead.append(level*indent + '<' + rkey + '>')
-                XmlHead.append((level+1)*indent*pretty + '<Value>' + \
-                               self.getKeyword(rkey)[1] + '</Value>')
-                XmlHead.append((level+1)*indent*pretty + '<Comment>' + \
-                               self.getKeyword(rkey)[2] + '</Comment>')
-                XmlHead.append(level*indent + '</' + rkey + '>')
-                openTags = []
-
-# COMMENT and HISTORY keywords
-
-            elif rkey in ['COMMENT', 'HISTORY', 'ESO-LOG']:
-                chlist[rkey] += 1
-                if hflag:
-                    for ot in openTags:
-                        level = (level - 1) * pretty
-                        XmlHead.append(level*indent + '</'+ot+'>')
-                    openTags = []
-                    hflag = 0
-                if openTags and openTags[0] != rkey:
-                    if len(openTags[0])>0:
-                        XmlHead.append(level*indent + '</' + openTags[0] + '>')
-                    openTags = [rkey]
-                    XmlHead.append(level*indent + '<' + rkey + '>')
-                if type(self.getKeyDict(rkey)) == type({}):
-                    XmlHead.append(self.getKeyword(rkey)[1])
-                elif type(self.getKeyDict(rkey)) == type([]):
-                    XmlHead.append(self.getKeyDict(rkey)[chlist[rkey]][1].strip())
-
-
-
-# HIERARCH keywords are placed in a real XML hierarchy
-
-            elif rkey == 'HIERARCH':
-
-
-# COMMENT and HISTORY and ESO-LOG elements are kept open until another element is found
-# Close COMMENT or HISTORY here if open
-                if openTags and  (openTags[0] in ['COMMENT', 'HISTORY', 'ESO-LOG']):
-                    XmlHead.append(level*indent + '</' + openTags[0] + '>')
-
-
-#hflag controls wheather we are already in a HIERARCH element
-#level controls how deep we are in the element and openTags
-#keeps all the open tags in reverse order
-
-                if not hflag:
-                    level = 2 * pretty
-                    XmlHead.append(level * indent + '<HIERARCH>')
-                    hflag = 1
-                    openTags = ['HIERARCH']
-
-                hind = ""
-                hkeys = key.split()
-#                    oinds = range(len(openTags))
-                oind = 0
-
-#compare current key elements with openTags and close the ones which don't match
-
-                for ot in openTags:
-                    if hkeys.count(ot) == 0:
-                        XmlHead.append(level*indent + '</'+ot+'>')
-                        level -= 1
-                        openTags = openTags[1:]
-                    else:
-                        dum = hkeys.index(ot)
-                        oind = max(oind,dum)
-
-
-                for hk in hkeys[:oind+1]:
-                    hind = hind + "['" + hk + "']"
-
-
-                for hk in hkeys[oind+1:]:
-                    level = (level + 1) * pretty
-                    hind = hind + "['" + hk + "']"
-                    XmlHead.append(level*indent + '<'+hk+'>')
-                    openTags = [hk] + openTags
-
-                    kkeys = eval("self['cards']"+hind+".keys()")
-                    if kkeys.count('Value') > 0:
-                        dum = kkeys.index("Value")
-                        value = eval("self['cards']"+hind+"['Value']")
-                        comment = eval("self['cards']"+hind+"['Comment']")
-                        XmlHead.append((level+1)*indent*pretty + '<Value>' + \
-                                       self.getKeyword(key)[1] + '</Value>')
-                        XmlHead.append((level+1)*indent*pretty + '<Comment>' + \
-                                       self.getKeyword(key)[2]  + '</Comment>')
-                        XmlHead.append(level*indent + '</'+hk+'>')
-                        level = (level - 1) * pretty
-                        openTags = openTags[1:]
-
-# close current <HEADER> element and continue with next
-        level -= 1
-        XmlHead.append(level*indent + '</HEADER>')
-
-
-        return XmlHead
+        writer = XmlWriter(format='xfits', pretty=pretty, indent=indent)
+        self.XmlHead = list(writer.headerLines(self, level))
+        return self.XmlHead
 
 
 
@@ -894,7 +822,8 @@ class HeadDict(dict):
         """
         Method serializes HeadDict and creates a list of XML strings.
         If <pretty> is 1 (default) then the
-        XML file is nicely indented.
+        XML file is nicely indented. Use XmlWriter to write the XML directly
+        to a file.
 
         This version is intended to write VOImage output.
 
@@ -905,158 +834,6 @@ class HeadDict(dict):
                                             per level. default '   ', optional
         OUTPUT:    string list, XML (VOImage) formatted header.
         """
-
-        if len(self.XmlHead) > 1 and self.XmlHead[0].strip()[:13] == "<RESOURCE id=":
-            return self.XmlHead
-        XmlHead = []
-        hflag = 0
-        oind = 0
-        openTags = ['']
-
-        xstr = '<RESOURCE id="' + str(self.NUMBER) + '"'
-        if 'EXTNAME' in self['cards']:
-           xstr = xstr + ' name="' + self['cards']['EXTNAME']['Value'][1:-1] +'"'
-
-        xstr = xstr + ' type="meta">'
-        XmlHead.append(level*indent + xstr)
-
-
-        level += 1
-        XmlHead.append(level*indent + '<INFO name="position" value="' + \
-                       str(self.POS) + '"/>')
-        XmlHead.append(level*indent + '<INFO name="datasize" value="' + \
-                       str(self.DATASIZE[0]) + '"/>')
-        for key in self['index'].values():
-
-# treat all 'normal' keywords
-
-#                if key[0:8] != 'HIERARCH':
-             if key[0:8] != '--------':     # for test we treat all keywords the same
-                 if hflag:
-                     for ot in openTags:
-                         level = (level-1) * pretty
-                         XmlHead.append(level*indent + '</'+ot+'>')
-                     openTags = ['']
-                     hflag = 0
-                 openTags = ['PARAM']
-
-                 (keyword,val,comm,typ,flag) = self.getKeyword(key)
-
-                 if typ == 'I':
-                     voTyp = 'int'
-                 elif typ == 'U':
-                     voTyp = 'unsignedByte'
-                 elif typ == 'S':
-                     voTyp = 'short'
-                 elif typ == 'L':
-                     voTyp = 'long'
-                 elif typ == 'F':
-                     voTyp = 'float'
-                 elif typ == 'D':
-                     voTyp = 'double'
-                 elif typ == 'C':
-                     voTyp = 'char'
-                 elif typ == 'B':
-                     voTyp = 'boolean'
-                 else:
-                     voTyp = ''
-
-                 if type(val) == type(''):
-                    XmlHead.append(level*indent + '<PARAM name="' + \
-                                key + '" value="' + val + '" datatype="' +\
-                                voTyp + '">')
-                    XmlHead.append((level+1)*indent +'<DESCRIPTION>'+\
-                                comm + '</DESCRIPTION>')
-                    XmlHead.append(level*indent + '</PARAM>')
-
-                 elif type(val) == type([]):
-                    for vv in val:
-                        XmlHead.append(level*indent + '<PARAM name="' + \
-                                    key + '" value="' + vv + '" datatype="' +\
-                                    voTyp + '">')
-                        XmlHead.append((level+1)*indent +'<DESCRIPTION>'+\
-                                    comm + '</DESCRIPTION>')
-                        XmlHead.append(level*indent + '</PARAM>')
-
-
-
-# HIERARCH keywords are placed in a real XML hierarchy
-
-#                elif key[0:8] == 'HIERARCH':
-             elif key[0:8] == '--------':
-
-
-#hflag controls whether we are already in a HIERARCH element
-#level controls how deep we are in the element and openTags
-#keeps all the open tags in reverse order
-
-                if not hflag:
-                    XmlHead.append(indent + '<PARAM name="' +\
-                                   key + '" value="' + self[key]['Value'] + '" datatype="' +\
-                                   self[key]['Type'] + '">')
-                    hflag = 1
-                openTags = ['HIERARCH']
-                level = 2 * pretty
-
-                hind = ""
-                hkeys = key.split()
-                oind = 0
-
-#compare current key elements with openTags and close the ones which don't match
-
-                for ot in openTags:
-                    if hkeys.count(ot) == 0:
-                        XmlHead.append(level*indent + '</'+ot+'>')
-                        level -= 1
-                        openTags = openTags[1:]
-                    else:
-                        dum = hkeys.index(ot)
-                        oind = max(oind,dum)
-
-
-                    for hk in hkeys[:oind+1]:
-                        hind = hind + "['" + hk + "']"
-
-
-                    for hk in hkeys[oind+1:]:
-                        level = (level + 1) * pretty
-                        hind = hind + "['" + hk + "']"
-                        XmlHead.append(level*indent + '<'+hk+'>')
-                        openTags = [hk] + openTags
-
-                        kkeys = eval("self"+hind+".keys()")
-                        try:
-                            dum = kkeys.index("Value")
-                            value = eval("self"+hind+"['Value']")
-                            comment = eval("self"+hind+"['Comment']")
-                            XmlHead.append((level+1)*indent*pretty + '<Value>' + \
-                                           value + '</Value>')
-                            XmlHead.append((level+1)*indent*pretty + '<Comment>' + \
-                                           comment + '</Comment>')
-                            XmlHead.append(level*indent + '</'+hk+'>')
-                            level = (level - 1) * pretty
-                            openTags = openTags[1:]
-                        except:
-                            pass
-
-# close current <RESOURCE> element and continue with next
-
-        if self.DATASIZE > 0:
-            XmlHead.append(level*indent + '<TABLE name="data">')
-            level += 1
-            XmlHead.append(level*indent + '<FIELD name="image" type="link" '+\
-                           'arraysize="[]" datatype="integer">')
-            level += 1
-            XmlHead.append(level*indent + '<LINK href="cid:' + str(self.NUMBER) + '"/>')
-            level -= 1
-            XmlHead.append(level*indent + '</FIELD>')
-            level -= 1
-            XmlHead.append(level*indent + '</TABLE>')
-
-        level -= 1
-        XmlHead.append(level*indent + '</RESOURCE>')
-
-
-# put the XML into the object
-
-        return XmlHead
+        writer = XmlWriter(format='vo', pretty=pretty, indent=indent)
+        self.XmlHead = list(writer.headerLines(self, level))
+        return self.XmlHead
@@ -0,0 +1,245 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import os
+import re
+import sqlite3
+import hashlib
+from printhead.classes.FitsHead import FitsHead
+from printhead.classes.FileWalker import FileWalker, _PATTERNS_
+# <keyword> <operator> <value> conditions of the query
+_CONDITION_RX_ = re.compile(r"^\s*(.+?)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$")
+_COMMIT_ = 1000                  # files per transaction
+
+_SCHEMA_ = (
+    """CREATE TABLE IF NOT EXISTS files (
+           id INTEGER PRIMARY KEY,
+           path TEXT UNIQUE NOT NULL,
+           size INTEGER,
+           mtime_ns INTEGER,
+           hhash TEXT,
+           nhdu INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS keywords (
+           file_id INTEGER NOT NULL REFERENCES files(id),
+           ext INTEGER,
+           key_ind INTEGER,
+           key TEXT,
+           value TEXT,
+           comment TEXT,
+           type TEXT,
+           value_num REAL,
+           value_dt TEXT)""",
+    "CREATE INDEX IF NOT EXISTS keywords_file ON keywords(file_id)",
+    "CREATE INDEX IF NOT EXISTS keywords_num ON keywords(key, value_num)",
+    "CREATE INDEX IF NOT EXISTS keywords_val ON keywords(key, value)",
+    "CREATE INDEX IF NOT EXISTS keywords_dt ON keywords(key, value_dt)",
+)
+
+
+class HeadIndex:
+    """
+    Keyword index of a collection of FITS files kept in a SQLite database.
+    The table 'keywords' holds the DBCM rows produced by
+    FitsHead.parseFitsHead2TupleList(forceString=2), i.e. one row per card
+    with the columns ext, key_ind, key, value, comment, type, value_num and
+    value_dt, which refer to the table 'files' containing the path, the size,
+    the modification time and a hash of the headers of each file.
+
+    The index is maintained incrementally: a file is only read again if its
+    size or modification time changed and its rows are only replaced if the
+    hash of its headers changed as well.
+    """
+
+    def __init__(self, dbname):
+        """
+        INPUT:     string, name of the database file, created if it does not exist
+        """
+        self.dbname = dbname
+        self.db = sqlite3.connect(dbname)
+        for stmt in _SCHEMA_:
+            self.db.execute(stmt)
+        self.db.commit()
+
+
+    def close(self):
+        """
+        Commit and close the database.
+        """
+        self.db.commit()
+        self.db.close()
+
+
+    def walk(self, roots, patterns=_PATTERNS_):
+        """
+        Generator producing the absolute paths of all files matching one of
+        <patterns> below the directories <roots>. Names of plain files in
+        <roots> are produced as they are, see FileWalker.
+        """
+        for path in FileWalker(roots, patterns):
+            yield os.path.abspath(path)
+
+
+    def crawl(self, roots, patterns=_PATTERNS_, prune=1, verbose=1):
+        """
+        Bring the index up to date for all files found by walk(<roots>, <patterns>).
+        If <prune> is 1 the entries of files below <roots> which do not exist
+        any more are removed.
+
+        OUTPUT:    dictionary, number of files per status: added, updated,
+                   touched (only size or time changed), unchanged, removed, failed
+        """
+        stats = dict((status, 0) for status in
+                     ('added', 'updated', 'touched', 'unchanged', 'removed', 'failed'))
+        seen = set()
+        for path in self.walk(roots, patterns):
+            seen.add(path)
+            try:
+                status = self.indexFile(path)
+            except Exception as e:
+                status = 'failed'
+                if verbose:
+                    print(e)
+            stats[status] += 1
+            if sum(stats.values()) % _COMMIT_ == 0:
+                self.db.commit()
+        if prune:
+            for root in roots:
+                if not os.path.isdir(root):
+                    continue
+                prefix = os.path.join(os.path.abspath(root), '')
+                for (fid, path) in self.db.execute(
+                        "SELECT id, path FROM files WHERE substr(path, 1, ?) = ?",
+                        (len(prefix), prefix)).fetchall():
+                    if path not in seen and not os.path.exists(path):
+                        self.removeFile(fid)
+                        stats['removed'] += 1
+        self.db.commit()
+        return stats
+
+
+    def indexFile(self, path):
+        """
+        Add or update the rows of the file <path>.
+
+        OUTPUT:    string, 'added', 'updated', 'touched' or 'unchanged'
+        """
+        st = os.stat(path)
+        mtime = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        row = self.db.execute("SELECT id, size, mtime_ns, hhash FROM files WHERE path = ?",
+                              (path,)).fetchone()
+        if row is not None and row[1] == st.st_size and row[2] == mtime:
+            return 'unchanged'
+        (hhash, nhdu, rows) = self.headerRows(path)
+        if row is not None and row[3] == hhash:
+            self.db.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?",
+                            (st.st_size, mtime, row[0]))
+            return 'touched'
+        if row is None:
+            fid = self.db.execute(
+                "INSERT INTO files (path, size, mtime_ns, hhash, nhdu) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_size, mtime, hhash, nhdu)).lastrowid
+            status = 'added'
+        else:
+            fid = row[0]
+            self.db.execute("DELETE FROM keywords WHERE file_id = ?", (fid,))
+            self.db.execute("UPDATE files SET size = ?, mtime_ns = ?, hhash = ?, nhdu = ? "
+                            "WHERE id = ?", (st.st_size, mtime, hhash, nhdu, fid))
+            status = 'updated'
+        self.db.executemany("INSERT INTO keywords VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(fid,) + rr for rr in rows])
+        return status
+
+
+    def headerRows(self, path):
+        """
+        Read all headers of the file <path> and return the tuple
+        (<header hash>, <number of HDUs>, <list of keyword rows>), where the
+        rows contain the DBCM columns following the file id.
+        """
+        pH = FitsHead(path, struct=1, show=99)
+        pH.close()
+        digest = hashlib.sha1()
+        for head in pH.HEAD:
+            digest.update(bytes(head))
+        rows = []
+        for hrows in pH.parseFitsHead2TupleList(forceString=2):
+            for rr in hrows:
+                num = float(rr[8]) if rr[8] != '' else None
+                rows.append((int(rr[2]), int(rr[3]), rr[4], rr[5], rr[6], rr[7], num,
+                             rr[9] or None))
+        return (digest.hexdigest(), len(pH.HEAD), rows)
+
+
+    def removeFile(self, fid):
+        """
+        Remove the file with the id <fid> and its rows from the index.
+        """
+        self.db.execute("DELETE FROM keywords WHERE file_id = ?", (fid,))
+        self.db.execute("DELETE FROM files WHERE id = ?", (fid,))
+
+
+    def parseCondition(self, cond):
+        """
+        Split the condition <cond> of the form <keyword><operator><value>,
+        e.g. "EXPTIME>600" or "OBJECT='X'", into the tuple (<keyword>,
+        <operator>, <value>), where <value> is a float for numeric values.
+        """
+        m = _CONDITION_RX_.match(cond)
+        if m is None:
+            errMsg = "Invalid condition: %s" % cond
+            raise Exception(errMsg)
+        (key, op, value) = m.groups()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+            return (key, op, value[1:-1].strip())
+        try:
+            return (key, op, float(value))
+        except ValueError:
+            return (key, op, value)
+
+
+    def query(self, conditions):
+        """
+        Return the paths of the files having a header which fulfills all the
+        <conditions>, see parseCondition. Numeric values are compared with the
+        numeric value of the keyword, all others with the value string. Only
+        files matching the first condition have to be looked at, thus the most
+        selective condition should come first.
+
+        INPUT:     string list, conditions
+        OUTPUT:    list of tuples, (<path>, <HDU number>)
+        """
+        if len(conditions) == 0:
+            errMsg = "No query condition given"
+            raise Exception(errMsg)
+        joins = []
+        params = []
+        for (ii, cond) in enumerate(conditions):
+            (key, op, value) = self.parseCondition(cond)
+            column = 'value_num' if type(value) == type(0.0) else 'value'
+            alias = 'k%d' % ii
+            if ii == 0:
+                on = "k0.file_id = f.id"
+            else:
+                on = "%s.file_id = k0.file_id AND %s.ext = k0.ext" % (alias, alias)
+            joins.append("JOIN keywords %s ON %s AND %s.key = ? AND %s.%s %s ?" %
+                         (alias, on, alias, alias, column, op))
+            params += [key, value]
+        sql = "SELECT DISTINCT f.path, k0.ext FROM files f %s ORDER BY f.path, k0.ext" % \
+            ' '.join(joins)
+        return self.db.execute(sql, params).fetchall()
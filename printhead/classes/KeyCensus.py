@@ -0,0 +1,167 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+from collections import Counter
+from printhead.classes.FitsHead import FitsHead
+
+_INTEGER_ = ('U', 'S', 'I')
+_NUMERIC_ = _INTEGER_ + ('F', 'D')
+_COMMENTARY_ = ('COMMENT', 'HISTORY', 'ESO-LOG')
+_MAXVALUES_ = 1000               # distinct values counted per keyword
+
+
+class KeyCensus:
+    """
+    Keyword statistics of a collection of FITS headers. For every keyword
+    the census keeps
+
+        the number of headers containing it,
+        the number of cards per type code, see KeyType,
+        the minimum and maximum of the numeric values,
+        the number of occurrences of its values.
+
+    Only the first <maxvalues> distinct values of a keyword are counted, all
+    others are summed up as 'other', which bounds the memory for keywords
+    like DATE-OBS with a different value in every header. Commentary
+    keywords (COMMENT, HISTORY, ESO-LOG) are counted but their values are not.
+
+    Instances are picklable and can be merged, thus the files can be split
+    among worker processes, each one producing a partial census, which are
+    combined at the end, see functions.census.
+    """
+
+    def __init__(self, maxvalues=_MAXVALUES_):
+        """
+        INPUT:     int attribute maxvalues, distinct values counted per keyword,
+                                            default 1000, optional
+        """
+        self.maxvalues = maxvalues
+        self.keys = {}           # key: [<headers>, <types>, <min>, <max>, <values>, <other>]
+        self.nfiles = 0
+        self.nheads = 0
+        self.errors = []         # messages of files which could not be read
+
+
+    def entry(self, key):
+        """
+        Return the statistics entry of <key>, creating it if necessary.
+        """
+        entry = self.keys.get(key)
+        if entry is None:
+            entry = [0, Counter(), None, None, Counter(), 0]
+            self.keys[key] = entry
+        return entry
+
+
+    def addFile(self, name, mode=1, cache=''):
+        """
+        Add all headers of the file <name>. Errors are not raised but
+        recorded in self.errors.
+        """
+        try:
+            pH = FitsHead(name, show=99, struct=1, mode=mode, cache=cache)
+            pH.close()
+        except Exception as e:
+            self.errors.append(str(e))
+            return
+        for head in pH.HEAD:
+            self.addHeader(pH.parseBlock(head, raw=1))
+        self.nfiles += 1
+
+
+    def addHeader(self, tupleList):
+        """
+        Add a header given as list of (key, value, comment, type, index)
+        tuples with raw values, see FitsHead.parseBlock.
+        """
+        seen = set()
+        for (key, value, comment, typ, ind) in tupleList:
+            if not key or key == 'END':
+                continue
+            entry = self.entry(key)
+            if key not in seen:
+                seen.add(key)
+                entry[0] += 1
+            entry[1][typ] += 1
+            if key in _COMMENTARY_:
+                continue
+            if typ in _NUMERIC_:
+                num = int(value) if typ in _INTEGER_ else float(value)
+                if entry[2] is None or num < entry[2]:
+                    entry[2] = num
+                if entry[3] is None or num > entry[3]:
+                    entry[3] = num
+            self.countValue(entry, value, 1)
+        self.nheads += 1
+
+
+    def countValue(self, entry, value, n):
+        """
+        Count <n> occurrences of <value> in <entry>, as far as the number
+        of distinct values permits.
+        """
+        values = entry[4]
+        if value in values or len(values) < self.maxvalues:
+            values[value] += n
+        else:
+            entry[5] += n
+
+
+    def merge(self, other):
+        """
+        Add the statistics of the KeyCensus <other> to this one.
+        """
+        for (key, oentry) in other.keys.items():
+            entry = self.entry(key)
+            entry[0] += oentry[0]
+            entry[1].update(oentry[1])
+            if oentry[2] is not None and (entry[2] is None or oentry[2] < entry[2]):
+                entry[2] = oentry[2]
+            if oentry[3] is not None and (entry[3] is None or oentry[3] > entry[3]):
+                entry[3] = oentry[3]
+            for (value, n) in oentry[4].most_common():
+                self.countValue(entry, value, n)
+            entry[5] += oentry[5]
+        self.nfiles += other.nfiles
+        self.nheads += other.nheads
+        self.errors += other.errors
+        return self
+
+
+    def lines(self, top=5):
+        """
+        Return the census as tab separated lines, one per keyword ordered by
+        the number of headers containing it, with the columns keyword,
+        headers, types, minimum, maximum and the <top> most frequent values.
+        The types and values are given as <item>:<count> separated by ', '.
+
+        OUTPUT:    list of strings
+        """
+        lines = ['#keyword\theaders\ttypes\tmin\tmax\tvalues\n']
+        for key in sorted(self.keys, key=lambda k: (-self.keys[k][0], k)):
+            (nheads, types, vmin, vmax, values, other) = self.keys[key]
+            types = ', '.join(['%s:%d' % tn for tn in sorted(types.items(),
+                                                             key=lambda tn: (-tn[1], tn[0]))])
+            freq = ['%s:%d' % vn for vn in values.most_common(top)]
+            if other:
+                freq.append('*other*:%d' % other)
+            lines.append('%s\t%d\t%s\t%s\t%s\t%s\n' % (key, nheads, types,
+                         '' if vmin is None else str(vmin),
+                         '' if vmax is None else str(vmax), ', '.join(freq)))
+        return lines
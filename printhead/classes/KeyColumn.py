@@ -0,0 +1,136 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+from array import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# array type code per column type
+_ARRAYTYPE_ = {'B': 'b', 'I': 'q', 'F': 'd'}
+_INTEGER_ = ('U', 'S', 'I')
+_NUMERIC_ = _INTEGER_ + ('F', 'D', 'R')
+
+
+class KeyColumn:
+    """
+    The values of one keyword across many headers, typed according to the
+    KeyType codes of the values (see FitsHead.getKeyType):
+
+        'B':            values is an array of type 'b' (0 or 1)
+        'I':            values is an array of type 'q' (64 bit integer), for
+                        values of the types 'U', 'S' and 'I'
+        'F':            values is an array of type 'd' (double), for values
+                        of the types 'F', 'D' and 'R' and mixed numeric types
+        'T':            string column of datetime values
+        'C':            string column
+
+    Mixtures of other types give a string column with the values as found
+    in the headers. The arrays are NumPy arrays if NumPy is installed, else
+    array.array instances.
+
+    String columns are dictionary encoded: values holds the index of each
+    value in the list categories, which keeps repeating values like
+    instrument names or object types compact.
+
+    mask holds 1 for the rows without a value, i.e. the keyword, the HDU or
+    the file is missing. The entries of values are 0 for those rows.
+    """
+
+    def __init__(self, key, cells):
+        """
+        INPUT:     string, keyword name
+                   list of (<type code>, <raw value string>) tuples, None for
+                   missing values
+        """
+        self.key = key
+        types = set([cell[0] for cell in cells if cell is not None])
+        if not types:
+            self.type = 'C'
+        elif types <= set(_INTEGER_):
+            self.type = 'I'
+        elif types <= set(_NUMERIC_):
+            self.type = 'F'
+        elif types == set('B'):
+            self.type = 'B'
+        elif types == set('T'):
+            self.type = 'T'
+        else:
+            self.type = 'C'
+        mask = array('b', [cell is None for cell in cells])
+        if self.type in _ARRAYTYPE_:
+            convert = self.converter()
+            values = array(_ARRAYTYPE_[self.type],
+                           [0 if cell is None else convert(cell[1]) for cell in cells])
+            self.categories = None
+        else:
+            index = {}
+            self.categories = []
+            codes = []
+            for cell in cells:
+                if cell is None:
+                    codes.append(0)
+                    continue
+                code = index.get(cell[1])
+                if code is None:
+                    code = index[cell[1]] = len(self.categories)
+                    self.categories.append(cell[1])
+                codes.append(code)
+            values = array('l', codes)
+        if numpy is not None:
+            values = numpy.frombuffer(values, dtype=values.typecode).copy()
+            mask = numpy.frombuffer(mask, dtype=numpy.int8).astype(bool)
+        self.values = values
+        self.mask = mask
+
+
+    def converter(self):
+        """
+        Return the function converting a raw value string into the column type.
+        """
+        if self.type == 'B':
+            return lambda val: val == 'T'
+        if self.type == 'I':
+            return int
+        return float
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def __getitem__(self, ind):
+        """
+        Return the value of row <ind>, None if it is missing.
+        """
+        if self.mask[ind]:
+            return None
+        if self.categories is not None:
+            return self.categories[self.values[ind]]
+        if self.type == 'B':
+            return bool(self.values[ind])
+        return self.values[ind].item() if numpy is not None else self.values[ind]
+
+
+    def tolist(self):
+        """
+        Return the values as list, with None for the missing ones.
+        """
+        return [self[ind] for ind in range(len(self))]
@@ -0,0 +1,182 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import re
+import ast
+from functools import lru_cache
+
+# `quoted` keyword names, e.g. `DATE-OBS` or `HIERARCH ESO DET CHIP ID`
+_QUOTED_RX_ = re.compile(r"`([^`]+)`")
+# syntax elements allowed in a filter expression
+_NODES_ = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub,
+           ast.UAdd, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Eq,
+           ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Name,
+           ast.Load, ast.Tuple, ast.List) + \
+          tuple([getattr(ast, name) for name in ('Constant', 'Num', 'Str', 'NameConstant')
+                 if hasattr(ast, name)])
+_CONSTANTS_ = ('True', 'False', 'None')
+
+
+class Missing:
+    """
+    Value of keywords which are not found in a header. All comparisons with
+    it are false and arithmetic with it gives Missing again.
+    """
+    def __eq__(self, other):
+        return False
+    __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __eq__
+
+    def __contains__(self, other):
+        return False
+
+    def __add__(self, other):
+        return self
+    __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = __add__
+    __truediv__ = __rtruediv__ = __neg__ = __pos__ = __add__
+
+    def __bool__(self):
+        return False
+
+    def __hash__(self):
+        return 0
+
+_MISSING_ = Missing()
+
+
+class KeyFilter:
+    """
+    Header selection by a Python style boolean expression on keyword values,
+    e.g.
+
+        EXPTIME > 600 and XTENSION == 'IMAGE'
+        `HIERARCH ESO DET CHIP ID` in ('ccd1', 'ccd2') or NAXIS == 0
+
+    Keyword names which are not valid identifiers are enclosed in backquotes.
+    Only comparisons, boolean and arithmetic operators and constants are
+    allowed. The values are converted according to their type (see KeyType),
+    i.e. integer, float, string or boolean, and comparisons with keywords
+    missing in the header or with values of an incompatible type are false.
+
+    The expression is compiled once. It is split into its top level 'and'
+    terms and the terms referring to a single keyword are tested as soon as
+    the card of the keyword is found while the header is read (see card),
+    thus a header is rejected at its first failing card and its remaining
+    cards are not even parsed. The other terms are evaluated at the end of
+    the header (see match).
+    """
+
+    def __init__(self, expr):
+        """
+        INPUT:     string, filter expression
+        """
+        self.expr = expr
+        names = {}
+
+        def quoted(m):
+            name = '_k%d_' % len(names)
+            names[name] = m.group(1).strip()
+            return name
+
+        try:
+            tree = ast.parse(_QUOTED_RX_.sub(quoted, expr.strip()), mode='eval')
+        except SyntaxError as e:
+            errMsg = "Invalid filter expression %s: %s" % (expr, e.msg)
+            raise Exception(errMsg)
+        for node in ast.walk(tree):
+            if not isinstance(node, _NODES_):
+                errMsg = "Invalid filter expression %s: %s not allowed" % \
+                         (expr, type(node).__name__)
+                raise Exception(errMsg)
+        body = tree.body
+        if isinstance(body, ast.BoolOp) and isinstance(body.op, ast.And):
+            terms = body.values
+        else:
+            terms = [body]
+        self.terms = []              # (<keywords>, <code>) per term
+        self.keys = {}               # keyword: variable name in the code
+        self.single = {}             # keyword: codes of the terms only using it
+        for term in terms:
+            keys = []
+            for node in ast.walk(term):
+                if isinstance(node, ast.Name) and node.id not in _CONSTANTS_:
+                    key = names.get(node.id, node.id)
+                    self.keys[key] = node.id
+                    if key not in keys:
+                        keys.append(key)
+            code = compile(ast.Expression(body=term), '<where>', 'eval')
+            self.terms.append((keys, code))
+            if len(keys) == 1:
+                self.single.setdefault(keys[0], []).append(code)
+
+
+    def __reduce__(self):
+        # code objects can't be pickled, the workers compile the expression again
+        return (KeyFilter.compiled, (self.expr,))
+
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def compiled(expr):
+        """
+        Return the KeyFilter of <expr>, compiled only once per process.
+        """
+        return KeyFilter(expr)
+
+
+    def evaluate(self, code, values):
+        """
+        Evaluate the compiled term <code> with the keyword values <values>.
+        """
+        try:
+            return bool(eval(code, {'__builtins__': {}}, values))
+        except (TypeError, ZeroDivisionError):
+            return False
+
+
+    def card(self, values, key, value):
+        """
+        Add the value of the keyword <key> to the dictionary <values> of the
+        current header and test the terms referring only to <key>.
+
+        OUTPUT:    int, 0 if the header is rejected, else 1
+        """
+        name = self.keys[key]
+        if name in values:               # only the first card of a keyword counts
+            return 1
+        values[name] = value
+        for code in self.single.get(key, ()):
+            if not self.evaluate(code, values):
+                return 0
+        return 1
+
+
+    def match(self, values):
+        """
+        Test the header with the keyword values <values> collected by card
+        at its end, missing keywords are set to Missing.
+
+        OUTPUT:    int, 1 if the header is selected, else 0
+        """
+        for (key, name) in self.keys.items():
+            if name not in values:
+                values[name] = _MISSING_
+        for (keys, code) in self.terms:
+            if not self.evaluate(code, values):
+                return 0
+        return 1
@@ -0,0 +1,148 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import re
+from functools import lru_cache
+
+# regexp for dateTime type
+_DATETIME_RX_ = re.compile(
+    r"(19\d{2}|2\d{3})\-(0\d|1[012])\-([012]\d|3[01])"
+    r"([T ]([01]\d|2[0-3])\:[0-5]\d\:[0-5]\d(\.\d+)?)?\s*$")
+
+# reserved words, which would lead to the wrong type...
+_RESERVED_ = ('INFINITY', 'INF', 'NAN')
+
+
+class KeyType:
+    """
+    Type inference for FITS keyword values shared by FitsHead and HeadDict.
+    The type code is one out of
+
+        'B':    boolean
+        'C':    character
+        'U':    tiny int unsigned (0 >= value < 256)
+        'S':    short (-65536 < value < +65536)
+        'I':    integer
+        'F':    float (up to 15 decimals)
+        'D':    double (more than 15 decimals)
+        'R':    out of range float (abs(value) > 1e15 or < 1e-15), the value is
+                not converted
+        'T':    datetime string (ISO)
+
+    The same value strings (T, 0, IMAGE, dates, exposure times...) repeat
+    over and over in the headers of an archive, thus the results are kept
+    in a bounded LRU cache keyed on the raw value string. A single shared
+    instance is available as KeyType.shared.
+    """
+
+    def __init__(self, maxsize=65536):
+        """
+        INPUT:     int attribute maxsize, maximum number of cached value strings,
+                                          default 65536, optional
+        """
+        self.lookup = lru_cache(maxsize=maxsize)(self.inferString)
+
+
+    def infer(self, val, typ=''):
+        """
+        Derive the type of the keyword value <val> and convert it accordingly.
+
+        INPUT:     string or already converted value
+                   string attribute typ, 'C' for values which were quoted in the
+                                         header, default '', optional
+        OUTPUT:    tuple, (<type code>, <converted value>)
+        """
+        if type(val) == type(''):
+            return self.lookup(val, typ == 'C')
+        return self.inferValue(val)
+
+
+    def inferString(self, val, quoted=0):
+        """
+        Uncached type inference of the value string <val>, see infer.
+        """
+        if quoted or val.upper() in _RESERVED_:
+            typ = 'C'
+            value = val
+        else:
+            try:
+                value = float(val)
+            except ValueError:
+                value = None
+            if value is None:
+                if val == 'T' or val == 'F':
+                    return ('B', val == 'T')
+                typ = 'C'
+                value = val
+            elif value != 0 and (abs(value) > 1.0e15 or abs(value) < 1e-15):
+                return ('R', None)
+            elif val.find('.') < 0:
+                try:
+                    value = int(val)
+                except ValueError:   # exponential notation without a dot
+                    return ('F', value)
+                if value < 256 and value >= 0:
+                    return ('U', value)
+                elif value > -65536 and value < 65536:
+                    return ('S', value)
+                return ('I', value)
+            else:
+                epos = val.upper().find('E')
+                if epos == -1:
+                    epos = len(val)
+                if len(val[val.find('.')+1:epos]) > 15:
+                    return ('D', value)
+                return ('F', value)
+        if _DATETIME_RX_.match(val):
+            typ = 'T'
+        return (typ, value)
+
+
+    def inferValue(self, val):
+        """
+        Derive the type code of an already converted value. Lists (the
+        values of COMMENT, HISTORY and ESO-LOG) are of type 'C'.
+        """
+        if val is True or val is False:
+            return ('B', val)
+        if type(val) == type(0):
+            return self.lookup(str(val), False)
+        if type(val) == type(0.0):
+            return ('F', val)
+        if val is None:
+            return ('R', val)
+        return ('C', val)
+
+
+    def cacheInfo(self):
+        """
+        Return the hit/miss statistics of the cache.
+        """
+        return self.lookup.cache_info()
+
+
+    def clear(self):
+        """
+        Empty the cache.
+        """
+        self.lookup.cache_clear()
+
+
+
+KeyType.shared = KeyType()
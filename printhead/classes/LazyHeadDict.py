@@ -0,0 +1,202 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+from printhead.classes.HeadDict import HeadDict
+
+_CARDSIZE_ = 80
+_SPECIAL_ = (b'COMMENT', b'HISTORY', b'END', b'ESO-LOG')
+_LISTKEYS_ = ['COMMENT', 'HISTORY', 'ESO-LOG']
+
+
+class LazyHeadDict(HeadDict):
+    """
+    HeadDict variant which keeps the raw header bytes together with a table
+    of the card offsets of every keyword. On creation only the keyword names
+    are extracted from the cards in order to fill the 'index' dictionary.
+    A card is parsed (including the type inference) only when it is touched
+    by getKeyword, getKeyType, getKeyPos or iterKeywords and the result is
+    memoized.
+
+    Any access to the 'cards' dictionary, either directly or through one of
+    the HeadDict methods working on the nested structure (updateKeyword,
+    Serialize, ...), parses the whole header first, see parseAll. Note that
+    dictionary methods which do not go through item access (get, items,
+    values, copy) see an empty 'cards' dictionary as long as the header is
+    not parsed completely.
+    """
+
+    def __init__(self, head, number=0, pos=0, parser=None):
+        """
+        INPUT:     HeadBuffer, string or bytes, header cards
+                   int attribute number, number of the header, default 0, optional
+                   int attribute pos, position of the header, default 0, optional
+                   function attribute parser, function parsing a single card and
+                             returning the tuple (key, value, comment, type, index),
+                             e.g. FitsHead.parseFitsCard
+        """
+        HeadDict.__init__(self, number=number, pos=pos)
+        if parser is None:
+            errMsg = "LazyHeadDict requires a card parser"
+            raise Exception(errMsg)
+        if type(head) == type(''):
+            head = head.encode('latin-1')
+        else:
+            head = bytes(head)       # no copy for bytes and HeadBuffer
+        self.RAW = head
+        self.parser = parser
+        self.OFFSETS = {}            # keyword -> list of card offsets
+        self.PARSED = {}             # card offset -> parsed key tuple
+        self.KEYS = {}               # keyword -> memoized keyword tuple
+        self.PENDING = 1             # the 'cards' dictionary is not filled yet
+        index = dict.__getitem__(self, 'index')
+        last = {}
+        for off in range(0, len(head) - _CARDSIZE_ + 1, _CARDSIZE_):
+            key = self.cardKey(head[off:off+_CARDSIZE_])
+            if not key:
+                continue
+            if key in self.OFFSETS:
+                self.OFFSETS[key].append(off)
+                del(index[last[key]])
+            else:
+                self.OFFSETS[key] = [off]
+            last[key] = off // _CARDSIZE_
+            index[last[key]] = key
+
+
+    def __getitem__(self, key):
+        if key == 'cards' and self.PENDING:
+            self.parseAll()
+        return dict.__getitem__(self, key)
+
+
+    def cardKey(self, card):
+        """
+        Return the keyword name of the raw <card> without parsing the value.
+
+        INPUT:     bytes, single header card
+        OUTPUT:    string, keyword or empty string for blank cards
+        """
+        if card[:1] == b' ':
+            return ''
+        for sk in _SPECIAL_:
+            if card.startswith(sk):
+                return sk.decode()
+        eqind = card.find(b'=')
+        if eqind < 0:
+            return card[:8].strip().decode('latin-1')
+        return card[:eqind].strip().decode('latin-1')
+
+
+    def parseCard(self, off):
+        """
+        Return the parsed key tuple of the card at offset <off>.
+        """
+        if off not in self.PARSED:
+            card = self.RAW[off:off+_CARDSIZE_].decode('latin-1')
+            self.PARSED[off] = self.parser(card)
+        return self.PARSED[off]
+
+
+    def parseKey(self, key):
+        """
+        Parse the card(s) of keyword <key> and return the keyword tuple
+        (<key>,<value>,<comment>,<type>,-1) or None if the keyword does not
+        exist. Like in the fully parsed HeadDict the values of COMMENT,
+        HISTORY and ESO-LOG cards are collected into a list and for keywords
+        appearing more than once the first value is used.
+        """
+        if key in self.KEYS:
+            return self.KEYS[key]
+        offs = self.OFFSETS.get(key)
+        if offs is None:
+            return None
+        if key in _LISTKEYS_:
+            value = [self.parseCard(off)[1][0] for off in offs]
+            result = (key, value, '', 'C', -1)
+        else:
+            keyTuple = self.parseCard(offs[0])
+            result = (key, keyTuple[1], keyTuple[2], keyTuple[3], -1)
+        self.KEYS[key] = result
+        return result
+
+
+    def parseAll(self):
+        """
+        Parse all remaining cards and fill the nested 'cards' dictionary.
+        Afterwards the instance behaves exactly like a HeadDict created by
+        FitsHead.parseHeader.
+        """
+        if not self.PENDING:
+            return
+        self.PENDING = 0
+        dict.__setitem__(self, 'index', {})   # rebuilt by addCards
+        self.KEYPOS = {}
+        cards = []
+        for off in range(0, len(self.RAW) - _CARDSIZE_ + 1, _CARDSIZE_):
+            if self.RAW[off:off+1] == b' ':
+                continue
+            cards.append(self.parseCard(off)[:4] + (off // _CARDSIZE_,))
+        self.addCards(cards)
+
+
+    def getKeyword(self,key,check=0):
+        """
+        Method takes a keyword <key> and returns a tuple of the form
+        (<key>,<value>,<comment>,<type>,-1). Only the card(s) of <key> are
+        parsed.
+
+        If the keyword does not exist the strings in the tuple are empty.
+
+        If check is set to 1 and the keyword does not exists, the function
+        returns None instead.
+        """
+        if not self.PENDING:
+            return HeadDict.getKeyword(self, key, check=check)
+        result = self.parseKey(key)
+        if result is None:
+            if check == 1:
+                return None
+            return key,'','','',-1
+        return result
+
+
+    def getKeyType(self,key):
+        """
+        Method returns the derived type of the keyword <key> or a blank string
+        if the type could not be derived.
+        """
+        if not self.PENDING:
+            return HeadDict.getKeyType(self, key)
+        result = self.parseKey(key)
+        if result is None:
+            return ''
+        return result[3]
+
+
+    def getKeyPos(self,key):
+        """
+        Method takes a keyword <key> and returns the position in the original FITS
+        header or -1 if the keyword does not exist.
+        """
+        if not self.PENDING:
+            return HeadDict.getKeyPos(self, key)
+        if key not in self.OFFSETS:
+            return -1
+        self.parseKey(key)
+        return self.OFFSETS[key][-1] // _CARDSIZE_
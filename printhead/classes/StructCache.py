@@ -0,0 +1,118 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import os
+import json
+import hashlib
+
+
+class StructCache:
+    """
+    Persistent on-disk cache of the HDU structure of FITS files. For every
+    file a small JSON document is kept in the cache directory, which contains
+    the structure table of the file, i.e. one entry per HDU of the form
+
+        {'pos':<header position>, 'datapos':<data position>,
+         'datasize':<data size in bytes>,
+         'keys':[[<index>,<key>,<value>,<comment>,<type>],...]}
+
+    where 'keys' holds the mandatory keywords of the header. The entries are
+    keyed on the path of the file and are only valid as long as the size and
+    the modification time of the file are unchanged.
+    """
+
+    def __init__(self, cachedir):
+        """
+        INPUT:     string, directory holding the cache files. It is created
+                   if it does not exist.
+        """
+        self.cachedir = cachedir
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+
+    def fileKey(self, name):
+        """
+        Return the cache key of the file <name>.
+
+        INPUT:     string, file name
+        OUTPUT:    tuple, (<absolute path>, <size>, <mtime>)
+        """
+        path = os.path.abspath(name)
+        st = os.stat(path)
+        mtime = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        return (path, st.st_size, mtime)
+
+
+    def cacheFile(self, path):
+        """
+        Return the name of the cache file for the absolute <path>.
+        """
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cachedir, digest + '.json')
+
+
+    def get(self, name):
+        """
+        Return the cached structure table of the file <name> or None if there
+        is no valid entry.
+
+        INPUT:     string, file name
+        OUTPUT:    list of HDU entries or None
+        """
+        try:
+            (path, size, mtime) = self.fileKey(name)
+            with open(self.cacheFile(path)) as f:
+                entry = json.load(f)
+        except (EnvironmentError, ValueError):
+            return None
+        if entry.get('path') != path or entry.get('size') != size or \
+           entry.get('mtime') != mtime:
+            return None
+        return entry['hdus']
+
+
+    def put(self, name, table):
+        """
+        Store the structure table of the file <name>.
+
+        INPUT:     string, file name
+                   list of HDU entries
+        OUTPUT:    1 if successful, 0 else
+        """
+        try:
+            (path, size, mtime) = self.fileKey(name)
+            cfile = self.cacheFile(path)
+            tmp = '%s.%d' % (cfile, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'path':path, 'size':size, 'mtime':mtime, 'hdus':table}, f)
+            os.rename(tmp, cfile)
+        except (EnvironmentError, TypeError, ValueError):
+            return 0
+        return 1
+
+
+    def invalidate(self, name):
+        """
+        Remove the cache entry of the file <name>, if any.
+        """
+        try:
+            os.remove(self.cacheFile(os.path.abspath(name)))
+        except EnvironmentError:
+            pass
@@ -0,0 +1,363 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+import os
+import threading
+from zlib import crc32
+from concurrent.futures import Future, ThreadPoolExecutor
+from printhead.classes.FitsChecksum import FitsChecksum
+
+_BLOCKSIZE_ = 2880
+_CHUNKSIZE_ = 4194304            # bytes per CRC32 step
+_THREADS_ = min(8, os.cpu_count() or 1)
+_LOCAL_ = threading.local()      # per-thread read buffer of dataCrc
+_CARDSIZE_ = 80
+_ENDCARD_ = b'END     '
+
+# keywords which may appear in the leading mandatory part of a header
+_MANDATORY_ = (b'SIMPLE  ', b'XTENSION', b'BITPIX  ', b'NAXIS', b'PCOUNT  ',
+               b'GCOUNT  ', b'EXTEND  ', b'GROUPS  ')
+
+
+def dataSize(bitpix, axes, pcount=0, gcount=1, groups=0):
+    """
+    Return the size in bytes of the data part described by the mandatory
+    keywords following the FITS standard:
+
+        |BITPIX|/8 * GCOUNT * (PCOUNT + NAXIS1 * NAXIS2 * ... * NAXISn)
+
+    For random groups (GROUPS = T and NAXIS1 = 0) NAXIS1 is omitted
+    from the product.
+
+    INPUT:     int, BITPIX
+               int list, NAXIS1 ... NAXISn
+               int attribute pcount, default 0, optional
+               int attribute gcount, default 1, optional
+               int attribute groups, default 0, optional
+    OUTPUT:    int, size in bytes without padding
+    """
+    if len(axes) == 0:
+        return 0
+    if groups and axes[0] == 0:
+        axes = axes[1:]
+    siz = 1
+    for na in axes:
+        siz *= na
+    return abs(bitpix) // 8 * gcount * (pcount + siz)
+
+
+def dataChunks(fd, size, buf=None, pos=-1, chunksize=_CHUNKSIZE_):
+    """
+    Generator producing <size> bytes of data as memoryviews of at most
+    <chunksize> bytes, thus the memory use does not depend on <size>:
+
+        buf given:  slices of the mapped buffer starting at <pos>
+        pos >= 0:   positional reads from fd.fileno() at <pos> into a reused
+                    per-thread buffer, the file position is not changed
+        else:       sequential reads from the current position of <fd>, into
+                    the reused buffer if the file object supports readinto
+
+    A chunk of the reused buffer is only valid until the next one is
+    requested. Less than <size> bytes are produced at the end of the file.
+
+    INPUT:     file object, None if <buf> is given
+               int, number of bytes
+               buffer attribute buf, mapped file, default None, optional
+               int attribute pos, start position, default -1, optional
+               int attribute chunksize, default 4 MB, optional
+    """
+    if buf is not None:
+        mv = memoryview(buf)
+        for off in range(pos, pos + size, chunksize):
+            yield mv[off:min(off + chunksize, pos + size)]
+        return
+    rbuf = getattr(_LOCAL_, 'buf', None)
+    if rbuf is None or len(rbuf) < chunksize:
+        rbuf = _LOCAL_.buf = bytearray(chunksize)
+    mv = memoryview(rbuf)
+    readinto = getattr(fd, 'readinto', None)
+    rest = size
+    while rest > 0:
+        nn = min(rest, chunksize)
+        if pos >= 0:
+            if hasattr(os, 'preadv'):
+                got = os.preadv(fd.fileno(), [mv[:nn]], pos + size - rest)
+            else:
+                data = os.pread(fd.fileno(), nn, pos + size - rest)
+                got = len(data)
+                mv[:got] = data
+        elif readinto is not None:
+            got = readinto(mv[:nn])
+        else:
+            data = fd.read(nn)
+            got = len(data)
+            mv[:got] = data
+        if not got:
+            return
+        yield mv[:got]
+        rest -= got
+
+
+def dataCrc(fd, size, buf=None, pos=-1, chunksize=_CHUNKSIZE_):
+    """
+    Return the CRC32 of <size> bytes of data read in chunks, see dataChunks
+    for the arguments. zlib releases the GIL while computing the CRC, thus
+    several calls on mapped or positional data run concurrently in threads.
+    """
+    checksum = 0
+    for chunk in dataChunks(fd, size, buf=buf, pos=pos, chunksize=chunksize):
+        checksum = crc32(chunk, checksum)
+    return checksum
+
+
+def dataSums(fd, size, buf=None, pos=-1, chunksize=_CHUNKSIZE_):
+    """
+    Return the tuple (<CRC32>, <FITS DATASUM>) of <size> bytes of data, both
+    calculated in a single pass over the chunks, see dataChunks.
+    """
+    checksum = 0
+    fitsum = 0
+    for chunk in dataChunks(fd, size, buf=buf, pos=pos, chunksize=chunksize):
+        checksum = crc32(chunk, checksum)
+        fitsum = FitsChecksum.shared.sum(chunk, fitsum)
+    return (checksum, fitsum)
+
+
+def findEnd(block, start=0):
+    """
+    Return the offset of the END card in <block> or -1. Only matches
+    on 80 byte card boundaries are accepted.
+    """
+    ind = block.find(_ENDCARD_, start)
+    while ind >= 0:
+        if ind % _CARDSIZE_ == 0:
+            return ind
+        ind = block.find(_ENDCARD_, ind + 1)
+    return -1
+
+
+class StructScan:
+    """
+    Scanner deriving the structure of a FITS file directly from the raw bytes.
+    The header blocks are never decoded or concatenated: the END card is
+    located with bytes.find on the 80 byte card boundaries and only the
+    leading mandatory cards (SIMPLE/XTENSION, BITPIX, NAXISn, PCOUNT,
+    GCOUNT) are looked at using fixed-column slicing.
+
+    Iterating over a StructScan instance produces one entry per HDU:
+
+        {'pos':<header position>, 'datapos':<data position>,
+         'datasize':<data size in bytes>, 'datasum':<CRC32 or -1>,
+         'cards':[[<index>,<card>],...]}
+
+    where 'cards' contains the mandatory cards and the END card as strings.
+    If check is set the entries contain also 'fitsum', the FITS standard
+    DATASUM of the data part, and 'fitscheck', the verification status of
+    the DATASUM and CHECKSUM keywords of the header, see FitsChecksum.verify.
+    If a memory-mapped buffer is given all of this is done by pointer
+    arithmetic on the buffer, else the file object is read block by block
+    and the data parts are skipped with seek (or read for streams).
+
+    The CRC32 of the data parts is calculated in chunks, see dataCrc. For
+    mapped or seekable plain files the checksums of the HDUs are calculated
+    concurrently by a pool of <threads> threads while the scan continues,
+    the entries are still produced in HDU order.
+    """
+
+    def __init__(self, fd, buf=None, pos=0, check=0, mode=1, limit=-1, threads=_THREADS_):
+        """
+        INPUT:     file object, positioned at <pos>
+                   buffer attribute buf, mapped file, default None, optional
+                   int attribute pos, position of the first header, default 0, optional
+                   int attribute check, if 1 the CRC32 and the FITS checksums
+                                        of the data are calculated,
+                                        default 0, optional
+                   int attribute mode, if 0 the file does not contain data parts,
+                                       default 1, optional
+                   int attribute limit, if >= 0 stop after this number of HDUs,
+                                        default -1, optional
+                   int attribute threads, number of checksum threads, default
+                                          min(8, number of CPUs), optional
+        """
+        self.fd = fd
+        self.buf = buf
+        self.pos = pos
+        self.check = int(check)
+        self.mode = mode
+        self.limit = limit
+        self.threads = threads
+        self.pool = None
+
+
+    def __iter__(self):
+        if self.check and self.threads > 1 and self.positional():
+            self.pool = ThreadPoolExecutor(self.threads)
+        pending = []                 # entries waiting for their checksum
+        count = 0
+        try:
+            while count != self.limit:
+                entry = self.nextHDU()
+                if entry is None:
+                    break
+                count += 1
+                pending.append(entry)
+                while pending and not (isinstance(pending[0]['datasum'], Future) and
+                                       not pending[0]['datasum'].done()):
+                    yield self.resolve(pending.pop(0))
+            while pending:
+                yield self.resolve(pending.pop(0))
+        finally:
+            if self.pool is not None:
+                for entry in pending:
+                    if isinstance(entry['datasum'], Future):
+                        entry['datasum'].cancel()
+                self.pool.shutdown(wait=True)
+                self.pool = None
+
+
+    def positional(self):
+        """
+        Return 1 if the data can be read at arbitrary positions, i.e. for
+        mapped and plain seekable files.
+        """
+        if self.buf is not None:
+            return 1
+        try:
+            return int(self.fd.seekable() and self.fd.fileno() >= 0)
+        except (AttributeError, IOError, OSError, ValueError):
+            return 0
+
+
+    def resolve(self, entry):
+        """
+        Replace a pending checksum of <entry> by its value and verify the
+        FITS checksums.
+        """
+        if isinstance(entry['datasum'], Future):
+            (entry['datasum'], entry['fitsum']) = entry['datasum'].result()
+        if 'header' in entry:
+            entry['fitscheck'] = FitsChecksum.shared.verify(entry.pop('header'), entry['fitsum'],
+                                                            entry.pop('hdrsum'))
+        return entry
+
+
+    def readBlock(self):
+        """
+        Return the next block of the file.
+        """
+        if self.buf is not None:
+            return self.buf[self.pos:self.pos+_BLOCKSIZE_]
+        return self.fd.read(_BLOCKSIZE_)
+
+
+    def nextHDU(self):
+        """
+        Scan the header at the current position and skip over its data part.
+
+        OUTPUT:    dictionary, HDU entry or None at the end of the file
+        """
+        hpos = self.pos
+        block = self.readBlock()
+        if len(block) < _BLOCKSIZE_ or not (block[:8] == b'XTENSION' or block[:6] == b'SIMPLE'):
+            return None
+        cards = []
+        values = {}
+        offset = 0                   # offset of the current block in the header
+        mandatory = 1
+        blocks = []                  # raw header blocks, check only
+        hdrsum = 0
+        while True:
+            if self.check:
+                blocks.append(bytes(block))
+                hdrsum = FitsChecksum.shared.sum(block, hdrsum)
+            if mandatory:
+                for ind in range(0, _BLOCKSIZE_, _CARDSIZE_):
+                    key = block[ind:ind+8]
+                    if not key.startswith(_MANDATORY_):
+                        mandatory = 0
+                        break
+                    card = block[ind:ind+_CARDSIZE_]
+                    cards.append([(offset + ind) // _CARDSIZE_, card.decode('latin-1')])
+                    values[key.strip()] = card
+            endind = findEnd(block)
+            self.pos += _BLOCKSIZE_
+            if endind >= 0:
+                cards.append([(offset + endind) // _CARDSIZE_, block[endind:endind+_CARDSIZE_].decode('latin-1')])
+                break
+            block = self.readBlock()
+            offset += _BLOCKSIZE_
+            if len(block) < _BLOCKSIZE_:
+                return None          # truncated header
+
+        naxis = self.intValue(values, b'NAXIS')
+        axes = [self.intValue(values, ('NAXIS%d' % na).encode()) for na in range(1, naxis+1)]
+        groups = values.get(b'GROUPS', b'')[10:30].strip() == b'T'
+        siz = dataSize(self.intValue(values, b'BITPIX'), axes,
+                       self.intValue(values, b'PCOUNT', 0), self.intValue(values, b'GCOUNT', 1),
+                       groups)
+        entry = {'pos':hpos, 'datapos':self.pos, 'datasize':siz, 'datasum':-1, 'cards':cards}
+        if self.check:
+            entry.update({'fitsum':0, 'header':b''.join(blocks), 'hdrsum':hdrsum})
+        if self.mode:
+            self.skipData(entry)
+        return entry
+
+
+    def intValue(self, values, key, default=0):
+        """
+        Return the integer value of the mandatory card <key>. The value is
+        taken from the fixed-format columns 11-30, with a fallback for free
+        format cards.
+        """
+        card = values.get(key)
+        if card is None:
+            return default
+        try:
+            return int(card[10:30])
+        except ValueError:
+            return int(card[10:].split(b'/')[0])
+
+
+    def skipData(self, entry):
+        """
+        Move behind the data part of the HDU described by <entry> and
+        calculate the CRC32 and the FITS DATASUM of the data if requested.
+        If a thread pool is active the checksums are submitted to it and
+        'datasum' holds the future until the entry is resolved.
+        """
+        siz = entry['datasize']
+        if siz == 0:
+            return
+        datasiz = siz + (-siz) % _BLOCKSIZE_
+        if self.check and self.pool is not None:
+            entry['datasum'] = self.pool.submit(dataSums, self.fd, datasiz, self.buf, self.pos)
+            if self.buf is None:
+                self.fd.seek(datasiz, 1)
+        elif self.buf is not None:
+            if self.check:
+                (entry['datasum'], entry['fitsum']) = dataSums(None, datasiz, buf=self.buf,
+                                                               pos=self.pos)
+        elif self.check:
+            (entry['datasum'], entry['fitsum']) = dataSums(self.fd, datasiz)
+        else:
+            try:
+                self.fd.seek(datasiz, 1)
+            except (IOError, OSError, AttributeError, ValueError):
+                dataCrc(self.fd, datasiz)    # not seekable, read through
+        self.pos += datasiz
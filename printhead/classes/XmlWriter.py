@@ -0,0 +1,266 @@
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+from io import TextIOBase
+from xml.sax.saxutils import escape
+from printhead import __version__
+
+# VOTable datatypes of the KeyType codes
+_VOTYPES_ = {'I':'int', 'U':'unsignedByte', 'S':'short', 'L':'long', 'F':'float',
+             'D':'double', 'C':'char', 'B':'boolean'}
+_ATTRESC_ = {'"':'&quot;'}
+
+
+class XmlWriter:
+    """
+    Streaming serializer of HeadDict instances into XFits or VOTable XML.
+
+    The document is produced line by line while the headers are walked,
+    using one getKeyword lookup per keyword. Lines are collected in a buffer
+    of at most <bufsize> characters, which is written to the output each
+    time it is full, thus the memory use does not depend on the size of the
+    headers. The output may be a text or binary file object (binary output
+    is encoded ISO-8859-1 as declared in the document) or a socket.
+
+    Values and comments are escaped, e.g.
+
+        XmlWriter(open('file.xml', 'wb'), format='xfits').writeDocument(heads, 'file.fits')
+    """
+
+    def __init__(self, out=None, format='vo', pretty=1, indent='   ', bufsize=65536):
+        """
+        INPUT:     file object or socket out, None if only the line generators are
+                              used, optional
+                   string attribute format, 'vo' or 'xfits', default 'vo', optional
+                   int attribute pretty, indent the elements, default 1, optional
+                   string attribute indent, whitespace per level, default '   ', optional
+                   int attribute bufsize, size of the output buffer in characters,
+                                          default 65536, optional
+        """
+        if format not in ('vo', 'xfits'):
+            errMsg = "Invalid format specified: %s. Should be vo or xfits" % format
+            raise Exception(errMsg)
+        self.out = out
+        self.format = format
+        self.indent = indent if pretty else ''
+        self.bufsize = bufsize
+        self.buf = []
+        self.size = 0
+        self.text = isinstance(out, TextIOBase)
+        if out is None:
+            self.send = None
+        elif hasattr(out, 'write'):
+            self.send = out.write
+        elif hasattr(out, 'sendall'):
+            self.send = out.sendall
+        else:
+            errMsg = "XmlWriter output needs a write or sendall method"
+            raise Exception(errMsg)
+
+
+    def write(self, line):
+        """
+        Append <line> and a newline to the buffer and write the buffer if
+        it is full.
+        """
+        self.buf.append(line)
+        self.buf.append('\n')
+        self.size += len(line) + 1
+        if self.size >= self.bufsize:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write the buffer to the output.
+        """
+        if self.buf:
+            data = ''.join(self.buf)
+            self.buf = []
+            self.size = 0
+            if not self.text:
+                data = data.encode('latin-1', 'xmlcharrefreplace')
+            self.send(data)
+        if hasattr(self.out, 'flush'):
+            self.out.flush()
+
+
+    def writeDocument(self, heads, name=''):
+        """
+        Write the complete XML document of the HeadDict instances <heads>
+        of the file <name> and flush the output.
+        """
+        for line in self.documentLines(heads, name):
+            self.write(line)
+        self.flush()
+
+
+    def writeHeader(self, HD, level=0):
+        """
+        Write the XML element of the single HeadDict <HD>.
+        """
+        for line in self.headerLines(HD, level):
+            self.write(line)
+
+
+    def documentLines(self, heads, name=''):
+        """
+        Generator producing the lines of the XML document of the HeadDict
+        instances <heads> of the file <name>.
+        """
+        ind = self.indent
+        yield '<?xml version="1.0" encoding="ISO-8859-1"?>'
+        if self.format == 'vo':
+            yield '<VOTABLE version="1.1">'
+            yield ind + '<INFO name="Creator" value="ESO printhead tool"/>'
+            yield ind + '<INFO name="Version" value="' + __version__ + '"/>'
+            yield ind + '<INFO name="Compatibility" value="FITS"/>'
+            yield ind + '<DESCRIPTION>'
+            yield 2*ind + 'VOTable file created from FITS file'
+            yield 2*ind + escape(name)
+            yield ind + '</DESCRIPTION>'
+        else:
+            yield '<?xml-stylesheet type="text/xml" href="XMLmenu.xsl"?>'
+            yield '<XFits>'
+        for HD in heads:
+            for line in self.headerLines(HD, 1):
+                yield line
+        if self.format == 'vo':
+            yield '</VOTABLE>'
+        else:
+            yield '</XFits>'
+
+
+    def headerLines(self, HD, level=0):
+        """
+        Generator producing the lines of the XML element of the HeadDict <HD>,
+        i.e. a HEADER element for XFits and a RESOURCE element for VOTable.
+        """
+        if self.format == 'vo':
+            return self.votableLines(HD, level)
+        return self.xfitsLines(HD, level)
+
+
+    def xfitsLines(self, HD, level=0):
+        """
+        Generator producing the XFits HEADER element of <HD>. HIERARCH keywords
+        are placed in a real XML hierarchy below a HIERARCH element.
+        """
+        ind = self.indent
+        yield level*ind + '<HEADER number="%d" position="%d" datasize="%d">' % \
+            (HD.NUMBER, HD.POS, HD.DATASIZE[0])
+        level += 1
+        hopen = 0
+        hier = []                    # open elements below HIERARCH
+        for (key, val, com, typ, flag) in HD.iterKeywords():
+            hkeys = key.split()
+            if hkeys[0] == 'HIERARCH' and len(hkeys) > 1:
+                path = hkeys[1:-1]
+                if not hopen:
+                    yield level*ind + '<HIERARCH>'
+                    hopen = 1
+                common = 0
+                while common < len(hier) and common < len(path) and \
+                      hier[common] == path[common]:
+                    common += 1
+                while len(hier) > common:
+                    yield (level + len(hier))*ind + '</' + hier.pop() + '>'
+                for hk in path[common:]:
+                    hier.append(hk)
+                    yield (level + len(hier))*ind + '<' + hk + '>'
+                for line in self.xfitsElement(hkeys[-1], val, com, level + len(hier) + 1):
+                    yield line
+            else:
+                while hier:
+                    yield (level + len(hier))*ind + '</' + hier.pop() + '>'
+                if hopen:
+                    yield level*ind + '</HIERARCH>'
+                    hopen = 0
+                for line in self.xfitsElement(key, val, com, level):
+                    yield line
+        while hier:
+            yield (level + len(hier))*ind + '</' + hier.pop() + '>'
+        if hopen:
+            yield level*ind + '</HIERARCH>'
+        yield (level - 1)*ind + '</HEADER>'
+
+
+    def xfitsElement(self, name, val, com, level):
+        """
+        Generator producing the XFits element of a single keyword. The lines
+        of COMMENT, HISTORY and ESO-LOG are kept in a single element.
+        """
+        ind = self.indent
+        yield level*ind + '<' + name + '>'
+        if type(val) == type([]):
+            for vv in val:
+                yield (level+1)*ind + escape(self.valueString(vv).strip())
+        else:
+            yield (level+1)*ind + '<Value>' + escape(self.valueString(val)) + '</Value>'
+            yield (level+1)*ind + '<Comment>' + escape(com) + '</Comment>'
+        yield level*ind + '</' + name + '>'
+
+
+    def votableLines(self, HD, level=0):
+        """
+        Generator producing the VOTable RESOURCE element of <HD> with one
+        PARAM element per keyword (per line for COMMENT, HISTORY and ESO-LOG).
+        """
+        ind = self.indent
+        xstr = '<RESOURCE id="' + str(HD.NUMBER) + '"'
+        extname = HD.getKeyword('EXTNAME', check=1)
+        if extname is not None:
+            xstr += ' name="' + escape(self.valueString(extname[1]), _ATTRESC_) + '"'
+        yield level*ind + xstr + ' type="meta">'
+        level += 1
+        yield level*ind + '<INFO name="position" value="' + str(HD.POS) + '"/>'
+        yield level*ind + '<INFO name="datasize" value="' + str(HD.DATASIZE[0]) + '"/>'
+        for (key, val, com, typ, flag) in HD.iterKeywords():
+            name = escape(key, _ATTRESC_)
+            voTyp = _VOTYPES_.get(typ, '')
+            comm = escape(com)
+            if type(val) != type([]):
+                val = [val]
+            for vv in val:
+                yield level*ind + '<PARAM name="' + name + '" value="' + \
+                    escape(self.valueString(vv), _ATTRESC_) + '" datatype="' + voTyp + '">'
+                yield (level+1)*ind + '<DESCRIPTION>' + comm + '</DESCRIPTION>'
+                yield level*ind + '</PARAM>'
+        if HD.DATASIZE[0] > 0:
+            yield level*ind + '<TABLE name="data">'
+            yield (level+1)*ind + '<FIELD name="image" type="link" ' + \
+                'arraysize="[]" datatype="integer">'
+            yield (level+2)*ind + '<LINK href="cid:' + str(HD.NUMBER) + '"/>'
+            yield (level+1)*ind + '</FIELD>'
+            yield level*ind + '</TABLE>'
+        yield (level - 1)*ind + '</RESOURCE>'
+
+
+    def valueString(self, val):
+        """
+        Return the string representation of a converted keyword value,
+        i.e. T or F for booleans and an empty string for values out of range.
+        """
+        if val is True:
+            return 'T'
+        if val is False:
+            return 'F'
+        if val is None:
+            return ''
+        return str(val)
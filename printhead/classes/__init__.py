@@ -1,4 +1,19 @@
 __all__ = [
+    "CompressedFile",
+    "DbLoader",
+    "FileWalker",
+    "FitsChecksum",
     "FitsHead",
-    "HeadDict"
+    "HeadBuffer",
+    "HeadCache",
+    "HeadDict",
+    "HeadIndex",
+    "KeyCensus",
+    "KeyColumn",
+    "KeyFilter",
+    "KeyType",
+    "LazyHeadDict",
+    "StructCache",
+    "StructScan",
+    "XmlWriter"
 ]
\ No newline at end of file
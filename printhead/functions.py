@@ -20,9 +20,27 @@
 ####
 # All of this is for the interactive version...
 ###
+import sys
+import os
+import getopt
+import threading
+import re
+from glob import glob
+from io import BytesIO
+from functools import partial
+from multiprocessing import Pool
 from printhead import __version__
 from printhead.classes.FitsHead import FitsHead
 from printhead.classes.FitsHead import HeadDict
+from printhead.classes.HeadCache import HeadCache
+from printhead.classes.HeadIndex import HeadIndex
+from printhead.classes.DbLoader import DbLoader, sqliteConnect
+from printhead.classes.FileWalker import FileWalker, _PATTERNS_
+from printhead.classes.KeyCensus import KeyCensus
+from printhead.classes.KeyColumn import KeyColumn
+from printhead.classes.KeyFilter import KeyFilter
+
+_MAGIC_RX_ = re.compile('[*?[]')     # glob wildcards
 
 def usage():
         """
@@ -43,6 +61,12 @@ def usage():
                "                with the extension '.hdr'.",
                "--skey|-s:      if the given KEYWORD is found",
                "                in the header only the matching lines will be printed.",
+               "                Several keywords can be given separated by commas, e.g.",
+               "                -s EXPTIME,OBJECT,DATE-OBS. Then one row per file and header",
+               "                with the values of all keywords (or *not found*) is printed",
+               "                and reading a header stops as soon as all keywords are found.",
+               "                The columns are file name, header number and the keywords",
+               "                in the given order, named in a first line starting with #.",
                "",
                "--header|-H:    <number> specifies the number of the header to be printed.",
                "                If 99 is given, all headers are printed. If <number> is",
@@ -62,96 +86,729 @@ def usage():
                "                The index item is the running number of the keyword within the header.",
                "",
                "--check|-c      If this flag is set the CRC32 checksum of the data part of the",
-               "                extensions is calculated.",
+               "                extensions is calculated. In addition the FITS DATASUM is",
+               "                calculated and the DATASUM and CHECKSUM keywords are verified",
+               "                (columns FITSSUM, DSUM and CSUM: ok, BAD or - if missing).",
                "--mode-m        [1]|0: If set to 0 the program does not try to skip the data part",
                "                between headers. This is useful for interpreting header files.",
                "--parse|-p      Switch the full parsing of the header on",
                "                extensions is calculated.",
+               "--cache         <dir>: Keep the structure of the files in the directory <dir>",
+               "                and reuse it for unchanged files.",
+               "--where|-w      <expr>: Only output the headers matching the expression <expr>, e.g.",
+               "                \"EXPTIME > 600 and XTENSION == 'IMAGE'\". Keywords which are no",
+               "                Python names are quoted with backquotes, e.g. `DATE-OBS`.",
+               "                Headers are rejected while they are read, at the first card",
+               "                failing a condition. With --struct the structure of the files",
+               "                with at least one matching header is printed.",
+               "--recursive|-r  <dir>: Process all files below the directory <dir> matching the",
+               "                patterns given by --pattern, in addition to the files given",
+               "                as arguments. Can be given several times.",
+               "--pattern       <patterns>: comma separated file name patterns for --recursive,",
+               "                default *.fits,*.fit,*.fts and their .gz and .Z versions.",
+               "--files-from    <file>: Process the files listed in <file> ('-' for stdin), the",
+               "                names separated by NUL characters, e.g. the output of",
+               "                find -print0. The files are processed while they are found.",
+               "--jobs|-j       <N>: Process the files with N worker processes (0: one per CPU).",
+               "                The output is still written in the order of the files.",
                "--help|-h:      print this help and exit.",
                "",
+               "printhead index [-p <patterns>] [--no-prune] <database> <dir|file>...",
+               "                Crawl the directories and load the keywords of all files",
+               "                matching <patterns> (comma separated, default *.fits,*.fit,",
+               "                *.fts and their .gz and .Z versions) into the SQLite",
+               "                <database>. Unchanged files are skipped on later runs and",
+               "                files which disappeared are removed unless --no-prune is given.",
+               "printhead query <database> <condition>...",
+               "                Print the files and HDUs fulfilling all conditions of the",
+               "                form <KEYWORD><op><value> with op one of = != < <= > >=,",
+               "                e.g. printhead query idx.db 'EXPTIME>600' \"OBJECT='X'\"",
+               "printhead census [-j <N>] [--top <K>] <file>...",
+               "                Print for every keyword found in the headers of the files",
+               "                the number of headers containing it, the number of values",
+               "                per type, the minimum and maximum of the numeric values and",
+               "                the K (default 5) most frequent values, tab separated.",
+               "printhead load [-j <N>] [--table <name>] [--batch <rows>] <database> <file>...",
+               "                Load the keywords of all HDUs of the files in DBCM format",
+               "                into the table <name> (default dbcm) of the SQLite <database>.",
+               "                The files are parsed by N worker processes and written in",
+               "                batches of <rows> rows (default 5000) by a single writer.",
+               "",
                "Version: " + __version__)
         print('\n'.join(msg))
 
 
-def run(args, skey='END', header=0, mode=1, struct=0, check=0):
+def run(args, skey='END', header=0, mode=1, struct=0, check=0, cache='', jobs=1, where=None,
+        hcache=1):
         """
         Implements the loop around several files and opens either a
         pipe (compressed files) or the file directly.
+
+        With jobs other than 1 the files are distributed over a pool of
+        worker processes, see mapFiles. The output is still written in the
+        order of <args>, but the FitsHead instances stay in the workers and
+        None is returned instead of the last one.
+
+        If <where> is given only the headers matching this filter expression
+        are printed, see KeyFilter.
+
+        If <hcache> is 1 (default) and jobs is 1 the headers are taken from
+        the process-wide HeadCache, as far as possible, see runFile.
+
+        For several keywords in <skey> a '#' line with the column names is
+        printed first.
         """
-        for name in args:
-          try:
+        pH = ''
+        skeys = FitsHead.keyList(skey)
+        if len(skeys) > 1:
+            writeOutput(['#FILE\tHDU\t%s\n' % '\t'.join(skeys)])
+        for (name, res, err) in mapFiles(runFile, args, jobs=jobs, skey=skey,
+                                         header=header, mode=mode, struct=struct,
+                                         check=check, cache=cache, where=where,
+                                         hcache=(hcache and jobs == 1), keep=(jobs == 1)):
+            if err is not None:
+                pH = ''
+                print(err)
+#                sys.exit('<ERROR> unable to open file:' +name+' <ERROR>')
+                continue
+            (pH, out) = res
+            writeOutput(out)
+        return pH
+
+def runFile(name, skey='END', header=0, mode=1, struct=0, check=0, cache='', where=None,
+            hcache=0, keep=1):
+        """
+        Processes the single file <name> for run.
+
+        INPUT:     string, file name
+                   further attributes as for run
+                   int attribute hcache, if 1 the header is taken from the shared
+                                         HeadCache, default 0, optional
+                   int attribute keep, if 0 the FitsHead instance is closed and
+                                       not returned, default 1, optional
+        OUTPUT:    tuple, (<FitsHead instance or None>, <list of output chunks>)
+        """
+        if hcache and cacheable(header, check, mode, where):
+            pH = HeadCache.shared.get(name, header, cache=cache)
+        else:
             pH = FitsHead(name, skey=skey, show=header,
-                          struct=struct, check=check, mode=mode)
-            if skey != 'END':
-                if header == 99:
-                    heads = range(len(pH.HEAD))
-                else:
-                    heads = [header]
-                for h in heads:
-                    if list(pH.Extension[h]['index'].values()).count(skey) == 0:
-                        print('%s\t%3d\t%s\t*not found*' % (name, h, skey))
-                    else:
-                       print("%s\t%3d\t%s\t%s" % (name, h, skey,
-                                                  pH.Extension[h].getKeyword(skey)[1]))
+                          struct=struct, check=check, mode=mode, cache=cache, where=where)
+        skeys = FitsHead.keyList(skey)
+        out = []
+        if len(skeys) == 1:
+            skey = skeys[0]
+        if skeys:
+            if header == 99:
+                heads = range(len(pH.HEAD))
             else:
-                print(pH.HEAD[header])
-          except Exception as e:
-            pH = ''
-            print(e)
-#            sys.exit('<ERROR> unable to open file:' +name+' <ERROR>')
-        return pH
+                heads = [header]
+            for h in pH.matchHeads(heads):
+                if len(skeys) > 1:
+                    # one row with the values of all keywords
+                    values = []
+                    for key in skeys:
+                        if pH.Extension[h].getKeyIndex(key) < 0:
+                            values.append('*not found*')
+                        else:
+                            values.append(str(pH.Extension[h].getKeyword(key)[1]))
+                    out.append('%s\t%3d\t%s\n' % (name, h, '\t'.join(values)))
+                elif pH.Extension[h].getKeyIndex(skey) < 0:
+                    out.append('%s\t%3d\t%s\t*not found*\n' % (name, h, skey))
+                else:
+                    out.append("%s\t%3d\t%s\t%s\n" % (name, h, skey,
+                                                      pH.Extension[h].getKeyword(skey)[1]))
+        elif pH.matchHeads([header]):
+            out += [pH.HEAD[header], '\n']
+        if not keep:
+            pH.close()
+            pH = None
+        return (pH, out)
+
+def cacheable(header, check=0, mode=1, where=None):
+        """
+        Returns 1 if the header <header> can be taken from the HeadCache, i.e.
+        a single header is requested without checksums and filter.
+        """
+        return int(0 <= header < 99 and not check and mode == 1 and where is None)
+
+def fileNames(args, roots=(), patterns=None, filesfrom=None):
+        """
+        Generator producing the file names <args> followed by the files found
+        below the directories <roots> matching <patterns> (default: FITS file
+        extensions) and listed in the file <filesfrom>, see FileWalker. The
+        names are produced as soon as they are found.
+        """
+        for name in args:
+            yield name
+        if roots or filesfrom:
+            for name in FileWalker(roots, patterns or _PATTERNS_, filesfrom):
+                yield name
+
+def mapFiles(func, args, jobs=1, chunksize=1, window=0, **kw):
+        """
+        Generator applying func(name, **kw) to all file names in <args>.
+
+        For jobs == 1 the files are processed one after the other in this
+        process. Otherwise a pool of <jobs> worker processes (one per CPU for
+        jobs < 1) is used. In both cases the results are produced in the order
+        of <args>, each one as soon as it and all the results before it are
+        available. <func> has to be a module level function and its results
+        have to be picklable in the parallel case.
+
+        At most <window> files are handed to the workers before the consumer
+        picked up their results, which bounds the memory used by results
+        waiting for a slow consumer, independent of the number of files.
+
+        Exceptions raised by <func> do not stop the loop, they are returned
+        together with the file name instead.
+
+        INPUT:     function, called for every file
+                   iterable of strings, file names
+                   int attribute jobs, number of worker processes, default 1, optional
+                   int attribute chunksize, files handed to a worker at once,
+                                            default 1, optional
+                   int attribute window, maximum number of files in flight,
+                                         default 0: 16 per worker, optional
+                   further keyword attributes are passed on to <func>
+        OUTPUT:    tuples, (<name>, <result of func or None>, <exception or None>)
+        """
+        if jobs == 1:
+            for name in args:
+                yield callFile(func, name, kw)
+            return
+        if jobs < 1:
+            jobs = os.cpu_count() or 1
+        if window < 1:
+            window = 16 * jobs
+        window = max(window, chunksize)
+        slots = threading.Semaphore(window)
+        stop = []
+
+        def feed():
+            # runs in the task handler thread of the pool
+            for name in args:
+                slots.acquire()
+                if stop:
+                    return
+                yield name
+
+        pool = Pool(jobs)
+        try:
+            for res in pool.imap(partial(callFile, func, kw=kw), feed(), chunksize):
+                slots.release()
+                yield res
+            pool.close()
+        finally:
+            stop.append(1)
+            slots.release()          # wake up the feeder if it is waiting
+            pool.terminate()
+            pool.join()
+
+def callFile(func, name, kw):
+        """
+        Calls func(name, **kw) and catches any exception, see mapFiles.
+
+        OUTPUT:    tuple, (<name>, <result of func or None>, <exception or None>)
+        """
+        try:
+            return (name, func(name, **kw), None)
+        except Exception as e:
+            return (name, None, e)
+
+def writeOutput(out):
+        """
+        Writes the output chunks produced by one of the per-file functions
+        (runFile, structFile, ...) to stdout. Strings are encoded, HeadBuffer
+        instances and bytes are written as they are.
+
+        INPUT:     list of strings, bytes or HeadBuffer instances
+        """
+        sys.stdout.flush()
+        buf = getattr(sys.stdout, 'buffer', None)
+        if buf is None:              # stdout replaced by a text stream
+            sys.stdout.write(''.join([str(chunk) for chunk in out]))
+            return
+        enc = sys.stdout.encoding or 'utf-8'
+        for chunk in out:
+            if type(chunk) == type(''):
+                chunk = chunk.encode(enc, 'replace')
+            buf.write(bytes(chunk))
+        buf.flush()
+
+def indexMain(args):
+        """
+        Implements the index subcommand, see usage.
+        """
+        opts, args = getopt.getopt(args, "p:", ["pattern=", "no-prune"])
+        patterns = None
+        prune = 1
+        for o, v in opts:
+            if o in ("-p", "--pattern"):
+                patterns = tuple([pat.strip() for pat in v.split(',') if pat.strip()])
+            if o == "--no-prune":
+                prune = 0
+        if len(args) < 2:
+            usage()
+            return
+        HI = HeadIndex(args[0])
+        if patterns:
+            stats = HI.crawl(args[1:], patterns=patterns, prune=prune)
+        else:
+            stats = HI.crawl(args[1:], prune=prune)
+        HI.close()
+        print(' '.join(['%s: %d' % (status, stats[status]) for status in
+                        ('added', 'updated', 'touched', 'unchanged', 'removed', 'failed')]))
+        return stats
+
+def queryMain(args):
+        """
+        Implements the query subcommand, see usage.
+        """
+        if len(args) < 2:
+            usage()
+            return
+        HI = HeadIndex(args[0])
+        result = HI.query(args[1:])
+        HI.close()
+        writeOutput(['%s\t%d\n' % (path, ext) for (path, ext) in result])
+        return result
+
+def loadMain(args):
+        """
+        Implements the load subcommand, see usage.
+        """
+        opts, args = getopt.getopt(args, "j:", ["jobs=", "table=", "batch="])
+        kw = {}
+        for o, v in opts:
+            if o in ("-j", "--jobs"):
+                kw['jobs'] = int(v)
+            if o == "--table":
+                kw['table'] = v
+            if o == "--batch":
+                kw['batch'] = int(v)
+        if len(args) < 2:
+            usage()
+            return
+        (nfiles, nrows, nerr) = dbLoad(args[1:], dbname=args[0], **kw)
+        print('files: %d rows: %d failed: %d' % (nfiles, nrows, nerr))
+        return nfiles
+
+def dbLoad(args, conn=None, dbname='', table='dbcm', batch=5000, commit=200000,
+           jobs=1, mode=1, cache=''):
+        """
+        Loads the keywords of all HDUs of the files <args> in the DBCM format
+        of parseFitsHead2TupleList(forceString=2) into a database table.
+
+        The files are parsed in a pool of <jobs> worker processes (see
+        mapFiles), while this process is the single writer inserting the rows
+        in batches through a DbLoader. The number of parsed files waiting for
+        the writer is bounded by mapFiles, thus a slow database throttles the
+        workers instead of filling the memory.
+
+        INPUT:     list of strings, file names
+                   DB-API connection attribute conn, default: SQLite database <dbname>
+                   string attribute dbname, name of the SQLite database, used if
+                                    conn is None
+                   string attribute table, name of the table, default 'dbcm'
+                   int attribute batch, rows per executemany call, default 5000
+                   int attribute commit, rows per transaction, default 200000
+                   int attribute jobs, number of worker processes, default 1
+                   further attributes as for FitsHead
+        OUTPUT:    tuple, (<number of files loaded>, <number of rows>, <number of failed files>)
+        """
+        close = 0
+        if conn is None:
+            conn = sqliteConnect(dbname)
+            close = 1
+        nerr = 0
+        try:
+            DL = DbLoader(conn, table=table, batch=batch, commit=commit)
+            for (name, rows, err) in mapFiles(dbcmFile, args, jobs=jobs, mode=mode, cache=cache):
+                if err is not None:
+                    print(err)
+                    nerr += 1
+                    continue
+                DL.add(rows)
+            DL.close()
+        finally:
+            if close:
+                conn.close()
+        return (DL.nfiles, DL.nrows, nerr)
+
+def dbcmFile(name, mode=1, cache=''):
+        """
+        Processes the single file <name> for dbLoad.
+
+        INPUT:     string, file name
+                   further attributes as for FitsHead
+        OUTPUT:    list of DBCM tuples of all HDUs
+        """
+        pH = FitsHead(name, show=99, struct=1, mode=mode, cache=cache)
+        pH.close()
+        rows = []
+        for hrows in pH.parseFitsHead2TupleList(forceString=2):
+            rows.extend(hrows)
+        return rows
+
+def censusMain(args):
+        """
+        Implements the census subcommand, see usage.
+        """
+        opts, args = getopt.getopt(args, "j:", ["jobs=", "top="])
+        jobs = 1
+        top = 5
+        for o, v in opts:
+            if o in ("-j", "--jobs"):
+                jobs = int(v)
+            if o == "--top":
+                top = int(v)
+        if len(args) == 0:
+            usage()
+            return
+        KC = census(args, jobs=jobs)
+        for err in KC.errors:
+            print(err)
+        writeOutput(KC.lines(top=top))
+        return KC
+
+def census(args, jobs=1, maxvalues=1000, mode=1, cache=''):
+        """
+        Keyword statistics of all headers of the files <args>, see KeyCensus.
+
+        The files are split into chunks, each one is processed by a worker
+        (see mapFiles) into a partial KeyCensus and the partial results are
+        merged in the order of the chunks. Only the small aggregates travel
+        between the processes, not the headers.
+
+        INPUT:     list of strings, file names
+                   int attribute jobs, number of worker processes, default 1
+                   int attribute maxvalues, distinct values counted per keyword,
+                                            default 1000, optional
+                   further attributes as for FitsHead
+        OUTPUT:    KeyCensus instance
+        """
+        args = list(args)
+        if jobs == 1:
+            chunks = [args]
+        else:
+            nchunks = 4 * (jobs if jobs > 0 else (os.cpu_count() or 1))
+            size = max(1, min(256, -(-len(args) // nchunks)))
+            chunks = [args[ii:ii+size] for ii in range(0, len(args), size)]
+        KC = KeyCensus(maxvalues=maxvalues)
+        for (names, part, err) in mapFiles(censusFiles, chunks, jobs=jobs,
+                                           maxvalues=maxvalues, mode=mode, cache=cache):
+            if err is not None:
+                raise err
+            KC.merge(part)
+        return KC
+
+def censusFiles(names, maxvalues=1000, mode=1, cache=''):
+        """
+        Processes the chunk of files <names> for census.
+
+        INPUT:     list of strings, file names
+                   further attributes as for census
+        OUTPUT:    KeyCensus instance
+        """
+        KC = KeyCensus(maxvalues=maxvalues)
+        for name in names:
+            KC.addFile(name, mode=mode, cache=cache)
+        return KC
 
-def getval(name, key):
+def writeHead(heads, out=None):
+        """
+        Writes the plain headers <heads> followed by a newline to the binary
+        stream <out> (default stdout) directly from the header buffers,
+        i.e. without decoding and concatenating them.
+
+        INPUT:     list of HeadBuffer instances
+                   file object attribute out, binary stream, default stdout, optional
+        """
+        if out is None:
+            sys.stdout.flush()
+            out = getattr(sys.stdout, 'buffer', None)
+            if out is None:          # stdout replaced by a text stream
+                print(''.join([str(head) for head in heads]))
+                return
+        for head in heads:
+            out.write(bytes(head))
+        out.write(b'\n')
+        out.flush()
+
+def getval(name, key, hdu=0, hcache=1):
     """
     Function mimics the same functionality as the pyfits getval function.
+    The parsed headers are kept in the process-wide HeadCache, thus
+    repeated calls for the same file only check whether it changed.
 
     Input:
     name: string, file path and name
     key: FITS keyword to search for
+    hdu: int, number of the header, default 0, optional
+    hcache: int, if 0 the HeadCache is not used, default 1, optional
 
     Output:
     keyword value: string
     """
-    pH = FitsHead(name, skey=key, show=0,
-        struct=0, check=0, mode=1)
-    return pH.Extension[0]['cards'][key]['Value']
+    if hcache:
+        pH = HeadCache.shared.get(name, hdu)
+    else:
+        pH = FitsHead(name, skey=key, show=hdu,
+            struct=(hdu > 0), check=0, mode=1)
+        pH.close()
+    res = pH.Extension[hdu].getKeyword(key, check=1)
+    if res is None:
+        raise KeyError("Keyword '%s' not found." % key)
+    return res[1]
+
+def select(paths, where, jobs=1, mode=1, cache=''):
+        """
+        Generator producing the tuples (<file name>, <list of header numbers>)
+        of the files in <paths> having at least one header matching the filter
+        expression <where>, e.g.
+
+            for (name, hdus) in printhead.functions.select(paths, "EXPTIME > 600"):
+
+        The filter is tested while the headers are read, see KeyFilter, no
+        header is parsed completely. Files which can't be read are skipped.
+
+        INPUT:     iterable of strings, file names
+                   string, filter expression
+                   int attribute jobs, number of worker processes, see mapFiles,
+                                       default 1, optional
+                   further attributes as for FitsHead
+        OUTPUT:    tuples, (<file name>, <list of int>)
+        """
+        KeyFilter.compiled(where)            # raise syntax errors right away
+        for (name, heads, err) in mapFiles(selectFile, paths, jobs=jobs, chunksize=16,
+                                           where=where, mode=mode, cache=cache):
+            if err is None and heads:
+                yield (name, heads)
+
+def selectFile(name, where='', mode=1, cache=''):
+        """
+        Processes the single file <name> for select.
+
+        OUTPUT:    list of int, numbers of the matching headers
+        """
+        pH = FitsHead(name, show=99, struct=1, mode=mode, cache=cache, where=where)
+        pH.close()
+        return pH.matchHeads(range(len(pH.HEAD)))
+
+def columns(paths, keys, hdu=0, jobs=1, errors='raise', mode=1, cache=''):
+        """
+        Extracts the values of the keywords <keys> of header <hdu> of all
+        files <paths> into one typed column per keyword, e.g.
+
+            cols = printhead.columns(paths, keys=['EXPTIME', 'OBJECT'])
+            cols['EXPTIME'].values, cols['EXPTIME'].mask
+
+        Each file is opened and its header read only once for all keywords,
+        only the cards of <keys> are converted. See KeyColumn for the types of
+        the columns. Rows of files without the keyword or the HDU are masked.
 
-def tsvFunc(args, skey='END', header=0, mode=1):
+        INPUT:     list of strings, file names
+                   list of strings, keyword names
+                   int attribute hdu, number of the header, default 0, optional
+                   int attribute jobs, number of worker processes, see mapFiles,
+                                       default 1, optional
+                   string attribute errors, 'raise' (default) to raise the exception
+                                    of a failing file, 'mask' to mask its rows, optional
+                   further attributes as for FitsHead
+        OUTPUT:    dictionary, {<keyword>: <KeyColumn instance>}
+        """
+        if errors not in ('raise', 'mask'):
+            errMsg = "errors has to be 'raise' or 'mask', got %s" % errors
+            raise Exception(errMsg)
+        keys = list(keys)
+        cells = [[] for key in keys]
+        for (name, row, err) in mapFiles(columnsFile, paths, jobs=jobs, chunksize=16,
+                                         keys=keys, hdu=hdu, mode=mode, cache=cache):
+            if err is not None:
+                if errors == 'raise':
+                    raise err
+                row = [None] * len(keys)
+            for (col, cell) in zip(cells, row):
+                col.append(cell)
+        return dict([(key, KeyColumn(key, col)) for (key, col) in zip(keys, cells)])
+
+def columnsFile(name, keys=(), hdu=0, mode=1, cache=''):
+        """
+        Processes the single file <name> for columns.
+
+        INPUT:     string, file name
+                   further attributes as for columns
+        OUTPUT:    list, (<type code>, <raw value string>) or None per keyword
+        """
+        pH = FitsHead(name, show=hdu, struct=1, mode=mode, cache=cache)
+        pH.close()
+        if len(pH.HEAD) <= hdu or len(pH.HEAD[hdu]) == 0:
+            return [None] * len(keys)
+        found = dict([(key, None) for key in keys])
+        for (key, value, comment, typ, ind) in pH.parseBlock(pH.HEAD[hdu], raw=1):
+            if key in found and found[key] is None:
+                found[key] = (typ, value)
+        return [found[key] for key in keys]
+
+def tsvFunc(args, skey='END', header=0, mode=1, cache='', jobs=1, where=None, hcache=1):
         """
         Implements the loop around several files and opens either a
         pipe (compressed files) or the file directly.
 
+        All lines are collected in memory, use tsvWrite to stream the
+        lines of a large number of files. Files which can't be processed
+        are reported and skipped.
+
         INPUT:     string list, file name to process
                    string attribute skey, keyword to parse, default 'END', optional
                    int attribute header, >=0 number of header to return, default 0, optional
+                   string attribute cache, directory of the structure cache, optional
+                   int attribute jobs, number of worker processes, see mapFiles,
+                                       default 1, optional
+                   string attribute where, filter expression selecting the
+                                    headers, see KeyFilter, optional
+                   int attribute hcache, if 1 (default) and jobs is 1 the header
+                                    is taken from the HeadCache, see runFile
         OUTPUT:    tuple, (<FitsHead instance>, <list of tsv formatted lines>)
+                   The FitsHead instance is None for jobs other than 1.
         """
 
+        pH = None
         lines = []
-        for name in args:
-          try:
-            pH = FitsHead(name, skey=skey, show=header, struct=1, mode=mode)
-            tupleList = pH.parseFitsHead2TupleList(forceString=1)
-            if header == 99:
-                    hrange = range(len(tupleList))
+        for (name, res, err) in tsvIter(args, skey=skey, header=header, mode=mode,
+                                        cache=cache, jobs=jobs, where=where,
+                                        hcache=(hcache and jobs == 1), keep=(jobs == 1)):
+            if err is not None:
+                print(err)
+                continue
+            (pH, flines) = res
+            lines += flines
+        return (pH, lines)
+
+def tsvIter(args, skey='END', header=0, mode=1, cache='', jobs=1, where=None, hcache=0,
+            keep=0):
+        """
+        Generator producing the tuples (<name>, (<FitsHead instance or None>,
+        <list of tsv formatted lines>), <exception or None>) file by file in
+        the order of <args>, see tsvFile and mapFiles. Only the lines of the
+        files in flight are kept in memory.
+        """
+        return mapFiles(tsvFile, args, jobs=jobs, skey=skey, header=header,
+                        mode=mode, cache=cache, where=where, hcache=hcache, keep=keep)
+
+def tsvWrite(args, skey='END', header=0, mode=1, cache='', jobs=1, where=None, out=None):
+        """
+        Writes the tsv formatted lines of all files in <args> to the binary
+        stream <out> (default stdout) as soon as a file is parsed. The memory
+        use does not depend on the number of files. Files which can't be
+        processed are reported in the output stream and skipped.
+
+        INPUT:     string list, file names to process
+                   further attributes as for tsvFunc
+                   file object attribute out, binary stream, default stdout, optional
+        OUTPUT:    int, number of files which could not be processed
+        """
+        enc = 'utf-8'
+        if out is None:
+            sys.stdout.flush()
+            enc = sys.stdout.encoding or enc
+            out = getattr(sys.stdout, 'buffer', None)
+            if out is None:          # stdout replaced by a text stream
+                out = sys.stdout
+                enc = None
+        nerr = 0
+        for (name, res, err) in tsvIter(args, skey=skey, header=header, mode=mode,
+                                        cache=cache, jobs=jobs, where=where):
+            if err is not None:
+                nerr += 1
+                text = str(err) + '\n'
             else:
-                    hrange = [header]
-            for hind in hrange:
-                if skey != 'END':
-                    if pH.Extension[hind].getKeyPos(skey) == -1:
-                        lines += ['%s\t%s\t*not found*' % (name, skey)]
+                text = ''.join(res[1])
+            if enc is None:
+                out.write(text)
+            else:
+                out.write(text.encode(enc, 'replace'))
+        out.flush()
+        return nerr
+
+def tsvFile(name, skey='END', header=0, mode=1, cache='', where=None, hcache=0, keep=1):
+        """
+        Processes the single file <name> for tsvFunc.
+
+        INPUT:     string, file name
+                   further attributes as for tsvFunc and runFile
+                   int attribute keep, if 0 the FitsHead instance is closed and
+                                       not returned, default 1, optional
+        OUTPUT:    tuple, (<FitsHead instance or None>, <list of tsv formatted lines>)
+        """
+        lines = []
+        if hcache and cacheable(header, 0, mode, where):
+            pH = HeadCache.shared.get(name, header, cache=cache)
+        else:
+            pH = FitsHead(name, skey=skey, show=header, struct=1, mode=mode, cache=cache,
+                          where=where)
+        skeys = FitsHead.keyList(skey)
+        tupleList = pH.parseFitsHead2TupleList(forceString=1)
+        if header == 99:
+                hrange = range(len(tupleList))
+        else:
+                hrange = [header]
+        for hind in pH.matchHeads(hrange):
+            if skeys:
+                # the header contains only the matching card(s) if not cached
+                for key in skeys:
+                    rows = [row for row in tupleList[hind] if row[3] == key]
+                    if len(rows) == 0:
+                        lines += ['%s\t%s\t*not found*\n' % (name, key)]
                     else:
-                        ind = pH.Extension[hind].getKeyPos(skey)
-                        # print skey, ind, tupleList[ind]
-                        lines += ascii_load_lines([tupleList[hind]
-                                                   [ind]], '\t', '\n')
-                else:
-                    lines += ascii_load_lines(tupleList[hind], '\t', '\n')
-          except Exception as e:
-              print(e)
-              return
+                        ind = pH.Extension[hind].getKeyPos(key)
+                        row = rows[0][:2] + (str(ind),) + rows[0][3:]
+                        lines += ascii_load_lines([row], '\t', '\n')
+            else:
+                lines += ascii_load_lines(tupleList[hind], '\t', '\n')
+        if not keep:
+            pH.close()
+            pH = None
         return (pH, lines)
 
+def structFile(name, show=-1, struct=1, check=0, mode=1, cache='', where=None):
+        """
+        Returns the output chunks of the structure (show == -99) or of the
+        header(s) <show> of the file <name>. With the filter expression
+        <where> only the matching headers are returned, respectively the
+        structure only if at least one header matches.
+        """
+        pH = FitsHead(name, struct=struct, check=check, verbose=0,
+                      show=show, mode=mode, cache=cache, where=where)
+        pH.close()
+        heads = pH.matchHeads(range(len(pH.HEAD)))
+        if where is not None and not heads:
+            return []
+        if show == -99:
+            return ['\n'.join(pH.STRUCT), '\n']
+        elif show == 99:
+            return [pH.HEAD[ii] for ii in heads] + ['\n']
+        elif show >= 0 and show < len(pH.HEAD):
+            return [pH.HEAD[show], '\n']
+        return ["Invalid header number specified. Should be: [0-%d,99]\n" % \
+                (len(pH.HEAD)-1)]
+
+def xmlFile(name, xmlfl='vo', skey='END', show=-1, struct=1, check=0, mode=1, where=None):
+        """
+        Returns the XML representation of the header(s) <show> of the file
+        <name> as a list of output chunks, nothing if the filter expression
+        <where> is given and no header matches.
+        """
+        pH = FitsHead(name, skey=skey, show=show, struct=struct,
+                      check=check, mode=mode, where=where)
+        pH.close()
+        if where is not None and not pH.matchHeads(range(len(pH.HEAD))):
+            return []
+        pH.parseFitsHead()
+        out = BytesIO()
+        pH.writeXml(out, format=xmlfl, head=show)
+        return [out.getvalue()]
+
 
 def ascii_load_lines(res, TABsep, RETsep):
     """
@@ -175,78 +832,122 @@ def ascii_load_lines(res, TABsep, RETsep):
     return(lines)
 
 
-def hdrExtract(name, xmlfl='', xtract=0, skey='END', show=0, struct=1, check=0, mode=1):
+def hdrExtract(name, xmlfl='', xtract=0, skey='END', show=0, struct=1, check=0, mode=1,
+               cache='', jobs=1, where=None):
     """
     Extracts headers of all files found by glob(name) into
     header file <file_id>.hdr or <file_id>.xml. The last directory
     in the path defined by <name> is maintained also for the
-    header files.
+    header files. <name> may also be a list of names or patterns, or any
+    iterable like a FileWalker, which allows to distribute the files over
+    <jobs> worker processes, see mapFiles. The names are expanded while the
+    files are processed, see expandNames. The last FitsHead instance is
+    returned for jobs == 1 only.
+    With the filter expression <where> only files with matching headers
+    are extracted.
     """
-    file_list = glob(name)
-    if xmlfl >= 1:
+    if type(name) == type(''):
+        name = [name]
+    pH = -1                          # no file found
+    for (file, res, err) in mapFiles(extractFile, expandNames(name), jobs=jobs, xmlfl=xmlfl,
+                                     xtract=xtract, skey=skey, show=show, struct=struct,
+                                     check=check, mode=mode, cache=cache, where=where,
+                                     keep=(jobs == 1)):
+        if err is not None:
+            raise err
+        if res == 1:
+            return 1
+        pH = res
+
+    if pH is not None and pH != -1:
+        fh = pH.Extension[0].Serialize()
+
+    return pH
+
+
+def expandNames(names):
+    """
+    Generator producing the existing files matching the names or glob
+    patterns <names>. Only names containing wildcards are passed to glob,
+    the others are just checked with a single stat call.
+
+    INPUT:     iterable of strings, file names or patterns
+    OUTPUT:    strings, file names
+    """
+    for name in names:
+        if _MAGIC_RX_.search(name):
+            for fname in glob(name):
+                yield fname
+        elif os.path.exists(name):
+            yield name
+
+
+def extractFile(file, xmlfl='', xtract=0, skey='END', show=0, struct=1, check=0, mode=1,
+                cache='', where=None, keep=1):
+    """
+    Extracts the header(s) of the single file <file>, see hdrExtract.
+    Returns the FitsHead instance, None if keep is 0 or 1 if the output
+    file could not be opened.
+    """
+    if xmlfl:
         oext = '.xml'
     else:
         oext = '.hdr'
 
-    if len(file_list) == 0:
-        return -1
-    for file in file_list:
-        (path, base) = os.path.split(file)
-        (fileb, ext) = os.path.splitext(base)
-        if path:
-            #last directory of orig-files will be used to order the
-            #extracted headers
+    (path, base) = os.path.split(file)
+    (fileb, ext) = os.path.splitext(base)
+    if path:
+        #last directory of orig-files will be used to order the
+        #extracted headers
 
-            night = os.path.split(path)[1]
-        else:
-            night = ''
+        night = os.path.split(path)[1]
+    else:
+        night = ''
 
-        pH = FitsHead(file, skey=skey, show=show, struct=struct,
-                      check=check, mode=mode)
-        pH.fd.close()
+    pH = FitsHead(file, skey=skey, show=show, struct=struct,
+                  check=check, mode=mode, cache=cache, where=where)
+    pH.close()
+    if where is not None and not pH.matchHeads(range(len(pH.HEAD))):
+        return pH if keep else None
 
-        if ext == '.Z' or ext == '.gz':
-            (file_id, ext) = os.path.splitext(fileb)
-        else:
-            file_id = fileb
+    if ext == '.Z' or ext == '.gz':
+        (file_id, ext) = os.path.splitext(fileb)
+    else:
+        file_id = fileb
 
-        if night:
-            if not os.path.isdir(night):
-                    os.mkdir(night)
-            ofnm = night + '/' + file_id + oext
-        else:
-            ofnm = file_id + oext
-        if xtract == 1:
-                #            print 'extracting header of file ',file,' to ',ofnm
-            o = open(ofnm, 'w')
-            o.write(pH.HEAD[0])
-            o.close()
-        elif xmlfl != '':
-                #            print 'extracting header of file ',file,' to ',ofnm
-            pH.parseFitsHead()
-            XmlHead = pH.xmlHead(format=xmlfl, head=show)
-
-            # if outfile is specified write the XML to it
-
-            if len(ofnm) > 0:
-                try:
-                    o = open(ofnm, 'w')
-                except:
-                    print("ERROR: Unable to open ", outfile)
-                    return 1
-
-                for xml in XmlHead:
-                    if type(xml) == type(''):
-                        o.write(xml + "\n")
-                    elif type(xml) == type([]):
-                        o.write('\n'.join(xml))
-                o.close()
+    if night:
+        if not os.path.isdir(night):
+            try:
+                os.mkdir(night)
+            except FileExistsError:   # created by another worker
+                pass
+        ofnm = night + '/' + file_id + oext
+    else:
+        ofnm = file_id + oext
+    if xtract == 1:
+            #            print 'extracting header of file ',file,' to ',ofnm
+        o = open(ofnm, 'wb')
+        pH.HEAD[0].write(o)
+        o.close()
+    elif xmlfl != '':
+            #            print 'extracting header of file ',file,' to ',ofnm
+        pH.parseFitsHead()
 
-        else:
-            pH.parseFitsHead()
+        # write the XML directly to the output file
 
-    fh = pH.Extension[0].Serialize()
+        try:
+            o = open(ofnm, 'wb')
+        except:
+            print("ERROR: Unable to open ", ofnm)
+            return 1
+        pH.writeXml(o, format=xmlfl, head=show)
+        o.close()
+
+    else:
+        pH.parseFitsHead()
 
+    if not keep:
+        return None
     return pH
 
 